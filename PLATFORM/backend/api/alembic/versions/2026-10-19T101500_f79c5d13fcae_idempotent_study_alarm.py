@@ -0,0 +1,44 @@
+"""idempotent study alarm
+
+Revision ID: f79c5d13fcae
+Revises: 3f3cf07179db
+Create Date: 2026-10-19 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f79c5d13fcae'
+down_revision = '3f3cf07179db'
+branch_labels = None
+depends_on = None
+
+
+UNIQUE_KEYS = (
+    ('study', 'uq_study_patient_ts',      ('patient_id', 'ts')),
+    ('alarm', 'uq_alarm_patient_type_ts', ('patient_id', 'alarm_type', 'ts')),
+)
+
+
+def upgrade():
+    for tbl_name, constraint_name, columns in UNIQUE_KEYS:
+        # Remove the duplicates created by device retries, keeping the first stored record
+        op.execute(f'''
+        DELETE FROM "{tbl_name}" dup
+        USING "{tbl_name}" orig
+        WHERE {' AND '.join(f'dup.{col} = orig.{col}' for col in columns)}
+          AND dup.id > orig.id
+        ''')
+
+        op.create_unique_constraint(constraint_name, tbl_name, list(columns))
+
+        # patient_id is the first column of the unique index, the single column index is redundant
+        op.drop_index(f'ix_{tbl_name}_patient_id', table_name=tbl_name)
+
+
+def downgrade():
+    for tbl_name, constraint_name, columns in UNIQUE_KEYS:
+        op.create_index(f'ix_{tbl_name}_patient_id', tbl_name, ['patient_id'])
+        op.drop_constraint(constraint_name, tbl_name, type_='unique')
@@ -0,0 +1,49 @@
+"""chat last message
+
+Revision ID: 66175df63063
+Revises: f79c5d13fcae
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '66175df63063'
+down_revision = 'f79c5d13fcae'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = (
+    ('last_message_id',            sa.INTEGER(),   'Last message, by ts and id'),
+    ('last_message_ts',            sa.TIMESTAMP(), 'Time when the last message was sent'),
+    ('user1_last_read_message_id', sa.INTEGER(),   'Last message read by user1'),
+    ('user2_last_read_message_id', sa.INTEGER(),   'Last message read by user2'),
+)
+
+
+def upgrade():
+    for col_name, col_type, comment in COLUMNS:
+        op.add_column('chat', sa.Column(col_name, col_type, nullable=True, comment=comment))
+
+    # The existing messages are considered read, otherwise every old chat would show as unread
+    op.execute('''
+    UPDATE chat
+    SET last_message_id            = last_msg.id,
+        last_message_ts            = last_msg.ts,
+        user1_last_read_message_id = last_msg.id,
+        user2_last_read_message_id = last_msg.id
+    FROM (
+        SELECT DISTINCT ON (chat_id) chat_id, id, ts
+        FROM message
+        ORDER BY chat_id, ts DESC, id DESC
+    ) last_msg
+    WHERE last_msg.chat_id = chat.id
+    ''')
+
+
+def downgrade():
+    for col_name, _, _ in reversed(COLUMNS):
+        op.drop_column('chat', col_name)
@@ -0,0 +1,35 @@
+"""message chat ts index
+
+Revision ID: b8e21d4c9a57
+Revises: 66175df63063
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e21d4c9a57'
+down_revision = '66175df63063'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built without locking the writes, the message table can be big
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_message_chat_id_ts_id',
+            'message',
+            ['chat_id', 'ts', 'id'],
+            postgresql_concurrently = True
+        )
+
+        # chat_id is the first column of the new index, the single column index is redundant
+        op.drop_index('ix_message_chat_id', table_name='message', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_message_chat_id', 'message', ['chat_id'], postgresql_concurrently=True)
+        op.drop_index('ix_message_chat_id_ts_id', table_name='message', postgresql_concurrently=True)
@@ -0,0 +1,67 @@
+"""search documents
+
+Revision ID: 5c0e9a41d27f
+Revises: b8e21d4c9a57
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e9a41d27f'
+down_revision = 'b8e21d4c9a57'
+branch_labels = None
+depends_on = None
+
+
+# Text searched by the 'fts' search arg, see bracelet_lib.models.search_document_column
+SEARCH_DOCUMENTS = (
+    ('user_account', "email || ' ' || first_name || ' ' || last_name || COALESCE(' ' || phone, '')"),
+    ('patient',      'code'),
+    ('pathology',    'name'),
+)
+
+
+def upgrade():
+    for table_name, expression in SEARCH_DOCUMENTS:
+        op.execute(
+            f'ALTER TABLE {table_name} '
+            f'ADD COLUMN search_document TEXT GENERATED ALWAYS AS (public.unaccent_text({expression})) STORED'
+        )
+
+    # Built without locking the writes
+    with op.get_context().autocommit_block():
+        for table_name, _ in SEARCH_DOCUMENTS:
+            op.create_index(
+                f'ix_{table_name}_search_document',
+                table_name,
+                [ sa.text('search_document gin_trgm_ops') ],
+                postgresql_using        = 'gin',
+                postgresql_concurrently = True
+            )
+
+        # Replaced by the index of the search_document column
+        op.drop_index('user_account_fts_gist_idx', table_name='user_account', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'user_account_fts_gist_idx',
+            'user_account',
+            [
+                sa.text(
+                    "public.unaccent_text("
+                    "(email || ' ' || first_name || ' ' ||  last_name || COALESCE(' ' ||  phone, ''))"
+                    ") gist_trgm_ops"
+                )
+            ],
+            postgresql_using        = 'gist',
+            postgresql_concurrently = True
+        )
+
+    for table_name, _ in reversed(SEARCH_DOCUMENTS):
+        # The index of the column is dropped with it
+        op.drop_column(table_name, 'search_document')
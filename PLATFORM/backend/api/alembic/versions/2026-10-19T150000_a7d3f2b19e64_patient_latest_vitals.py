@@ -0,0 +1,61 @@
+"""patient latest vitals
+
+Revision ID: a7d3f2b19e64
+Revises: 5c0e9a41d27f
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3f2b19e64'
+down_revision = '5c0e9a41d27f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'patient_latest_vitals',
+        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('study_id', sa.INTEGER(), nullable=True, comment="Latest study, by ts"),
+        sa.Column('step_count', sa.INTEGER(), nullable=True),
+        sa.Column('bpm', sa.INTEGER(), nullable=True),
+        sa.Column('spo2', sa.INTEGER(), nullable=True),
+        sa.Column('study_ts', sa.TIMESTAMP(), nullable=True),
+        sa.Column('last_alarm_id', sa.INTEGER(), nullable=True, comment="Latest alarm, by ts"),
+        sa.Column('last_alarm_type', sa.VARCHAR(64), nullable=True),
+        sa.Column('last_alarm_ts', sa.TIMESTAMP(), nullable=True),
+        sa.Column('last_alarm_is_urgent', sa.BOOLEAN(), nullable=True),
+        sa.Column('update_ts', sa.TIMESTAMP(), nullable=False, server_default=sa.text('now()')),
+        comment = "Latest study and alarm of each patient"
+    )
+
+    op.execute('''
+    INSERT INTO patient_latest_vitals (patient_id, study_id, step_count, bpm, spo2, study_ts)
+    SELECT DISTINCT ON (patient_id) patient_id, id, step_count, bpm, spo2, ts
+    FROM study
+    ORDER BY patient_id, ts DESC, id DESC
+    ''')
+
+    op.execute('''
+    INSERT INTO patient_latest_vitals (patient_id, last_alarm_id, last_alarm_type, last_alarm_ts, last_alarm_is_urgent)
+    SELECT DISTINCT ON (patient_id) patient_id, id, alarm_type, ts, is_urgent
+    FROM alarm
+    ORDER BY patient_id, ts DESC, id DESC
+    ON CONFLICT (patient_id) DO UPDATE
+    SET last_alarm_id        = excluded.last_alarm_id,
+        last_alarm_type      = excluded.last_alarm_type,
+        last_alarm_ts        = excluded.last_alarm_ts,
+        last_alarm_is_urgent = excluded.last_alarm_is_urgent
+    ''')
+
+    # The doctors' board filters the patients by owner
+    op.create_index('ix_patient_owner_user_id', 'patient', ['owner_user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_patient_owner_user_id', table_name='patient')
+    op.drop_table('patient_latest_vitals')
@@ -0,0 +1,42 @@
+"""study daily
+
+Revision ID: d41b6e8c05a3
+Revises: a7d3f2b19e64
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41b6e8c05a3'
+down_revision = 'a7d3f2b19e64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'study_daily',
+        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('day', sa.DATE(), primary_key=True),
+        sa.Column('count', sa.INTEGER(), nullable=False, comment="Studies of the day"),
+        sa.Column('first_ts', sa.TIMESTAMP(), nullable=False),
+        sa.Column('last_ts', sa.TIMESTAMP(), nullable=False),
+        sa.Column('last_step_count', sa.INTEGER(), nullable=False, comment="Steps of the day, they are cumulative"),
+        sa.Column('bpm_min', sa.INTEGER(), nullable=False),
+        sa.Column('bpm_max', sa.INTEGER(), nullable=False),
+        sa.Column('bpm_sum', sa.BIGINT(), nullable=False),
+        sa.Column('spo2_min', sa.INTEGER(), nullable=True),
+        sa.Column('spo2_max', sa.INTEGER(), nullable=True),
+        sa.Column('spo2_sum', sa.BIGINT(), nullable=False, server_default=sa.text('0')),
+        sa.Column('spo2_count', sa.INTEGER(), nullable=False, server_default=sa.text('0')),
+        sa.Column('create_ts', sa.TIMESTAMP(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('update_ts', sa.TIMESTAMP(), nullable=False, server_default=sa.text('now()')),
+        comment = "Daily rollup of the archived studies"
+    )
+
+
+def downgrade():
+    op.drop_table('study_daily')
@@ -1,17 +1,21 @@
+from decimal import Decimal
 from enum import Enum
 
+import orjson
 import pydantic
 import sqlalchemy as sa
 from typing import Union, Sequence, Type, Any, Dict, List, Optional, Callable
 from starlette.requests import Request
+from starlette.responses import Response
 from cache import AsyncLRU
 
-from bracelet_lib.models.base_model import TBaseModel
+from bracelet_lib.models.base_model import TBaseModel, BaseModel, TbraceletModel
 from bracelet_lib.models.query_builder import QueryBuilder, URLPaginatedHelper
 from bracelet_lib.controllers.base_ctrl import TbraceletCtrl
 from bracelet_lib.controllers.users import UserAccountCtrl, PermissionCtrl
 
 from lib import config, exceptions
+from lib.http_cache import http_cache as response_cache
 from walkers.fields import create_embed_fields_maps
 from walkers.search import create_db_search_where, create_db_search_into_rel_entities
 from walkers.sort import create_sort_map
@@ -66,6 +70,47 @@ async def _get_permission_rec(user_id, user_role, ctrl, perm_type) -> Optional[P
         return permission_rec[perm_type.value]
 
 
+def _orjson_default(o):
+    if isinstance(o, BaseModel):  # Embedded records
+        return o.dict()
+
+    elif isinstance(o, Decimal):  # Same as pydantic
+        return float(o)
+
+    raise TypeError(f'Type is not JSON serializable: {type(o).__name__}')
+
+
+def _is_trusted(model: Type[TbraceletModel], embed_map: Dict) -> bool:
+    """
+    Records can be serialized directly only if the model and all the embedded ones are trusted
+    """
+    if not model.TrustedSerialization:
+        return False
+
+    relations = model.get_relations()
+    for rel_name, rel_embed_map in embed_map.items():
+        rel = relations.get(rel_name)  # Dynamic relations are not checked, so they are never trusted
+        if rel is None or rel.model is None:
+            return False
+
+        if not _is_trusted(rel.model, rel_embed_map if isinstance(rel_embed_map, dict) else {}):
+            return False
+
+    return True
+
+
+async def _invalidate_response_cache(ctrl: Type[TbraceletCtrl]) -> None:
+    """
+    Only the entities served with http_cache (ResponseCached) have cached responses to invalidate
+    """
+    if ctrl.Model.ResponseCached:
+        await response_cache.invalidate(ctrl.Model.Table)
+
+
+def _trusted_response(content: Any) -> Response:
+    return Response(content=orjson.dumps(content, default=_orjson_default), media_type='application/json')
+
+
 class braceletCtrlProxy:
 
     @classmethod
@@ -113,8 +158,20 @@ class braceletCtrlProxy:
             embed          : str = None,
             auth_user_info      : Optional[Dict[str, Union[str, int]]] = None,
             extra_args          : Dict[str, Any] = {},
-            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {},
+            request             : Optional[Request] = None,
+            http_cache          : bool = False,
+            http_cache_vary     : str  = '',
+            trusted             : bool = False
     ):
+        """
+        :param http_cache: if True (request is needed) the response is cached and revalidated with ETags, only
+                           for near-static entities (ResponseCached models, ignored for the rest), embeds are not
+                           allowed because their changes are not tracked
+        :param http_cache_vary: anything else changing the response, the user is already included
+        :param trusted: if True and the model allows it (TrustedSerialization) the record is serialized directly
+                        into a Response skipping pydantic, only for routes returning the proxy result as is
+        """
         fields_embed_data = create_embed_fields_maps( fields, embed, relation_fields=ctrl.Model.get_relation_fields() )
 
         if auth_user_info:
@@ -126,6 +183,21 @@ class braceletCtrlProxy:
                 record_id = id
             )
 
+        if http_cache and not embed and ctrl.Model.ResponseCached:
+            return await response_cache.respond(
+                ctrl.Model.Table,
+                request,
+                compute = lambda: braceletCtrlProxy.get(
+                    ctrl,
+                    id,
+                    fields              = fields,
+                    extra_args          = extra_args,
+                    dynamic_rel_context = dynamic_rel_context,
+                    trusted             = trusted
+                ),
+                vary    = f"{auth_user_info.get('user_id') if auth_user_info else ''}|{http_cache_vary}"
+            )
+
         record = await ctrl.get(
             id,
             fields_map          = fields_embed_data['fields'],
@@ -134,6 +206,9 @@ class braceletCtrlProxy:
             dynamic_rel_context = dynamic_rel_context
         )
 
+        if record and trusted and _is_trusted(ctrl.Model, fields_embed_data['embed']):
+            return _trusted_response( record.dict() )
+
         if record:
             record = ctrl.Model.FullValidator.from_model(record)
 
@@ -156,8 +231,19 @@ class braceletCtrlProxy:
             max_limit           : int             = None,  # This is used by some special entities that need longer page size
             auth_user_info      : Optional[Dict[str, Union[str, int]]] = None,
             extra_args          : Dict[str, Any]  = {},
-            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {},
+            http_cache          : bool            = False,
+            http_cache_vary     : str             = '',
+            trusted             : bool            = False
     ):
+        """
+        :param http_cache: if True the response is cached and revalidated with ETags, only for near-static
+                           entities (ResponseCached models, ignored for the rest), embeds are not allowed because
+                           their changes are not tracked
+        :param http_cache_vary: anything else changing the response, the user is already included
+        :param trusted: if True and the models allow it (TrustedSerialization) the records are serialized directly
+                        into a Response skipping pydantic, only for routes returning the proxy result as is
+        """
         max_page_size = config.settings.pag_max_size if max_limit is None else max_limit
         limit         = min( limit or config.settings.pag_default_size, max_page_size )
 
@@ -169,6 +255,29 @@ class braceletCtrlProxy:
                 user_role = auth_user_info['user_role']
             )
 
+        if http_cache and not embed and ctrl.Model.ResponseCached:
+            return await response_cache.respond(
+                ctrl.Model.Table,
+                request,
+                compute = lambda: braceletCtrlProxy.search(
+                    ctrl,
+                    request,
+                    builder             = builder,
+                    q                   = q,
+                    limit               = limit,
+                    offset              = offset,
+                    sort_by             = sort_by,
+                    fields              = fields,
+                    pq                  = pq,
+                    from_prev           = from_prev,
+                    max_limit           = max_limit,
+                    extra_args          = extra_args,
+                    dynamic_rel_context = dynamic_rel_context,
+                    trusted             = trusted
+                ),
+                vary    = f"{auth_user_info.get('user_id') if auth_user_info else ''}|{http_cache_vary}"
+            )
+
         if not builder:
             builder = QueryBuilder(ctrl.Model)
 
@@ -227,6 +336,13 @@ class braceletCtrlProxy:
             from_prev
         )
 
+        if trusted and _is_trusted(ctrl.Model, fields_embed_data['embed']):
+            # Unset pagination links are excluded as response_model_exclude_unset does
+            return _trusted_response({
+                'items' : [ o.dict() for o in records ],
+                **{ key: value for key, value in pag_links.items() if value is not None }
+            })
+
         serial_records = ( o.dict() for o in records )
 
         return ctrl.Model.SearchValidator(items=serial_records, **pag_links)
@@ -262,6 +378,7 @@ class braceletCtrlProxy:
             extra_args = extra_args,
             dynamic_rel_context = dynamic_rel_context
         )
+        await _invalidate_response_cache(ctrl)
 
         if record:
             record = ctrl.Model.FullValidator.from_model(record)
@@ -300,6 +417,7 @@ class braceletCtrlProxy:
             extra_args          = extra_args,
             dynamic_rel_context = dynamic_rel_context
         )
+        await _invalidate_response_cache(ctrl)
 
         if record:
             record = ctrl.Model.FullValidator.from_model(record)
@@ -338,6 +456,7 @@ class braceletCtrlProxy:
             extra_args          = extra_args,
             dynamic_rel_context = dynamic_rel_context
         )
+        await _invalidate_response_cache(ctrl)
 
         if record:
             record = ctrl.Model.FullValidator.from_model(record)
@@ -363,6 +482,7 @@ class braceletCtrlProxy:
             )
 
         await ctrl.delete(id, extra_args=extra_args)
+        await _invalidate_response_cache(ctrl)
 
     # noinspection PyDefaultArgument
     @staticmethod
@@ -23,7 +23,8 @@ class OauthCtrl:
             username      : str = None,
             password      : str = None,
             scope         : str = None,
-            refresh_token : str = None
+            refresh_token : str = None,
+            client_ip     : str = None
     ) -> Dict:
         current_refresh_token_redis = None
         token_expiry_ts             = None
@@ -31,7 +32,7 @@ class OauthCtrl:
 
         if username and password:
             if scope == ScopeEnum.full:
-                user_login = await UserAccountCtrl.get_user_login(username, password)
+                user_login = await UserAccountCtrl.get_user_login(username, password, client_ip=client_ip)
 
                 if not user_login:
                     raise exceptions.AuthException()
@@ -1,6 +1,10 @@
 import jwt
-import functools
+import time
 import typing
+import hashlib
+import logging
+
+from collections import OrderedDict
 
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer, HTTPBasic, HTTPBasicCredentials
@@ -11,6 +15,58 @@ from lib import config, exceptions
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/v1/oauth/token", auto_error=False)
 basic_scheme  = HTTPBasic(auto_error=False)
 
+logger = logging.getLogger('api.auth')
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU holding the payloads of already verified JWTs, so the signature is only checked once per token.
+
+    Entries are keyed by the token hash (raw tokens are never kept in memory) and are dropped as soon as the
+    token reaches its 'exp' claim, so an expired token always goes through jwt.decode again.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries : typing.OrderedDict[bytes, typing.Tuple[float, typing.Dict]] = OrderedDict()
+
+    @staticmethod
+    def _get_key(token: str) -> bytes:
+        return hashlib.sha256( token.encode() ).digest()
+
+    def get(self, token: str) -> typing.Optional[typing.Dict[str, typing.Union[str, int]]]:
+        key   = self._get_key(token)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        expiry_ts, user_info = entry
+        if expiry_ts <= time.time():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+
+        return dict(user_info)  # Copy, the callers are free to modify the returned dict
+
+    def set(self, token: str, expiry_ts: float, user_info: typing.Dict[str, typing.Union[str, int]]) -> None:
+        if self.max_size <= 0:
+            return
+
+        key = self._get_key(token)
+        self._entries[key] = (expiry_ts, dict(user_info))
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+verified_token_cache = VerifiedTokenCache(max_size=config.settings.jwt_verify_cache_size)
+
 
 async def check_user_authenticated( token: str = Depends(oauth2_scheme) ) -> typing.Dict[str, typing.Union[str, int]]:
     """
@@ -18,47 +74,63 @@ async def check_user_authenticated( token: str = Depends(oauth2_scheme) ) -> typ
     :param token: the JWT token, this will be decoded and check for validity
     :return: user_id of the decoded token
     """
-    print(f"DEBUG AUTH: check_user_authenticated called")
-    print(f"DEBUG AUTH: token present: {token is not None}")
-    print(f"DEBUG AUTH: token length: {len(token) if token else 0}")
-    
     if token is None:
-        print(f"DEBUG AUTH: No token present - raising AuthException")
+        logger.debug('Token not present')
         raise exceptions.AuthException( msg='Token not present' )
 
+    return decode_user_token(token)
+
+
+def decode_user_token(token: str) -> typing.Dict[str, typing.Union[str, int]]:
+    """
+    Verify a JWT token, used directly where the token doesn't come in the Authorization header (websockets)
+    :raises exceptions.AuthException: if the token is not valid
+    :return: user_id and user_role of the decoded token
+    """
+    user_info = verified_token_cache.get(token)
+    if user_info is not None:
+        return user_info
+
     try:
-        payload   = jwt.decode(token, config.settings.jwt_secret_key, algorithms=[config.settings.jwt_algorithm])
-        user_id   = payload.get("sub")
-        user_role = payload.get("role")
-        
-        print(f"DEBUG AUTH: Token decoded successfully")
-        print(f"DEBUG AUTH: user_id: {user_id}, user_role: {user_role}")
-
-        if not user_id or not user_role:
-            print(f"DEBUG AUTH: Invalid token payload - missing user_id or user_role")
-            raise exceptions.AuthException( msg='Invalid token' )
-        
-        print(f"DEBUG AUTH: Authentication successful for user {user_id} with role {user_role}")
-        return {
-            'user_id'   : int(user_id),
-            'user_role' : user_role
-        }
-    
+        payload = jwt.decode(token, config.settings.jwt_secret_key, algorithms=[config.settings.jwt_algorithm])
+
     except jwt.ExpiredSignatureError:
-        print(f"DEBUG AUTH: Token expired")
+        logger.debug('Token expired')
         raise exceptions.AuthException( msg='Token expired' )
     except jwt.InvalidTokenError as e:
-        print(f"DEBUG AUTH: Invalid token: {e}")
+        logger.info(f'Invalid token: {e}')
         raise exceptions.AuthException( msg='Invalid token' )
     except Exception as e:
-        print(f"DEBUG AUTH: Unexpected error: {e}")
+        logger.warning(f'Unexpected error decoding token: {e}')
         raise exceptions.AuthException( msg='Authentication failed' )
 
-    return {
-        'user_id'   : int(user_id),
+    user_id   = payload.get("sub")
+    user_role = payload.get("role")
+
+    if not user_id or not user_role:
+        logger.info('Invalid token payload, missing sub or role')
+        raise exceptions.AuthException( msg='Invalid token' )
+
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        logger.info(f'Invalid token payload, sub is not a user id: {user_id!r}')
+        raise exceptions.AuthException( msg='Invalid token' )
+
+    user_info = {
+        'user_id'   : user_id,
         'user_role' : user_role
     }
 
+    # Tokens without expiration are not cached, we can't know when to drop them
+    expiry_ts = payload.get('exp')
+    if expiry_ts is not None:
+        verified_token_cache.set(token, float(expiry_ts), user_info)
+
+    logger.debug(f'Authentication successful for user {user_id} with role {user_role}')
+
+    return user_info
+
 
 async def check_client_authenticated(
         credentials : HTTPBasicCredentials = Depends(basic_scheme)
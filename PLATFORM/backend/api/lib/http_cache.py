@@ -0,0 +1,118 @@
+import hashlib
+import typing
+
+import orjson
+import sqlalchemy as sa
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response
+
+from bracelet_lib.cache import cache
+from bracelet_lib.models import database_manager
+
+
+class HTTPResponseCache:
+    """
+    Response cache for GETs of near-static entities, using strong ETags.
+
+    The ETag of a response is calculated from the entity watermark, the requested URL and the user, the watermark
+    combines a version bumped by every write done through braceletCtrlProxy with max(update_ts) and count(*) of
+    the table, cached in Redis for a short time, so writes done by other ways (seed, migrations, SQL) are noticed too.
+
+    A request with a matching If-None-Match gets a 304 without touching the DB, otherwise the serialized body
+    is served from Redis if available, only the misses reach the controller and pydantic
+    """
+
+    # noinspection PyTypeChecker
+    def __init__(self):
+        self.watermark_ttl : int = None
+        self.body_ttl      : int = None
+
+        self.init()
+
+    def init(self, watermark_ttl: int = 60, body_ttl: int = 3600):
+        """
+        :param watermark_ttl: seconds the DB watermark is cached, max delay to notice writes done outside the API
+        :param body_ttl: seconds the serialized responses are kept in Redis
+        """
+        self.watermark_ttl = watermark_ttl
+        self.body_ttl      = body_ttl
+
+    @staticmethod
+    def _get_keys(table: sa.Table) -> typing.Tuple[str, str]:
+        return f'http-version-{table.name}', f'http-watermark-{table.name}'
+
+    async def get_watermark(self, table: sa.Table) -> str:
+        version_key, watermark_key = self._get_keys(table)
+        version, watermark         = await cache.mget([version_key, watermark_key])
+
+        if watermark is None:
+            columns = [sa.func.count()]
+            if 'update_ts' in table.c:
+                columns.append( sa.func.max(table.c.update_ts) )
+
+            row       = await database_manager.get_db_conn().fetch_one( sa.select(columns).select_from(table) )
+            watermark = '-'.join( str(value) for value in row.values() ).encode()
+
+            await cache.set(watermark_key, watermark, ttl=self.watermark_ttl)
+
+        return f"{(version or b'0').decode()}-{watermark.decode()}"
+
+    async def invalidate(self, table: sa.Table) -> None:
+        version_key, watermark_key = self._get_keys(table)
+
+        async with cache.pipeline() as pipe:
+            pipe.incr(version_key)
+            pipe.delete(watermark_key)
+
+    @staticmethod
+    def _matches(request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get('if-none-match')
+        if not if_none_match:
+            return False
+
+        return if_none_match.strip() == '*' or etag in ( tag.strip() for tag in if_none_match.split(',') )
+
+    async def respond(
+            self,
+            table   : sa.Table,
+            request : Request,
+            compute : typing.Callable[[], typing.Awaitable[typing.Any]],
+            vary    : str = ''
+    ) -> Response:
+        """
+        :param table: main table of the entity, its watermark invalidates the response
+        :param request: used to get the URL and the If-None-Match header
+        :param compute: coroutine function building the response model on cache misses
+        :param vary: anything else changing the response, ex: the user
+        """
+        watermark = await self.get_watermark(table)
+        etag_hash = hashlib.sha1( f'{watermark}|{request.url.path}?{request.url.query}|{vary}'.encode() )
+        etag      = f'"{etag_hash.hexdigest()}"'
+        headers   = {
+            'ETag'          : etag,
+            'Cache-Control' : 'private, no-cache'  # Always revalidate
+        }
+
+        if self._matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        body_key = f'http-body-{etag_hash.hexdigest()}'
+        body     = await cache.get(body_key)
+
+        if body is None:
+            result = await compute()
+            if isinstance(result, Response):  # Already serialized, trusted records
+                body = result.body
+            else:
+                # Same serialization FastAPI applies to routes with response_model_exclude_unset
+                body = orjson.dumps( jsonable_encoder(result, by_alias=True, exclude_unset=True) )
+
+            await cache.set(body_key, body, ttl=self.body_ttl)
+
+        return Response(content=body, media_type='application/json', headers=headers)
+
+
+# singleton
+http_cache = HTTPResponseCache()
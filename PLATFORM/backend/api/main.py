@@ -2,6 +2,7 @@ import asyncio
 import logging
 import os
 import json
+import math
 import traceback
 
 import jwt.exceptions
@@ -16,8 +17,8 @@ from fastapi.security import OAuth2PasswordBearer
 from starlette.types import Message
 from typing import Optional
 
-from bracelet_lib.controllers import passwords, email, storage
-from lib import config, exceptions as api_exceptions, logs
+from bracelet_lib.controllers import passwords, password_hash, email, storage, chat_events, retention
+from lib import config, exceptions as api_exceptions, logs, http_cache
 from bracelet_lib import exceptions
 from bracelet_lib import models, cache
 from bracelet_lib.exceptions.sentry import sentry_logger
@@ -85,6 +86,11 @@ async def http_exception(request: Optional[Request], exc) -> ORJSONResponse:
         status_code    = 422
         response_data  = exc.get_data()
 
+    elif exc_type == exceptions.TooManyRequestsError:
+        status_code   = 429
+        response_data = exc.get_data()
+        headers       = { 'Retry-After' : str(math.ceil(exc.retry_after)) }
+
     elif exc_type == exceptions.NotFoundError:
         status_code   = 404
         response_data = None
@@ -204,7 +210,18 @@ async def startup():
     await models.database_manager.open()
 
     # Init redis connection
-    await cache.cache.init(redis_url=config.settings.redis_url)
+    await cache.cache.init(
+        redis_url      = config.settings.redis_url,
+        local_prefixes = config.settings.cache_local_prefixes,
+        local_max_size = config.settings.cache_local_max_size,
+        local_ttl      = config.settings.cache_local_ttl_seconds
+    )
+
+    # Configure HTTP response cache
+    http_cache.http_cache.init(
+        watermark_ttl = config.settings.http_cache_watermark_ttl_seconds,
+        body_ttl      = config.settings.http_cache_body_ttl_seconds
+    )
 
     main_api_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -218,8 +235,14 @@ async def startup():
         email_password       = config.settings.email_password,
         email_enable_ssl     = config.settings.email_enable_ssl,
         email_enable_tls     = config.settings.email_enable_tls,
-        email_template_dir   = f'{main_api_dir}/templates'
+        email_template_dir   = f'{main_api_dir}/templates',
+        queue_batch_size     = config.settings.email_queue_batch_size,
+        queue_max_attempts   = config.settings.email_queue_max_attempts,
+        queue_retry_seconds  = config.settings.email_queue_retry_seconds,
+        smtp_idle_seconds    = config.settings.email_smtp_idle_seconds
     )
+    if config.settings.email_queue_worker:
+        email.email_ctrl.start_queue_worker()
 
     # Configure storage controller
     storage.blob_storage_ctrl.init(
@@ -227,8 +250,29 @@ async def startup():
         s3_secret_access_key = config.settings.s3_secret_access_key,
         s3_region            = config.settings.s3_region,
         s3_bucket            = config.settings.s3_bucket,
-        s3_ttl               = config.settings.s3_ttl
+        s3_ttl               = config.settings.s3_ttl,
+        s3_endpoint_url      = config.settings.s3_endpoint_url,
+        url_cache_size       = config.settings.s3_url_cache_size,
+        url_cache_margin     = config.settings.s3_url_cache_margin
+    )
+    storage.blob_storage_ctrl.start_stale_uploads_cleanup(
+        interval_minutes = config.settings.s3_stale_upload_cleanup_minutes,
+        max_age_hours    = config.settings.s3_stale_upload_hours
+    )
+
+    # Configure the archival of the old studies, alarms and messages
+    retention.retention_ctrl.init(
+        study_days     = config.settings.retention_study_days,
+        alarm_days     = config.settings.retention_alarm_days,
+        message_days   = config.settings.retention_message_days,
+        batch_size     = config.settings.retention_batch_size,
+        archive_prefix = config.settings.retention_archive_prefix
     )
+    retention.retention_ctrl.start( interval_minutes=config.settings.retention_interval_minutes )
+
+    # Configure chat events fan-out, one Redis subscription per worker
+    chat_events.chat_events_hub.init( queue_size=config.settings.chat_ws_queue_size )
+    chat_events.chat_events_hub.start()
 
     # Configure password controller
     passwords.password_ctrl.init(
@@ -238,12 +282,22 @@ async def startup():
         jwt_refresh_token_expire_minutes    = config.settings.jwt_refresh_token_expire_minutes,
         login_max_attempts_until_block      = config.settings.login_max_attempts_until_block,
         login_attempts_ttl_minutes          = config.settings.login_attempts_ttl_minutes,
+        login_max_attempts_per_ip           = config.settings.login_max_attempts_per_ip,
+        login_backoff_step_ms               = config.settings.login_backoff_step_ms,
+        login_backoff_max_ms                = config.settings.login_backoff_max_ms,
         account_block_duration_hours        = config.settings.account_block_duration_hours,
         new_account_token_expire_minutes    = config.settings.new_account_token_expire_minutes,
         unlock_account_token_expire_minutes = config.settings.unlock_account_token_expire_minutes,
         reset_password_token_expire_minutes = config.settings.reset_password_token_expire_minutes
     )
 
+    # Configure password hashing
+    password_hash.password_hash_ctrl.init(
+        algorithm       = config.settings.password_hash_algorithm,
+        max_workers     = config.settings.password_hash_workers,
+        max_concurrency = config.settings.password_hash_max_concurrency
+    )
+
     # Configure sentry logger
     sentry_logger.init(
         sentry_dsn  = config.settings.sentry_dsn,
@@ -255,9 +309,21 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown():
+    # Before closing the database, a running batch is rolled back
+    await retention.retention_ctrl.close()
+
     # noinspection PyUnresolvedReferences
     await models.database_manager.close()
 
+    local_cache_stats = cache.cache.get_local_stats()
+    if local_cache_stats:
+        logger.info(f'Local cache stats: {orjson.dumps(local_cache_stats).decode()}')
+
+    await storage.blob_storage_ctrl.close()
+    await email.email_ctrl.close()
+    await chat_events.chat_events_hub.close()
+    await cache.cache.close()
+
 
 @app.middleware("http")
 async def logs_interceptor(request: Request, call_next):
@@ -43,7 +43,7 @@ async def search_alarms(
         'ts_from': ts_from,
         'ts_to': ts_to
     }
-    return await braceletCtrlProxy.search(AlarmCtrl, request, **options)
+    return await braceletCtrlProxy.search(AlarmCtrl, request, trusted=True, **options)
 
 @router.get(
     '/alarms/{alarm_id}',
@@ -60,7 +60,7 @@ async def get_alarm(
         auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
 ):
     options = {'auth_user_info': auth_user_info}
-    return await braceletCtrlProxy.get(AlarmCtrl, alarm_id, fields.fields, **options)
+    return await braceletCtrlProxy.get(AlarmCtrl, alarm_id, fields.fields, trusted=True, **options)
 
 @router.post(
     '/alarms',
@@ -1,23 +1,30 @@
+import asyncio
+import logging
+
+import orjson
+
 from typing import Dict, Union, List, Optional
-from fastapi import APIRouter, Depends, Path, HTTPException
-from pydantic import BaseModel, EmailStr
+from fastapi import APIRouter, Depends, Path, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, EmailStr, Field, ValidationError
 from starlette.requests import Request
-from starlette.status import HTTP_201_CREATED
+from starlette.status import HTTP_201_CREATED, WS_1008_POLICY_VIOLATION, WS_1013_TRY_AGAIN_LATER
 
 from fastapi import Query
 from collections import OrderedDict
 
-from lib import auth
+from lib import auth, exceptions as api_exceptions
 from routes.common import BasicQueryParams, HTTPResponses
 from controllers.bracelet_ctrl_proxy import braceletCtrlProxy
+from bracelet_lib.controllers.chat_events import chat_events_hub, ChatEventType, ChatSubscription
 from bracelet_lib.controllers.chats import ChatCtrl
 from bracelet_lib.controllers.users import UserAccountCtrl
-from bracelet_lib.controllers.message import MessageCtrl
 from bracelet_lib.models.chats import Chat
 from bracelet_lib.models.users import UserAccount
 
 router = APIRouter()
 
+logger = logging.getLogger('api.chats')
+
 class ChatSummary(BaseModel):
     chat_id          : int
     other_user_id    : int
@@ -25,6 +32,8 @@ class ChatSummary(BaseModel):
     other_last_name  : str
     last_message     : Optional[str]
     last_message_ts  : Optional[str]
+    last_message_id  : Optional[int]
+    unread           : bool = False
 
 class ChatSummaryList(BaseModel):
     items    : List[ChatSummary]
@@ -44,6 +53,8 @@ class ChatSummaryAnonymous(BaseModel):
     administration   : bool
     last_message     : Optional[str]
     last_message_ts  : Optional[str]
+    last_message_id  : Optional[int]
+    unread           : bool = False
 
 class ChatSummaryAnonymousList(BaseModel):
     items    : List[ChatSummaryAnonymous]
@@ -51,6 +62,16 @@ class ChatSummaryAnonymousList(BaseModel):
     next     : Optional[str]
     previous : Optional[str]
 
+class ChatRead(BaseModel):
+    message_id : int = Field(..., ge=1, description='Last message read by the user')
+
+class ChatReadResponse(BaseModel):
+    last_read_message_id : Optional[int]
+
+class ChatClientEvent(BaseModel):
+    type       : ChatEventType
+    message_id : Optional[int] = None  # Last message read, only for read events
+
 @router.get(
     '/chats/summary',
     response_model               = ChatSummaryList,
@@ -91,10 +112,10 @@ async def summary_chats_me(
             direction = direction.strip()
             
             # Campos que existen en el modelo Chat
-            if field in ['id', 'user1_id', 'user2_id', 'create_ts', 'update_ts']:
+            if field in ['id', 'user1_id', 'user2_id', 'create_ts', 'update_ts', 'last_message_ts']:
                 chat_sorts.append(f"{field}:{direction}")
             # Campos que necesitamos manejar a nivel ChatSummary
-            elif field in ['other_first_name', 'other_last_name', 'last_message', 'last_message_ts']:
+            elif field in ['other_first_name', 'other_last_name', 'last_message']:
                 summary_level_sort.append((field, direction.lower()))
         
         # Solo pasamos ordenamientos válidos al nivel de Chat
@@ -124,6 +145,8 @@ async def summary_chats_me(
     # 7) Mapeamos cada Chat a ChatSummary
     summaries: List[ChatSummary] = []
     fts_lower = fts.lower() if fts else None
+    # Últimos mensajes de la página con una sola consulta (last_message_id desnormalizado en chat)
+    last_messages = await ChatCtrl.get_last_messages(search_data.items)
     for chat in search_data.items:
         other_id = chat.user2_id if chat.user1_id == auth_user_info['user_id'] else chat.user1_id
         user = await braceletCtrlProxy.get(
@@ -131,14 +154,7 @@ async def summary_chats_me(
             other_id,
             auth_user_info = auth_user_info
         )
-        messages, _ = await MessageCtrl.search(
-            extra_args         = {'chat_id': chat.id},
-            sort_map           = {'ts': 'desc'},  # Ordenar por timestamp descendente
-            reverse_query_sort = False,
-            limit              = 1,
-            offset             = 0
-        )
-        last_msg = messages[0] if messages else None  # Tomar el primer elemento que ahora es el más reciente
+        last_msg = last_messages.get(chat.id)
 
         # Filtrado por fts (full text search) en nombre o apellido del otro usuario
         if fts_lower:
@@ -153,7 +169,9 @@ async def summary_chats_me(
             other_first_name = user.first_name,
             other_last_name  = user.last_name,
             last_message     = last_msg.content if last_msg else None,
-            last_message_ts  = last_msg.ts.isoformat() if last_msg else None
+            last_message_ts  = last_msg.ts.isoformat() if last_msg else None,
+            last_message_id  = chat.last_message_id,
+            unread           = ChatCtrl.has_unread(chat, auth_user_info['user_id'])
         ))
 
     # 8) Aplicamos ordenamiento a nivel de ChatSummary si es necesario
@@ -168,8 +186,6 @@ async def summary_chats_me(
                 summaries.sort(key=lambda s: (s.other_last_name or '').lower(), reverse=reverse)
             elif field == 'last_message':
                 summaries.sort(key=lambda s: (s.last_message or '').lower(), reverse=reverse)
-            elif field == 'last_message_ts':
-                summaries.sort(key=lambda s: s.last_message_ts or '', reverse=reverse)
 
     # 9) Sustituimos los items y devolvemos
     search_data.items = summaries  # type: ignore
@@ -331,7 +347,7 @@ async def summary_chats_anonymous(
     original_sort_by = options.get('sort_by')
     if original_sort_by:
         # Filtrar solo campos válidos para este endpoint
-        valid_fields = ['id', 'create_ts', 'update_ts', 'administration']
+        valid_fields = ['id', 'create_ts', 'update_ts', 'administration', 'last_message_ts']
         sort_parts = [part.strip() for part in original_sort_by.split(',') if part.strip()]
         valid_sorts = []
         
@@ -353,23 +369,19 @@ async def summary_chats_anonymous(
 
         # 6) Mapeamos cada Chat a ChatSummaryAnonymous (sin información de usuarios)
         summaries: List[ChatSummaryAnonymous] = []
+        last_messages = await ChatCtrl.get_last_messages(search_data.items)
         
         for chat in search_data.items:
             # Obtener el último mensaje sin necesidad de información del otro usuario
-            messages, _ = await MessageCtrl.search(
-                extra_args         = {'chat_id': chat.id},
-                sort_map           = {'ts': 'desc'},
-                reverse_query_sort = False,
-                limit              = 1,
-                offset             = 0
-            )
-            last_msg = messages[0] if messages else None
+            last_msg = last_messages.get(chat.id)
 
             summaries.append(ChatSummaryAnonymous(
                 chat_id          = chat.id,
                 administration   = chat.administration or False,  # Usar el campo booleano que acabamos de crear
                 last_message     = last_msg.content if last_msg else None,
-                last_message_ts  = last_msg.ts.isoformat() if last_msg else None
+                last_message_ts  = last_msg.ts.isoformat() if last_msg else None,
+                last_message_id  = chat.last_message_id,
+                unread           = ChatCtrl.has_unread(chat, auth_user_info['user_id'])
             ))
 
         # 7) Sustituimos los items y devolvemos
@@ -385,3 +397,113 @@ async def summary_chats_anonymous(
             next=None,
             previous=None
         )
+
+
+@router.put(
+    '/chats/{chat_id}/read',
+    response_model = ChatReadResponse,
+    summary        = 'Marcar chat como leído',
+    description    = 'Avanza el último mensaje leído por el usuario autenticado, nunca retrocede',
+    responses      = {**HTTPResponses.put}
+)
+async def mark_chat_read(
+    chat_read      : ChatRead,
+    chat_id        : int                        = Path(..., ge=1),
+    auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    last_read_id = await ChatCtrl.mark_read(chat_id, auth_user_info['user_id'], chat_read.message_id)
+
+    # Sólo los participantes tienen último mensaje leído
+    if last_read_id is None and not await ChatCtrl.is_participant(chat_id, auth_user_info['user_id']):
+        raise HTTPException(403, detail="No participas en este chat")
+
+    return ChatReadResponse(last_read_message_id=last_read_id)
+
+
+async def _receive_chat_events(websocket: WebSocket, chat_id: int, user_id: int):
+    """
+    Typing and read receipts sent by the client, they are published to the other websockets of the chat
+    """
+    while True:
+        raw = await websocket.receive_text()
+
+        try:
+            event = ChatClientEvent.parse_raw(raw)
+            if event.type == ChatEventType.message:
+                raise ValueError('Messages must be created using POST /messages')
+            if event.type == ChatEventType.read and event.message_id is None:
+                raise ValueError('message_id is required in read events')
+        except (ValidationError, ValueError) as e:
+            await websocket.send_text( orjson.dumps({'type': 'error', 'detail': str(e)}).decode() )
+            continue
+
+        if event.type == ChatEventType.read:
+            await ChatCtrl.mark_read(chat_id, user_id, event.message_id)  # It notifies the read event
+        else:
+            await chat_events_hub.publish(chat_id, event.type, { 'user_id': user_id })
+
+
+async def _send_chat_events(websocket: WebSocket, subscription: ChatSubscription, user_id: int):
+    while True:
+        event = await subscription.get()
+
+        if event is None:  # Events were lost, the client has to reconnect and reload the messages
+            await websocket.close(code=WS_1013_TRY_AGAIN_LATER)
+            return
+
+        # The own typing and read events are not sent back
+        if event['type'] != ChatEventType.message and event.get('user_id') == user_id:
+            continue
+
+        await websocket.send_text( orjson.dumps(event).decode() )
+
+
+@router.websocket('/chats/{chat_id}/ws')
+async def chat_websocket(
+    websocket : WebSocket,
+    chat_id   : int           = Path(..., ge=1),
+    token     : Optional[str] = Query(None, description='JWT access token, browsers can not set the Authorization header')
+):
+    """
+    Eventos del chat en tiempo real: mensajes nuevos, escribiendo y confirmaciones de lectura
+    """
+    if token is None:
+        scheme, _, header_token = websocket.headers.get('authorization', '').partition(' ')
+        token = header_token if scheme.lower() == 'bearer' else None
+
+    try:
+        if token is None:
+            raise api_exceptions.AuthException( msg='Token not present' )
+
+        auth_user_info = auth.decode_user_token(token)
+    except api_exceptions.AuthException:
+        await websocket.close(code=WS_1008_POLICY_VIOLATION)
+        return
+
+    user_id = auth_user_info['user_id']
+
+    # Permisos: sólo admin o los participantes del chat
+    if auth_user_info.get('user_role') != 'admin' and not await ChatCtrl.is_participant(chat_id, user_id):
+        await websocket.close(code=WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+
+    async with chat_events_hub.subscribe(chat_id) as subscription:
+        tasks = {
+            asyncio.ensure_future( _receive_chat_events(websocket, chat_id, user_id) ),
+            asyncio.ensure_future( _send_chat_events(websocket, subscription, user_id) )
+        }
+
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    for task in done:
+        exc = task.exception()
+        if exc is not None and not isinstance(exc, WebSocketDisconnect):
+            logger.warning(f'Chat {chat_id} websocket error: {exc!r}')
@@ -44,6 +44,9 @@ async def search_instruments(
         'fts': fts
     }
 
+    # Signed URLs expire, so those responses are not cached
+    options['http_cache'] = not add_blob_display_url
+
     search_data = await braceletCtrlProxy.search(InstrumentCtrl, request, **options)
     if add_blob_display_url:
         await InstrumentCtrl.bulk_add_signed_display_url(search_data.items)
@@ -109,6 +112,7 @@ async def post_instrument_signed_url(
     responses                    = {**HTTPResponses.get}
 )
 async def get_instrument(
+        request              : Request,
         instrument_id        : int                        = Path(..., description='Instrument ID'),
         fields               : FieldsQueryParam           = Depends(FieldsQueryParam),
         auth_user_info       : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated),
@@ -121,7 +125,9 @@ async def get_instrument(
         'auth_user_info': auth_user_info,
         'extra_args'     : {
             'add_blob_display_url' : add_blob_display_url
-        }
+        },
+        'request'        : request,
+        'http_cache'     : not add_blob_display_url  # Signed URLs expire, so those responses are not cached
     }
 
     return await braceletCtrlProxy.get(InstrumentCtrl, instrument_id, fields.fields, **options)
@@ -1,10 +1,11 @@
 from typing import Dict, Union, List, Optional
-from fastapi import APIRouter, Depends, Path, Query, Response
+from fastapi import APIRouter, Depends, Path, Query, Response, HTTPException
 from starlette.requests import Request
 from starlette.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT
 
 from controllers.bracelet_ctrl_proxy import braceletCtrlProxy
 from lib import auth
+from bracelet_lib.controllers.chats import ChatCtrl
 from bracelet_lib.controllers.message import MessageCtrl
 from bracelet_lib.models.common import StrEnum
 from bracelet_lib.models.messages import Message
@@ -44,7 +45,36 @@ async def search_messages(
         'ts_from': ts_from,
         'ts_to': ts_to
     }
-    return await braceletCtrlProxy.search(MessageCtrl, request, **options)
+    return await braceletCtrlProxy.search(MessageCtrl, request, trusted=True, **options)
+
+@router.get(
+    '/chats/{chat_id}/messages',
+    response_model               = Message.MessageHistory,
+    response_model_exclude_unset = True,
+    summary                      = 'Chat history',
+    description                  = 'Page of the chat messages before or after a message, the latest ones by default. '
+                                   'Use before_id/after_id from the response to load the previous/next page',
+    response_description         = 'Messages sorted by timestamp',
+    responses                    = {**HTTPResponses.get}
+)
+async def get_chat_history(
+        chat_id        : int           = Path(..., ge=1, description='Chat ID'),
+        before_id      : Optional[int] = Query(None, ge=1, description='Messages previous to this message ID'),
+        after_id       : Optional[int] = Query(None, ge=1, description='Messages following this message ID'),
+        limit          : int           = Query(50, ge=1, le=500, description='Max number of messages'),
+        auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    if auth_user_info.get('user_role') != 'admin' and not await ChatCtrl.is_participant(chat_id, auth_user_info['user_id']):
+        raise HTTPException(403, detail='You are not a participant of this chat')
+
+    messages, has_more = await MessageCtrl.history(chat_id, before_id=before_id, after_id=after_id, limit=limit)
+
+    return Message.MessageHistory(
+        items     = [ Message.FullValidator.from_model(message) for message in messages ],
+        has_more  = has_more,
+        before_id = messages[0].id if messages else before_id,
+        after_id  = messages[-1].id if messages else after_id
+    )
 
 @router.get(
     '/messages/{message_id}',
@@ -61,7 +91,7 @@ async def get_message(
         auth_user_info: Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
 ):
     options = {'auth_user_info': auth_user_info}
-    return await braceletCtrlProxy.get(MessageCtrl, message_id, fields.fields, **options)
+    return await braceletCtrlProxy.get(MessageCtrl, message_id, fields.fields, trusted=True, **options)
 
 @router.post(
     '/messages',
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from fastapi import Depends, APIRouter, Response, Query
+from fastapi import Depends, APIRouter, Response, Query, Request
 from fastapi.params import Form
 from starlette.status import HTTP_204_NO_CONTENT
 
@@ -49,14 +49,15 @@ class OAuth2PasswordRequestForm:
     response_description = 'Token created or refreshed successfully',
     responses            = {**HTTPResponses.post}
 )
-async def oauth_token(form_data: OAuth2PasswordRequestForm = Depends()):
+async def oauth_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
     tokens = None
 
     if form_data.grant_type == GrantTypeEnum.password and form_data.username and form_data.password:
         tokens = await OauthCtrl.create_token(
-            username = form_data.username,
-            password = form_data.password,
-            scope    = form_data.scope
+            username  = form_data.username,
+            password  = form_data.password,
+            scope     = form_data.scope,
+            client_ip = request.client.host if request.client else None
         )
 
     if form_data.grant_type == GrantTypeEnum.refresh_token and form_data.refresh_token:
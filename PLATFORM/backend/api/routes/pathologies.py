@@ -45,6 +45,7 @@ async def search_pathologies(
     options['extra_args']     = {
         'fts': fts
     }
+    options['http_cache']     = True
 
     return await braceletCtrlProxy.search(PathologyCtrl, request, **options)
 
@@ -59,6 +60,7 @@ async def search_pathologies(
     responses                    = {**HTTPResponses.get}
 )
 async def get_pathology(
+        request         : Request,
         pathology_id    : int                        = Path(..., description='Pathology ID'),
         embed           : str                        = Depends(build_embed_query_param(PathologyEmbedEnum)),
         fields          : FieldsQueryParam           = Depends(FieldsQueryParam),
@@ -66,7 +68,9 @@ async def get_pathology(
 ):
     options = {
         'embed'          : embed,
-        'auth_user_info' : auth_user_info
+        'auth_user_info' : auth_user_info,
+        'request'        : request,
+        'http_cache'     : True
     }
 
     return await braceletCtrlProxy.get(PathologyCtrl, pathology_id, fields.fields, **options)
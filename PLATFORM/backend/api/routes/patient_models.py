@@ -9,7 +9,7 @@ from bracelet_lib.controllers.users import PermissionCtrl
 from bracelet_lib.models.patient_models import PatientModel
 from bracelet_lib.models.common import StrEnum
 from routes.common import HTTPResponses, BasicQueryParams, FieldsQueryParam, build_embed_query_param
-from bracelet_lib.models.storage import SignedUrlResponse, SignedUrlRequest, BlobOpType
+from bracelet_lib.models.storage import SignedUrlResponse, SignedUrlRequest, BlobOpType, MAX_UPLOAD_PARTS
 from lib import auth, exceptions as lib_exceptions
 
 router = APIRouter()
@@ -89,6 +89,18 @@ async def post_patient_model_signed_url(
         signed_request : SignedUrlRequest.PostSignedUrlRequest,
         auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
 ):
+    return await PatientModelCtrl.generate_signed_url(
+        operation  = BlobOpType.post,
+        data       = signed_request,
+        prefix_url = await get_upload_prefix(auth_user_info)
+    )
+
+
+async def get_upload_prefix(auth_user_info: Dict[str, Union[str, int]]) -> str:
+    """
+    Checks the user can upload patient models and returns the blob prefix of their uploads, the multipart
+    operations are always built under this prefix, so users can only reach their own uploads
+    """
     user_id = auth_user_info['user_id']
     permissions = await PermissionCtrl.get_user_permission(
         user_id,
@@ -97,10 +109,97 @@ async def post_patient_model_signed_url(
     if permissions.write == PermissionGrantType.none:
         raise lib_exceptions.AuthException(msg='Not enough permissions to use this resource')
 
-    return await PatientModelCtrl.generate_signed_url(
-        operation  = BlobOpType.post,
-        data       = signed_request,
-        prefix_url = f"user/{user_id}/patient-models"
+    return f"user/{user_id}/patient-models"
+
+
+@router.get(
+    '/patient-models/bs-multipart/{upload_id}/parts',
+    response_model               = SignedUrlResponse.MultipartPartsResponse,
+    summary                      = 'List the uploaded parts of a multipart upload',
+    description                  = 'Returns the parts already uploaded, allows to resume an interrupted upload',
+    response_description         = 'Uploaded parts',
+    responses                    = {**HTTPResponses.get}
+)
+async def get_patient_model_multipart_parts(
+        upload_id      : str                        = Path(..., description='Multipart upload ID'),
+        reserved_id    : int                        = Query(..., description='ID reserved by the POST signed URL'),
+        filename       : str                        = Query(..., description='Name of the uploaded file'),
+        auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    return await PatientModelCtrl.get_multipart_parts(
+        prefix_url  = await get_upload_prefix(auth_user_info),
+        reserved_id = reserved_id,
+        filename    = filename,
+        upload_id   = upload_id
+    )
+
+
+@router.get(
+    '/patient-models/bs-multipart/{upload_id}/part-urls',
+    response_model               = SignedUrlResponse.MultipartPartUrlsResponse,
+    summary                      = 'Generate signed URLs for a range of parts of a multipart upload',
+    description                  = 'Allows big uploads to request the part URLs by batches',
+    response_description         = 'Signed URLs of the parts, starting at first_part',
+    responses                    = {**HTTPResponses.get}
+)
+async def get_patient_model_multipart_part_urls(
+        upload_id      : str                        = Path(..., description='Multipart upload ID'),
+        reserved_id    : int                        = Query(..., description='ID reserved by the POST signed URL'),
+        filename       : str                        = Query(..., description='Name of the uploaded file'),
+        first_part     : int                        = Query(1, ge=1, le=MAX_UPLOAD_PARTS),
+        count          : int                        = Query(100, ge=1, le=1000),
+        auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    return await PatientModelCtrl.get_multipart_part_urls(
+        prefix_url  = await get_upload_prefix(auth_user_info),
+        reserved_id = reserved_id,
+        filename    = filename,
+        upload_id   = upload_id,
+        first_part  = first_part,
+        count       = count
+    )
+
+
+@router.post(
+    '/patient-models/bs-multipart/{upload_id}/complete',
+    response_model               = SignedUrlResponse.GetSignedUrlResponse,
+    summary                      = 'Complete a multipart upload',
+    description                  = 'Joins the uploaded parts, all of them if the body does not include the parts',
+    response_description         = 'Signed URL to display the uploaded model',
+    responses                    = {**HTTPResponses.post}
+)
+async def complete_patient_model_multipart(
+        complete_request : SignedUrlRequest.CompleteMultipartRequest,
+        upload_id        : str                        = Path(..., description='Multipart upload ID'),
+        auth_user_info   : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    return await PatientModelCtrl.complete_multipart_upload(
+        prefix_url = await get_upload_prefix(auth_user_info),
+        upload_id  = upload_id,
+        data       = complete_request
+    )
+
+
+@router.delete(
+    '/patient-models/bs-multipart/{upload_id}',
+    summary                      = 'Abort a multipart upload',
+    description                  = 'Aborts the upload and removes the parts already uploaded',
+    response_description         = 'Empty',
+    status_code                  = HTTP_204_NO_CONTENT,
+    responses                    = {**HTTPResponses.delete},
+    response_class               = Response
+)
+async def abort_patient_model_multipart(
+        upload_id      : str                        = Path(..., description='Multipart upload ID'),
+        reserved_id    : int                        = Query(..., description='ID reserved by the POST signed URL'),
+        filename       : str                        = Query(..., description='Name of the uploaded file'),
+        auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    await PatientModelCtrl.abort_multipart_upload(
+        prefix_url  = await get_upload_prefix(auth_user_info),
+        reserved_id = reserved_id,
+        filename    = filename,
+        upload_id   = upload_id
     )
 
 
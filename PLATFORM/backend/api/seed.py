@@ -1122,23 +1122,20 @@ async def seed_users() -> List[UserAccount]:
         user_status = random.choice([ USER_STATUSES[0], USER_STATUSES[1] ])
         approval_toc_ts = None if user_status == USER_STATUSES[1] else datetime.now(timezone.utc)
         users.append(
-            await UserAccountCtrl.create(
-                UserAccount.CreateValidator(
-                    email            = f"{faker.word()}.{faker.email()}",
-                    password         = "TFGde10",
-                    user_role_name   = USER_ROLES[1],   # user
-                    user_status_name = user_status,
-                    first_name       = faker.first_name(),
-                    last_name        = faker.last_name(),
-                    phone            = faker.phone_number(),
-                    approval_toc_ts  = approval_toc_ts
-                ),
-                validate         = False,
-                with_transaction = False
+            UserAccount.CreateValidator(
+                email            = f"{faker.word()}.{faker.email()}",
+                password         = "TFGde10",
+                user_role_name   = USER_ROLES[1],   # user
+                user_status_name = user_status,
+                first_name       = faker.first_name(),
+                last_name        = faker.last_name(),
+                phone            = faker.phone_number(),
+                approval_toc_ts  = approval_toc_ts
             )
         )
 
-    return users
+    # UserAccount.save_many_static hashes the passwords
+    return await UserAccountCtrl.create_many(users, validate=False, with_transaction=False)
 
 
 async def seed_patient_models(patient_id: int) -> None:
@@ -1439,10 +1436,11 @@ def get_realistic_activity_pattern(patient_id: int, age: int, pathology_names: l
 async def generate_hour_studies(patient_id: int, hour: int, date_base: datetime, 
                                cumulative_steps: int, hour_config: dict, 
                                bpm_range: tuple, spo2_range: tuple, 
-                               pathology_names: list, health_profile: dict) -> List[Study]:
+                               pathology_names: list, health_profile: dict) -> List[Study.StudyCreate]:
     """
     Genera estudios para una hora específica del día siguiendo el patrón de actividad.
     Genera entre 4-12 estudios por hora para alcanzar 300-600 estudios diarios.
+    Los estudios no se guardan aquí, ver _generate_daily_studies.
     """
     import random
     studies = []
@@ -1539,18 +1537,16 @@ async def generate_hour_studies(patient_id: int, hour: int, date_base: datetime,
             elif any("hipertensión" in name for name in pathology_names):
                 bpm = random.randint(110, 140)  # Crisis hipertensiva
         
-        study = await StudyCtrl.create(
+        # Se insertan todos juntos en _generate_daily_studies, una vez ajustados los pasos
+        studies.append(
             Study.CreateValidator(
                 patient_id = patient_id,
                 step_count = local_cumulative,  # Usar variable local
                 bpm        = bpm,
                 spo2       = spo2,
                 ts         = ts
-            ),
-            validate         = False,
-            with_transaction = False
+            )
         )
-        studies.append(study)
     
     return studies
 
@@ -1683,7 +1679,8 @@ async def _generate_daily_studies(patient_id: int, start_ts: datetime, end_ts: d
         elif steps_needed > 500:
             daily_target_steps = cumulative_steps
 
-    return studies
+    # Un solo INSERT multi-fila por día, con los pasos ya ajustados
+    return await StudyCtrl.create_many(studies, validate=False, with_transaction=False)
 
 
 # ── Función para generar alarmas ───────────────────────────────────────────────
@@ -1741,19 +1738,17 @@ async def seed_alarms_for_patients(patients):
             # Alarmas de caída y botón de pánico son más urgentes
             is_urgent = alarm_type in ['fall_detected', 'button_alarm'] or random.choice([True, False])
             
-            alarm = await AlarmCtrl.create(
+            alarms.append(
                 Alarm.CreateValidator(
                     patient_id = patient.id,
                     alarm_type = alarm_type,
                     ts         = alarm_ts,
                     is_urgent  = is_urgent
-                ),
-                validate         = False,
-                with_transaction = False
+                )
             )
-            alarms.append(alarm)
     
-    return alarms
+    # Todas las alarmas en un solo INSERT multi-fila
+    return await AlarmCtrl.create_many(alarms, validate=False, with_transaction=False)
 
 
 
@@ -0,0 +1,35 @@
+import asyncio
+import timeit
+
+from typing import Awaitable, Callable, Optional
+
+
+def best_of(fn: Callable[[], object], number: int, repeat: int = 5) -> float:
+    """
+    :return: seconds per call, the best of the repetitions (the others only add noise of the machine)
+    """
+    return min( timeit.repeat(fn, number=number, repeat=repeat) ) / number
+
+
+async def best_of_async(fn: Callable[[], Awaitable], number: int, repeat: int = 5) -> float:
+    """
+    Same as best_of for coroutines, awaited one after the other in the running loop
+    """
+    loop    = asyncio.get_running_loop()
+    timings = []
+
+    for _ in range(repeat):
+        start = loop.time()
+        for _ in range(number):
+            await fn()
+        timings.append(loop.time() - start)
+
+    return min(timings) / number
+
+
+def report(name: str, seconds: float, baseline: Optional[float] = None, unit: str = 'call') -> None:
+    line = f'{name:<48} {seconds * 1e6:>12.2f} µs/{unit}'
+    if baseline is not None:
+        line += f'   x{baseline / seconds:.1f}'
+
+    print(line)
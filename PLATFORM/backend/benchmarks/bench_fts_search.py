@@ -0,0 +1,186 @@
+"""
+Users search ('fts' search arg) on 100k users: the trigram similarity computed over the unaccented columns on
+the fly (GiST expression index, as before) vs the search_document generated column (GIN index), and a plain
+ILIKE over the document as reference. Each query returns the first page, 50 users.
+
+    BENCH_DATABASE_URL=postgresql://postgres@127.0.0.1:5432/bracelet_bench \\
+        PYTHONPATH=bracelet-lib:api python benchmarks/bench_fts_search.py
+
+The database of BENCH_DATABASE_URL is dropped and created again, PostgreSQL needs the pg_trgm and unaccent
+extensions.
+"""
+import asyncio
+import os
+import sys
+
+import asyncpg
+import sqlalchemy as sa
+
+from urllib.parse import urlparse
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+from bracelet_lib.models import unaccent_text
+from bracelet_lib.models.users import UserAccount
+
+from _timing import best_of_async, report
+
+
+DB_URL = os.environ.get('BENCH_DATABASE_URL', 'postgresql://postgres@127.0.0.1:5432/bracelet_bench')
+USERS  = 100000
+LIMIT  = 50
+TEXTS  = ('José García', 'garcia', 'mar', 'user4242@bracelet', '+34 600')
+
+FIRST_NAMES = (
+    'José', 'María', 'Ángel', 'Lucía', 'Jesús', 'Begoña', 'Raúl', 'Inés', 'Óscar', 'Marta', 'Iñaki', 'Sofía'
+)
+LAST_NAMES  = (
+    'García', 'Martínez', 'López', 'Sánchez', 'Pérez', 'Gómez', 'Díaz', 'Muñoz', 'Álvarez', 'Romero', 'Jiménez',
+    'Ruiz', 'Hernández', 'Núñez', 'Castaño'
+)
+
+# Same as the migrations: the function of the initial migration, the old GiST index and the search documents
+SETUP = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE EXTENSION IF NOT EXISTS unaccent',
+    """
+    CREATE OR REPLACE FUNCTION public.unaccent_text(text) RETURNS text AS
+    $BODY$ SELECT public.unaccent($1); $BODY$
+    LANGUAGE sql IMMUTABLE COST 1
+    """,
+    str( CreateTable(UserAccount.Table, include_foreign_key_constraints=[]).compile(dialect=postgresql.dialect()) ),
+    f"""
+    INSERT INTO user_account (email, password, user_role_name, user_status_name, first_name, last_name, phone)
+    SELECT
+        'user' || i || '@bracelet.test',
+        'password',
+        'patient',
+        'active',
+        (ARRAY{list(FIRST_NAMES)})[1 + i % {len(FIRST_NAMES)}],
+        (ARRAY{list(LAST_NAMES)})[1 + (i / {len(FIRST_NAMES)}) % {len(LAST_NAMES)}],
+        CASE WHEN i % 3 = 0 THEN NULL ELSE '+34 6' || lpad((i * 7919 % 100000000)::text, 8, '0') END
+    FROM generate_series(1, {USERS}) AS i
+    """,
+    """
+    ALTER TABLE user_account ADD COLUMN search_document TEXT GENERATED ALWAYS AS (
+        public.unaccent_text(email || ' ' || first_name || ' ' || last_name || COALESCE(' ' || phone, ''))
+    ) STORED
+    """,
+    """
+    CREATE INDEX user_account_fts_gist_idx ON user_account USING gist (
+        public.unaccent_text((email || ' ' || first_name || ' ' ||  last_name || COALESCE(' ' ||  phone, '')))
+        gist_trgm_ops
+    )
+    """,
+    'CREATE INDEX ix_user_account_search_document ON user_account USING gin (search_document gin_trgm_ops)',
+    'ANALYZE user_account',
+)
+
+
+def _fts_query(document, text: str) -> str:
+    """
+    Same query as braceletBaseCtrl.apply_fts_sort_builder, the first page sorted by the match distance
+    """
+    user_t    = UserAccount.Table
+    fts_text  = unaccent_text(text)
+    fts_query = sa.select([
+        user_t.c.id,
+        sa.cast( document.op('<->')(fts_text), sa.Numeric(5, 4) ).label('match_distance')
+    ]).where(
+        sa.or_( document.op('%')(fts_text), document.op('%>')(fts_text) )
+    ).alias('fts')
+
+    query = sa.select([
+        user_t.c.id, user_t.c.email, user_t.c.first_name, user_t.c.last_name
+    ]).select_from(
+        user_t.join(fts_query, user_t.c.id == fts_query.c.id)
+    ).order_by(
+        fts_query.c.match_distance, user_t.c.id
+    ).limit(
+        LIMIT
+    )
+
+    return _compile(query)
+
+
+def _ilike_query(text: str) -> str:
+    user_t = UserAccount.Table
+    query  = sa.select([
+        user_t.c.id, user_t.c.email, user_t.c.first_name, user_t.c.last_name
+    ]).where(
+        UserAccount.SearchDocument.ilike( '%' + unaccent_text(text) + '%' )
+    ).order_by(
+        user_t.c.id
+    ).limit(
+        LIMIT
+    )
+
+    return _compile(query)
+
+
+def _compile(query) -> str:
+    # Without the escaped % of the default paramstyle, the queries are sent as they are
+    dialect = postgresql.dialect(paramstyle='named')
+
+    return str( query.compile(dialect=dialect, compile_kwargs={'literal_binds': True}) )
+
+
+async def _create_database(url) -> asyncpg.Connection:
+    admin = await asyncpg.connect(url._replace(path='/postgres').geturl())
+    try:
+        available = {
+            record['name'] for record in await admin.fetch(
+                "SELECT name FROM pg_available_extensions WHERE name IN ('pg_trgm', 'unaccent')"
+            )
+        }
+        if available != {'pg_trgm', 'unaccent'}:
+            sys.exit(f'PostgreSQL at {url.hostname} has no pg_trgm and unaccent extensions')
+
+        db_name = url.path.lstrip('/')
+        await admin.execute(f'DROP DATABASE IF EXISTS "{db_name}"')
+        await admin.execute(f'CREATE DATABASE "{db_name}"')
+    finally:
+        await admin.close()
+
+    conn = await asyncpg.connect(url.geturl())
+    for statement in SETUP:
+        await conn.execute(statement)
+
+    return conn
+
+
+async def run():
+    conn = await _create_database( urlparse(DB_URL) )
+
+    user_t = UserAccount.Table
+    old_document = unaccent_text(
+        user_t.c.email + ' ' + user_t.c.first_name + ' ' + user_t.c.last_name +
+        sa.func.coalesce(' ' + user_t.c.phone, '')
+    )
+
+    try:
+        for text in TEXTS:
+            queries = {
+                'unaccent_text(columns), GiST' : _fts_query(old_document, text),
+                'search_document, GIN'         : _fts_query(UserAccount.SearchDocument, text),
+                'search_document ILIKE, GIN'   : _ilike_query(text),
+            }
+
+            # Same page with both FTS queries, only the index changes
+            old_page, new_page = [ await conn.fetch(queries[name]) for name in list(queries)[:2] ]
+            assert old_page == new_page
+
+            print(f'\n{text!r}, {len(new_page)} users')
+
+            baseline = None
+            for name, query in queries.items():
+                seconds  = await best_of_async(lambda: conn.fetch(query), number=5, repeat=3)
+                baseline = baseline or seconds
+                report(name, seconds, baseline if seconds is not baseline else None, unit='query')
+
+    finally:
+        await conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+"""
+Verification of the access tokens: jwt.decode on every request vs the cache of verified tokens.
+
+    PYTHONPATH=bracelet-lib:api python benchmarks/bench_jwt_auth.py
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault('API_JWT_SECRET_KEY', 'benchmark-secret-key-of-32-bytes!')
+os.environ.setdefault('API_JWT_ALGORITHM', 'HS256')
+
+import jwt
+
+from lib import auth, config
+
+from _timing import best_of, report
+
+
+TOKENS   = 1000  # Different users, all fit in the cache (jwt_verify_cache_size)
+REQUESTS = 20    # Requests of each user in the concurrent load
+
+
+def _encode(user_id: int) -> str:
+    return jwt.encode(
+        {'sub': str(user_id), 'iss': 'https://bracelet.com', 'exp': int(time.time()) + 3600, 'role': 'doctor'},
+        config.settings.jwt_secret_key,
+        algorithm = config.settings.jwt_algorithm
+    )
+
+
+def main():
+    tokens = [ _encode(user_id) for user_id in range(1, TOKENS + 1) ]
+    token  = tokens[0]
+
+    print(f'{config.settings.jwt_algorithm}, cache of {auth.verified_token_cache.max_size} tokens')
+
+    decode = best_of(
+        lambda: jwt.decode(token, config.settings.jwt_secret_key, algorithms=[config.settings.jwt_algorithm]),
+        number = 5000
+    )
+    report('jwt.decode', decode)
+
+    def miss():
+        auth.verified_token_cache.clear()
+        auth.decode_user_token(token)
+
+    report('decode_user_token, cache miss', best_of(miss, number=5000), decode)
+
+    auth.decode_user_token(token)
+    report('decode_user_token, cache hit', best_of(lambda: auth.decode_user_token(token), number=50000), decode)
+
+    # Every user sending several requests at the same time, only the first one of each user is decoded
+    async def load():
+        await asyncio.gather(*[
+            auth.check_user_authenticated(token) for token in tokens for _ in range(REQUESTS)
+        ])
+
+    def cold_load():
+        auth.verified_token_cache.clear()
+        asyncio.run(load())
+
+    def decode_all():
+        for token in tokens:
+            for _ in range(REQUESTS):
+                jwt.decode(token, config.settings.jwt_secret_key, algorithms=[config.settings.jwt_algorithm])
+
+    requests = TOKENS * REQUESTS
+    baseline = best_of(decode_all, number=1, repeat=3) / requests
+    report(f'{requests} requests, jwt.decode each', baseline, unit='request')
+    report(f'{requests} requests, check_user_authenticated', best_of(cold_load, number=1, repeat=3) / requests,
+           baseline, unit='request')
+
+
+if __name__ == '__main__':
+    main()
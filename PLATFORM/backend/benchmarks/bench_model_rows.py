@@ -0,0 +1,77 @@
+"""
+Building the DB model instances of a result set: cls(**record) going through __setattr__ for every column (as
+before) vs from_db and from_db_multi skipping it. CPU time and memory of 2500 studies.
+
+    PYTHONPATH=bracelet-lib:api python benchmarks/bench_model_rows.py
+"""
+import datetime
+import tracemalloc
+
+from bracelet_lib.models.studies import Study
+
+from _timing import best_of, report
+
+
+ROWS = 2500
+
+
+def _rows() -> list:
+    ts = datetime.datetime(2026, 10, 19, 8, 0, 0)
+    return [
+        {
+            'id'         : i,
+            'patient_id' : i % 20 + 1,
+            'step_count' : i * 10,
+            'bpm'        : 60 + i % 40,
+            'spo2'       : 95 + i % 5 if i % 3 else None,
+            'ts'         : ts + datetime.timedelta(minutes=i),
+            'create_ts'  : (ts + datetime.timedelta(minutes=i)).replace(tzinfo=datetime.timezone.utc),
+            'update_ts'  : (ts + datetime.timedelta(minutes=i)).replace(tzinfo=datetime.timezone.utc)
+        }
+        for i in range(1, ROWS + 1)
+    ]
+
+
+def _peak_memory(build) -> int:
+    """
+    :return: bytes allocated while building the instances, the rows are already loaded
+    """
+    tracemalloc.start()
+    try:
+        instances = build()
+        _, peak   = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(instances) == ROWS
+    return peak
+
+
+def main():
+    rows     = _rows()
+    builders = {
+        'cls(**record)' : lambda: [ Study( **dict(row.items()) ) for row in rows ],
+        'from_db'       : lambda: [ Study.from_db(row) for row in rows ],
+        'from_db_multi' : lambda: list( Study.from_db_multi(rows) ),
+    }
+
+    # All of them load the same records
+    expected = [ study.dict() for study in builders['from_db_multi']() ]
+    for build in builders.values():
+        assert [ study.dict() for study in build() ] == expected
+
+    print(f'{ROWS} studies')
+
+    baseline = None
+    for name, build in builders.items():
+        seconds  = best_of(build, number=20) / ROWS
+        baseline = baseline or seconds
+        report(name, seconds, baseline if seconds is not baseline else None, unit='row')
+
+    print()
+    for name, build in builders.items():
+        print(f'{name:<48} {_peak_memory(build) / ROWS:>12.0f} bytes/row')
+
+
+if __name__ == '__main__':
+    main()
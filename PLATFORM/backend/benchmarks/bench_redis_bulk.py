@@ -0,0 +1,107 @@
+"""
+Loading and saving several keys: a Redis round trip per key vs the bulk operations (MGET and pipelined SET).
+
+    BENCH_REDIS_URL=redis://localhost:6379/15 PYTHONPATH=bracelet-lib:api python benchmarks/bench_redis_bulk.py
+
+The database of BENCH_REDIS_URL is flushed.
+"""
+import asyncio
+import datetime
+import os
+
+import pydantic
+
+from typing import Optional
+
+from bracelet_lib.cache import cache
+from bracelet_lib.models.base_model import braceletRedisModel
+
+from _timing import best_of_async, report
+
+
+REDIS_URL = os.environ.get('BENCH_REDIS_URL', 'redis://localhost:6379/15')
+SIZES     = (10, 100, 1000)
+
+
+class DeviceStatusFull(pydantic.BaseModel):
+    id         : int
+    patient_id : int
+    battery    : int
+    connected  : bool
+    last_seen  : datetime.datetime
+    firmware   : Optional[str]
+
+
+class DeviceStatus(braceletRedisModel):
+    FullValidator = DeviceStatusFull
+    Prefix        = 'bench-device-status'
+
+    id         : int               = None
+    patient_id : int               = None
+    battery    : int               = None
+    connected  : bool              = None
+    last_seen  : datetime.datetime = None
+    firmware   : Optional[str]     = None
+
+
+def _data(id: int) -> dict:
+    return {
+        'id'         : id,
+        'patient_id' : id,
+        'battery'    : id % 100,
+        'connected'  : True,
+        'last_seen'  : datetime.datetime(2026, 10, 19, 12, 0, 0),
+        'firmware'   : '1.4.2'
+    }
+
+
+async def run():
+    await cache.init(REDIS_URL)
+    await cache.conn.flushdb()
+
+    try:
+        for size in SIZES:
+            ids    = list(range(1, size + 1))
+            keys   = [ DeviceStatus._get_full_id(id) for id in ids ]
+            number = max(1, 2000 // size)
+
+            print(f'\n{size} keys')
+
+            async def save_one_by_one():
+                for id in ids:
+                    await DeviceStatus.save_static(_data(id))
+
+            async def save_many():
+                await DeviceStatus.save_many_static([ _data(id) for id in ids ])
+
+            baseline = await best_of_async(save_one_by_one, number)
+            report('save_static per key', baseline)
+            report('save_many_static', await best_of_async(save_many, number), baseline)
+
+            async def get_one_by_one():
+                for key in keys:
+                    await cache.get(key)
+
+            async def get_concurrently():
+                await asyncio.gather(*[ cache.get(key) for key in keys ])
+
+            baseline = await best_of_async(get_one_by_one, number)
+            report('cache.get per key', baseline)
+            report('cache.get per key, concurrent', await best_of_async(get_concurrently, number), baseline)
+            report('cache.mget', await best_of_async(lambda: cache.mget(keys), number), baseline)
+
+            async def get_static_one_by_one():
+                for id in ids:
+                    await DeviceStatus.get_static(id)
+
+            baseline = await best_of_async(get_static_one_by_one, number)
+            report('get_static per key', baseline)
+            report('get_many_static', await best_of_async(lambda: DeviceStatus.get_many_static(ids), number), baseline)
+
+    finally:
+        await cache.conn.flushdb()
+        await cache.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+"""
+Records stored in Redis: the msgpack codec (keeps the types, loaded without pydantic) vs the orjson codec
+(validated with FullValidator on load). Encoding, decoding, from_redis and the stored size.
+
+    PYTHONPATH=bracelet-lib:api python benchmarks/bench_redis_codecs.py
+"""
+import datetime
+import enum
+
+import pydantic
+
+from decimal import Decimal
+from typing import List, Optional
+
+from bracelet_lib.models import codecs
+from bracelet_lib.models.base_model import braceletRedisModel
+
+from _timing import best_of, report
+
+
+class AlarmLevel(str, enum.Enum):
+    INFO     = 'info'
+    CRITICAL = 'critical'
+
+
+class PatientSnapshotFull(pydantic.BaseModel):
+    id          : int
+    patient_id  : int
+    ts          : datetime.datetime
+    create_ts   : datetime.datetime
+    day         : datetime.date
+    temperature : Decimal
+    bpm         : int
+    spo2        : Optional[int]
+    level       : AlarmLevel
+    tags        : List[str]
+
+
+class PatientSnapshot(braceletRedisModel):
+    FullValidator = PatientSnapshotFull
+    Prefix        = 'bench-patient-snapshot'
+
+    id          : int               = None
+    patient_id  : int               = None
+    ts          : datetime.datetime = None
+    create_ts   : datetime.datetime = None
+    day         : datetime.date     = None
+    temperature : 'Decimal'         = None
+    bpm         : int               = None
+    spo2        : Optional[int]     = None
+    level       : AlarmLevel        = None
+    tags        : List[str]         = None
+
+
+DATA = {
+    'id'          : 12345,
+    'patient_id'  : 42,
+    'ts'          : datetime.datetime(2026, 10, 19, 8, 30, 15, 123456),
+    'create_ts'   : datetime.datetime(2026, 10, 19, 8, 30, 16, tzinfo=datetime.timezone.utc),
+    'day'         : datetime.date(2026, 10, 19),
+    'temperature' : Decimal('36.6'),
+    'bpm'         : 72,
+    'spo2'        : 98,
+    'level'       : AlarmLevel.INFO,
+    'tags'        : ['night', 'sleeping']
+}
+
+
+def main():
+    baselines = {}  # The orjson codec, the other one is compared with it
+
+    for codec in (codecs.orjson_codec, codecs.msgpack_codec):
+        PatientSnapshot.Codec = codec
+        raw                   = PatientSnapshot._encode(DATA)
+
+        assert PatientSnapshot.from_redis(raw).dict() == DATA
+
+        print(f'\n{type(codec).__name__}, {len(raw)} bytes')
+
+        timings = {
+            'encode'     : best_of(lambda: PatientSnapshot._encode(DATA), number=20000),
+            'decode'     : best_of(lambda: codecs.decode(raw), number=20000),
+            'from_redis' : best_of(lambda: PatientSnapshot.from_redis(raw), number=20000)
+        }
+        for name, seconds in timings.items():
+            report(name, seconds, baselines.get(name))
+
+        baselines = baselines or timings
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Search responses of a trusted model (Study): the SearchValidator plus the FastAPI response_model validation vs
+the records serialized directly with orjson.
+
+    PYTHONPATH=bracelet-lib:api python benchmarks/bench_trusted_serialization.py
+"""
+import asyncio
+import datetime
+
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_cloned_field, create_response_field
+
+from bracelet_lib.models.studies import Study
+from controllers.bracelet_ctrl_proxy import _trusted_response
+
+from _timing import best_of, report
+
+
+PAGE_SIZES = (50, 2500)
+PAG_LINKS  = {
+    'first' : 'https://bracelet.com/v1/studies?limit=50&sort_by=create_ts:asc',
+    'next'  : 'https://bracelet.com/v1/studies?limit=50&sort_by=create_ts:asc&from=eyJpZCI6IDUwfQ'
+}
+
+
+def _rows(size: int) -> list:
+    ts = datetime.datetime(2026, 10, 19, 8, 0, 0)
+    return [
+        {
+            'id'         : i,
+            'patient_id' : i % 20 + 1,
+            'step_count' : i * 10,
+            'bpm'        : 60 + i % 40,
+            'spo2'       : 95 + i % 5 if i % 3 else None,
+            'ts'         : ts + datetime.timedelta(minutes=i),
+            'create_ts'  : (ts + datetime.timedelta(minutes=i)).replace(tzinfo=datetime.timezone.utc),
+            'update_ts'  : (ts + datetime.timedelta(minutes=i)).replace(tzinfo=datetime.timezone.utc)
+        }
+        for i in range(1, size + 1)
+    ]
+
+
+# Same field APIRoute builds for response_model=Study.SearchValidator
+response_field = create_cloned_field( create_response_field('Response_search_studies', Study.SearchValidator) )
+loop           = asyncio.new_event_loop()
+
+
+def validated_response(records: list) -> ORJSONResponse:
+    content = Study.SearchValidator(items=( o.dict() for o in records ), **PAG_LINKS)
+    content = loop.run_until_complete(
+        serialize_response(field=response_field, response_content=content, exclude_unset=True)
+    )
+
+    return ORJSONResponse(content)
+
+
+def trusted_response(records: list):
+    return _trusted_response({
+        'items' : [ o.dict() for o in records ],
+        **{ key: value for key, value in PAG_LINKS.items() if value is not None }
+    })
+
+
+def main():
+    for size in PAGE_SIZES:
+        records = list( Study.from_db_multi(_rows(size)) )
+        number  = max(1, 5000 // size)
+
+        # Both send the same document
+        assert validated_response(records).body == trusted_response(records).body
+
+        print(f'\n{size} studies')
+
+        baseline = best_of(lambda: validated_response(records), number)
+        report('SearchValidator + response_model', baseline / size, unit='row')
+        report('trusted, orjson', best_of(lambda: trusted_response(records), number) / size, baseline / size,
+               unit='row')
+
+
+if __name__ == '__main__':
+    main()
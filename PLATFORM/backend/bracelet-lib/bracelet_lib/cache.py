@@ -1,7 +1,15 @@
+import asyncio
+import contextlib
 import aioredis
 import hashlib
+import logging
+import math
+import random
+import secrets
+import time
 
-from typing import Optional, Mapping, Union, Tuple
+from collections import OrderedDict
+from typing import Optional, Mapping, Union, Tuple, Dict, List, Sequence, Any, AsyncIterator, Callable, Awaitable
 from abc import ABC, abstractmethod
 from pydantic import RedisDsn
 
@@ -21,25 +29,280 @@ class CacheAbstract(ABC):
         pass
 
 
+logger = logging.getLogger('bracelet_lib.cache')
+
+
+class LocalCache:
+    """
+    In-process LRU with TTL, used as first level in front of Redis for selected key prefixes.
+    Hits and misses are tracked per prefix.
+    """
+
+    def __init__(self, prefixes: Sequence[str], max_size: int = 10000, ttl: int = 30):
+        self.prefixes = tuple(prefixes)
+        self.max_size = max_size
+        self.ttl      = ttl
+        self._entries : OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._stats   : Dict[str, Dict[str, int]]           = {
+            prefix: {'hits': 0, 'misses': 0} for prefix in self.prefixes
+        }
+
+    def get_prefix(self, key: str) -> Optional[str]:
+        for prefix in self.prefixes:
+            if key.startswith(prefix):
+                return prefix
+
+    def get(self, key: str, prefix: str) -> Tuple[bool, Any]:
+        """
+        :return: a tuple (found, value)
+        """
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self._stats[prefix]['hits'] += 1
+            return True, entry[1]
+
+        if entry is not None:
+            del self._entries[key]
+
+        self._stats[prefix]['misses'] += 1
+
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        stats = {}
+        for prefix, counters in self._stats.items():
+            total = counters['hits'] + counters['misses']
+            stats[prefix] = {
+                **counters,
+                'hit_rate' : counters['hits'] / total if total else 0.0
+            }
+
+        return stats
+
+
+# Sliding window limiter, each key is a sorted set of hits scored with the hit timestamp (ms)
+# KEYS: one window per key
+# ARGV: now_ms, window_ms, mode, member, max_backoff_ms, then a (limit, backoff_step_ms) pair per key,
+#       a limit of 0 means the key is only used to count hits
+#       mode: 0 only checks, 1 adds the hit before checking, 2 adds the hit only if it's allowed (reserve)
+# Returns: { retry_after_ms, count_key_1, count_key_2, ... }, the counts include the hit added
+SLIDING_WINDOW_SCRIPT = """
+local now         = tonumber(ARGV[1])
+local window      = tonumber(ARGV[2])
+local hit         = ARGV[3] == '1'
+local reserve     = ARGV[3] == '2'
+local member      = ARGV[4]
+local max_backoff = tonumber(ARGV[5])
+local result      = { 0 }
+
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[4 + 2 * i])
+    local step  = tonumber(ARGV[5 + 2 * i])
+
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+
+    if hit then
+        redis.call('ZADD', key, now, member)
+        redis.call('PEXPIRE', key, window)
+    end
+
+    local count = redis.call('ZCARD', key)
+    local wait  = 0
+
+    if limit > 0 and count >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        wait = tonumber(oldest[2]) + window - now
+    elseif step > 0 and count > 0 then
+        local newest = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')
+        wait = tonumber(newest[2]) + math.min(step * count, max_backoff) - now
+    end
+
+    if wait > result[1] then
+        result[1] = wait
+    end
+
+    result[i + 1] = count
+end
+
+if reserve and result[1] <= 0 then
+    for i, key in ipairs(KEYS) do
+        redis.call('ZADD', key, now, member)
+        redis.call('PEXPIRE', key, window)
+        result[i + 1] = result[i + 1] + 1
+    end
+end
+
+return result
+"""
+
+
+# Deletes the lock only if it's still owned by the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+
+return 0
+"""
+
+
 class RedisCache(CacheAbstract):
+    InvalidationChannel : str = 'cache-invalidation'
+
     def __init__(self):
-        self.conn = None
+        self.conn               = None
+        self.local              : Optional[LocalCache]     = None
+        self._script_shas       : Dict[str, str]           = {}
+        self._worker_id         : str                      = secrets.token_hex(8)  # Own invalidations are ignored
+        self._sub_conn          : Optional[aioredis.Redis] = None
+        self._invalidation_task : Optional[asyncio.Task]   = None
+        self._inflight          : Dict[str, asyncio.Task]  = {}  # get_or_compute calls running in this worker
 
-    async def init(self, redis_url: RedisDsn):
+    async def init(
+            self,
+            redis_url      : RedisDsn,
+            local_prefixes : Optional[Sequence[str]] = None,
+            local_max_size : int = 10000,
+            local_ttl      : int = 30
+    ):
         """
         This needs to be done here because it's an async operation. Create a Redis instance with
         ConnectionsPool
+        :param local_prefixes: keys starting with these prefixes are kept in an in-process cache too, the writes
+                               are broadcast to the other workers using pub/sub so they drop their local copy
+        :param local_max_size: max keys in the in-process cache
+        :param local_ttl: max seconds a key is kept in the in-process cache, it bounds the staleness if an
+                          invalidation message is lost or the key expires in Redis
         :return:
         """
         self.conn = await aioredis.create_redis_pool(redis_url)
 
+        if local_prefixes:
+            self.local              = LocalCache(local_prefixes, max_size=local_max_size, ttl=local_ttl)
+            self._sub_conn          = await aioredis.create_redis(redis_url)
+            channel,                = await self._sub_conn.subscribe(self.InvalidationChannel)
+            self._invalidation_task = asyncio.ensure_future( self._listen_invalidations(channel) )
+
+    async def close(self):
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            self._sub_conn.close()
+            await self._sub_conn.wait_closed()
+
+        self.conn.close()
+        await self.conn.wait_closed()
+
+    async def _listen_invalidations(self, channel: aioredis.Channel):
+        while await channel.wait_message():
+            message = await channel.get()
+
+            try:
+                worker_id, key = message.decode().split(':', 1)
+            except ValueError:
+                logger.warning(f'Invalid cache invalidation message: {message}')
+                continue
+
+            if worker_id != self._worker_id:
+                self.local.delete(key)
+
+        # The subscription was closed, entries will expire by TTL but nothing else invalidates them
+        logger.warning('Cache invalidation channel closed, disabling local cache')
+        self.local.clear()
+        self.local = None
+
+    async def _invalidate_local(self, key: str) -> None:
+        if self.local is None or self.local.get_prefix(key) is None:
+            return
+
+        self.local.delete(key)
+        await self.conn.publish(self.InvalidationChannel, f'{self._worker_id}:{key}')
+
+    def _invalidate_local_many(self, keys: Sequence[str], pipe) -> None:
+        """
+        Same as _invalidate_local but the publish commands are queued in a pipeline
+        """
+        if self.local is None:
+            return
+
+        for key in keys:
+            if self.local.get_prefix(key) is not None:
+                self.local.delete(key)
+                pipe.publish(self.InvalidationChannel, f'{self._worker_id}:{key}')
+
+    @contextlib.asynccontextmanager
+    async def pipeline(self, transaction: bool = False) -> AsyncIterator[Any]:
+        """
+        Queue several commands to send them in a single round trip, ex:
+
+            async with cache.pipeline() as pipe:
+                fut = pipe.get('a')
+                pipe.set('b', '1')
+            value = await fut
+
+        The commands return futures resolved once the block exits. Writes done this way don't invalidate the
+        in-process cache, use mset/mdelete for keys under the local prefixes
+        :param transaction: if True the commands are wrapped in MULTI/EXEC
+        """
+        pipe = self.conn.multi_exec() if transaction else self.conn.pipeline()
+
+        yield pipe
+
+        await pipe.execute()
+
+    @contextlib.asynccontextmanager
+    async def dedicated_connection(self) -> AsyncIterator[aioredis.Redis]:
+        """
+        Reserve a connection of the pool for the block, needed by blocking commands (BRPOP...) because the
+        pool shares its connections between tasks and they would wait behind the blocking command
+        """
+        conn = await self.conn.connection.acquire()
+
+        try:
+            yield aioredis.Redis(conn)
+        except BaseException:
+            conn.close()  # It may have a blocking command waiting for the reply, the pool replaces it
+            raise
+        finally:
+            self.conn.connection.release(conn)
+
+    def get_local_stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """
+        Hits, misses and hit rate of the in-process cache for each prefix
+        """
+        return self.local.get_stats() if self.local is not None else {}
+
     async def get(self, key: str) -> Optional[str]:
         """
         Get value from redis using a key
         :param key:
         :return: String value or None if not set
         """
-        return await self.conn.get(key)
+        prefix = self.local.get_prefix(key) if self.local is not None else None
+        if prefix is None:
+            return await self.conn.get(key)
+
+        found, value = self.local.get(key, prefix)
+        if not found:
+            value = await self.conn.get(key)
+            if value is not None:  # Misses are not cached, the key can be created any time
+                self.local.set(key, value)
+
+        return value
 
     async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
         """
@@ -49,7 +312,10 @@ class RedisCache(CacheAbstract):
         :param ttl: The ttl is expressed in seconds
         :return:
         """
-        return await self.conn.set(key, value, expire=ttl)
+        ret = await self.conn.set(key, value, expire=ttl)
+        await self._invalidate_local(key)
+
+        return ret
 
     async def delete(self, key) -> bool:
         """
@@ -58,8 +324,190 @@ class RedisCache(CacheAbstract):
         :return: if key was found
         """
         n_deleted = await self.conn.delete(key)
+        await self._invalidate_local(key)
+
         return n_deleted != 0
 
+    async def mget(self, keys: Sequence[str]) -> List[Optional[str]]:
+        """
+        Get several values in a single round trip
+        :param keys:
+        :return: values in the same order as keys, None for the keys not set
+        """
+        if not keys:
+            return []
+
+        values  = [None] * len(keys)
+        pending = []  # Positions to load from Redis
+
+        for i, key in enumerate(keys):
+            prefix = self.local.get_prefix(key) if self.local is not None else None
+            if prefix is not None:
+                found, values[i] = self.local.get(key, prefix)
+                if found:
+                    continue
+
+            pending.append(i)
+
+        if pending:
+            loaded = await self.conn.mget(*[keys[i] for i in pending])
+
+            for i, value in zip(pending, loaded):
+                values[i] = value
+                if value is not None and self.local is not None and self.local.get_prefix(keys[i]) is not None:
+                    self.local.set(keys[i], value)
+
+        return values
+
+    async def mset(
+            self,
+            items : Mapping[str, str],
+            ttl   : Union[int, Mapping[str, Optional[int]], None] = None
+    ) -> None:
+        """
+        Set several values in a single round trip, MSET doesn't allow expiration so a SET per key is pipelined
+        :param items: key -> value
+        :param ttl: seconds, the same for all the keys or a mapping key -> ttl (missing keys don't expire)
+        """
+        if not items:
+            return
+
+        pipe = self.conn.pipeline()
+        for key, value in items.items():
+            key_ttl = ttl.get(key) if isinstance(ttl, Mapping) else ttl
+            pipe.set(key, value, expire=key_ttl or 0)
+
+        self._invalidate_local_many(list(items.keys()), pipe)
+
+        await pipe.execute()
+
+    async def mdelete(self, keys: Sequence[str]) -> int:
+        """
+        Delete several keys in a single round trip
+        :return: number of keys found
+        """
+        if not keys:
+            return 0
+
+        pipe    = self.conn.pipeline()
+        deleted = pipe.delete(*keys)
+        self._invalidate_local_many(keys, pipe)
+
+        await pipe.execute()
+
+        return await deleted
+
+    async def get_or_compute(
+            self,
+            key          : str,
+            ttl          : int,
+            loader       : Callable[[], Awaitable[Union[str, bytes]]],
+            beta         : float = 1.0,
+            lock_timeout : float = 10
+    ) -> bytes:
+        """
+        Get a value or compute it with loader if not present, protecting the source from stampedes:
+
+        - Concurrent calls for the same key in this worker share a single computation
+        - Across workers only the one holding a Redis lock computes it, the others wait for the result
+        - The value is refreshed before it expires with a probability that increases when the expiry is close
+          and the computation is slow (XFetch), so hot keys are never missing
+
+        The value is stored with a small header (expiry and computation time), don't read the key with get()
+        :param key:
+        :param ttl: The ttl is expressed in seconds
+        :param loader: coroutine function returning the value to cache
+        :param beta: values > 1 favor earlier refreshes
+        :param lock_timeout: max seconds a worker waits for another one computing the same key
+        :return: the cached or computed value
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future( self._get_or_compute(key, ttl, loader, beta, lock_timeout) )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shielded, a cancelled caller must not cancel the computation shared with the others
+        return await asyncio.shield(task)
+
+    async def _get_or_compute(
+            self,
+            key          : str,
+            ttl          : int,
+            loader       : Callable[[], Awaitable[Union[str, bytes]]],
+            beta         : float,
+            lock_timeout : float
+    ) -> bytes:
+        raw = await self.get(key)
+
+        if raw is not None:
+            expiry_ts, delta, value = self._unpack_computed(raw)
+
+            if time.time() - delta * beta * math.log(1.0 - random.random()) < expiry_ts:
+                return value
+
+            lock_token = await self._acquire_lock(key, lock_timeout)
+            if lock_token is None:  # Another worker is refreshing it, meanwhile the current value is still valid
+                return value
+
+            return await self._compute(key, ttl, loader, lock_token)
+
+        lock_token = await self._acquire_lock(key, lock_timeout)
+        if lock_token is None:
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+
+                raw = await self.get(key)
+                if raw is not None:
+                    return self._unpack_computed(raw)[2]
+
+            # The worker holding the lock is too slow or died, we compute it without the lock
+
+        return await self._compute(key, ttl, loader, lock_token)
+
+    async def _compute(
+            self,
+            key        : str,
+            ttl        : int,
+            loader     : Callable[[], Awaitable[Union[str, bytes]]],
+            lock_token : Optional[str]
+    ) -> bytes:
+        try:
+            start = time.monotonic()
+            value = await loader()
+            if isinstance(value, str):
+                value = value.encode()
+
+            delta = time.monotonic() - start
+            await self.set(key, b'%.3f:%.3f:' % (time.time() + ttl, delta) + value, ttl=ttl)
+
+        finally:
+            if lock_token is not None:
+                await self.eval_script(RELEASE_LOCK_SCRIPT, keys=[f'{key}:lock'], args=[lock_token])
+
+        return value
+
+    async def _acquire_lock(self, key: str, timeout: float) -> Optional[str]:
+        """
+        :return: the lock token if acquired, needed to release it
+        """
+        token    = secrets.token_hex(8)
+        acquired = await self.conn.set(
+            f'{key}:lock',
+            token,
+            pexpire = int(timeout * 1000),
+            exist   = self.conn.SET_IF_NOT_EXIST
+        )
+
+        return token if acquired else None
+
+    @staticmethod
+    def _unpack_computed(raw: bytes) -> Tuple[float, float, bytes]:
+        expiry_ts, delta, value = raw.split(b':', 2)
+
+        return float(expiry_ts), float(delta), value
+
     async def get_from_hash(self, payload: Union[Mapping, str]) -> Tuple[str, str]:
         """
         This is used to calculate and get the value for a hash calculation given the contents of "payload" argument
@@ -84,6 +532,75 @@ class RedisCache(CacheAbstract):
         """
         return await self.conn.publish(channel, payload)
 
+    async def eval_script(self, script: str, keys: Sequence[str] = (), args: Sequence = ()):
+        """
+        Run a Lua script, the script is loaded once and called using its sha to avoid sending it every time
+        :param script: Lua source code
+        :param keys: keys touched by the script
+        :param args: extra arguments for the script
+        :return: the script result
+        """
+        sha = self._script_shas.get(script)
+        if sha is None:
+            sha = self._script_shas[script] = await self.conn.script_load(script)
+
+        try:
+            return await self.conn.evalsha(sha, keys=list(keys), args=list(args))
+
+        except aioredis.errors.ReplyError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+
+            # Redis was restarted or the scripts were flushed
+            self._script_shas[script] = await self.conn.script_load(script)
+
+            return await self.conn.evalsha(self._script_shas[script], keys=list(keys), args=list(args))
+
+    async def sliding_window(
+            self,
+            limits      : Mapping[str, Tuple[int, int]],
+            window      : int,
+            hit         : bool          = False,
+            max_backoff : int           = 0,
+            reserve     : bool          = False,
+            member      : Optional[str] = None
+    ) -> Tuple[float, List[int]]:
+        """
+        Check and optionally register a hit in several sliding windows with a single round trip
+        :param limits: window key -> (max hits in the window or 0 for no limit, backoff step in ms per hit)
+        :param window: window size in seconds
+        :param hit: if True the hit is added to every window before checking the limits
+        :param max_backoff: max backoff in ms, ignored for the keys over their limit
+        :param reserve: if True the hit is added only if it's allowed, in the same script that checks the limits,
+                        so concurrent callers can't all pass the check before any of them registers its hit. It
+                        can be given back with sliding_window_refund
+        :param member: id of the hit in the windows, needed to refund it, random by default
+        :return: seconds to wait before the next allowed hit (0 if allowed) and the hits count for each key
+        """
+        args = [
+            int(time.time() * 1000),
+            window * 1000,
+            2 if reserve else 1 if hit else 0,
+            member or secrets.token_hex(8),
+            max_backoff
+        ]
+        for limit, backoff_step in limits.values():
+            args.extend( (limit, backoff_step) )
+
+        retry_after_ms, *counts = await self.eval_script(SLIDING_WINDOW_SCRIPT, keys=list(limits.keys()), args=args)
+
+        return max(retry_after_ms, 0) / 1000, counts
+
+    async def sliding_window_refund(self, keys: Sequence[str], member: str) -> None:
+        """
+        Removes a hit reserved with sliding_window from the windows
+        :param keys: window keys
+        :param member: the member given to sliding_window
+        """
+        async with self.pipeline() as pipe:
+            for key in keys:
+                pipe.zrem(key, member)
+
     async def get_next(self, seq_name: str = '') -> int:
         """
         Get next value for a sequence name using the atomic operator incr
@@ -92,6 +609,17 @@ class RedisCache(CacheAbstract):
         """
         return await self.conn.incr(f'sequence_{seq_name}')
 
+    async def get_next_many(self, seq_name: str = '', count: int = 1) -> range:
+        """
+        Reserve several values of a sequence at once using the atomic operator incrby
+        :param seq_name: Name for the desired sequence
+        :param count: How many values to reserve
+        :return: The reserved values
+        """
+        last = await self.conn.incrby(f'sequence_{seq_name}', count)
+
+        return range(last - count + 1, last + 1)
+
 
 # singleton
 cache = RedisCache()
@@ -1,6 +1,10 @@
 from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List
+import pydantic
+import sqlalchemy as sa
 from sqlalchemy import Column, and_
 from ..controllers.base_ctrl import braceletBaseCtrl
+from ..controllers.patient_latest_vitals import PatientLatestVitalsCtrl
+from ..models import database_manager
 from ..models.alarm import Alarm
 from ..models.patients import Patient
 from ..models.query_builder import QueryBuilder
@@ -13,6 +17,78 @@ class AlarmCtrl(braceletBaseCtrl):
     Model       = Alarm
     OwnerColumn = Patient.Table.c.owner_user_id
 
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def create(
+            cls,
+            data                : Union[pydantic.BaseModel, Alarm, Dict],
+            validate            : bool = True,
+            embed_map           : Optional[Dict[str, Union[bool, Dict]]] = None,
+            with_transaction    : bool = True,
+            extra_args          : Mapping[str, Any] = {},
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {},
+            ignore_rel_entities : bool = False
+    ) -> Alarm:
+        """
+        The patient latest vitals are updated in the same transaction, see PatientLatestVitalsCtrl
+        """
+        async with database_manager.get_db_conn().transaction():
+            created = await super().create(
+                data,
+                validate            = validate,
+                embed_map           = embed_map,
+                with_transaction    = with_transaction,
+                extra_args          = extra_args,
+                dynamic_rel_context = dynamic_rel_context,
+                ignore_rel_entities = ignore_rel_entities
+            )
+
+            await PatientLatestVitalsCtrl.record_alarms([created])
+
+        return created
+
+    @classmethod
+    async def create_many(
+            cls,
+            data_list           : Sequence[Union[pydantic.BaseModel, Alarm, Dict]],
+            validate            : bool = True,
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List[Alarm]:
+        async with database_manager.get_db_conn().transaction():
+            created = await super().create_many(
+                data_list,
+                validate            = validate,
+                with_transaction    = with_transaction,
+                ignore_rel_entities = ignore_rel_entities
+            )
+
+            await PatientLatestVitalsCtrl.record_alarms(created)
+
+        return created
+
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def delete(
+            cls,
+            id               : Union[int, str, List[Union[int, str]]],
+            raise_not_found  : bool = True,
+            extra_args       : Mapping[str, Any] = {},
+            with_transaction : bool = True
+    ) -> None:
+        """
+        The patients whose latest alarm is deleted get the previous one
+        """
+        ids      = id if isinstance(id, list) else [id]
+        vitals_t = PatientLatestVitalsCtrl.Model.Table
+        query    = sa.select(vitals_t.c.patient_id).where( vitals_t.c.last_alarm_id.in_(ids) )
+
+        async with database_manager.get_db_conn().transaction():
+            patient_ids = [ record[0] for record in await database_manager.get_db_conn().fetch_all(query) ]
+
+            await super().delete(id, raise_not_found=raise_not_found, extra_args=extra_args, with_transaction=False)
+            await PatientLatestVitalsCtrl.refresh_alarms(patient_ids)
+
     # noinspection PyDefaultArgument
     @classmethod
     async def search(
@@ -4,14 +4,15 @@ import itertools
 import functools
 import urllib.parse
 
-from typing import List, Any, Dict, Union, Optional, Type, Mapping, Sequence, Tuple, TypeVar
-from sqlalchemy import join, select, Column, text, tuple_
+from typing import List, Any, Dict, Union, Optional, Type, Mapping, Sequence, Tuple, TypeVar, AsyncGenerator
+from sqlalchemy import join, select, Column, text, tuple_, cast, or_, Numeric
 from collections import defaultdict, OrderedDict
 
 from abc import ABC, abstractmethod
+from botocore.exceptions import ClientError
 from .storage import blob_storage_ctrl
 from .. import util, exceptions
-from ..models import database_manager, relation
+from ..models import database_manager, relation, DeclareCursor, unaccent_text
 from ..models.base_model import (
     TBaseModel,
     braceletBaseModel,
@@ -22,10 +23,14 @@ from ..models.base_model import (
 
 from ..models.query_builder import QueryBuilder, JoinMeta
 from ..models.relation import RelationType, Relation
-from ..models.storage import BlobOpType, SignedUrlRequest, SignedUrlResponse
+from ..models.storage import BlobOpType, SignedUrlRequest, SignedUrlResponse, MAX_UPLOAD_PARTS
 from ..models.users import UserAccount
 
 
+# Unique names for the server side cursors opened by braceletBaseCtrl.iterate
+_cursor_ids = itertools.count()
+
+
 class BaseCtrl(ABC):
     Model: Type[TBaseModel] = None
 
@@ -80,17 +85,15 @@ class BaseCtrl(ABC):
 
     @classmethod
     async def bulk_add_signed_display_url(cls, items: List[TBaseModel]):
-        for item in items:
-            try:
-                signed_response: SignedUrlResponse.GetSignedUrlResponse = await cls.generate_signed_url(
-                    operation = BlobOpType.get,
-                    blob_url  = item.url
-                )
-
-                item.blob_display_url = signed_response.display_url
+        paths = {
+            id(item): urllib.parse.urlparse(item.url).path.strip('/')
+            for item in items if item is not None and item.url
+        }
+        signed_urls = blob_storage_ctrl.get_signed_urls( list(paths.values()) )
 
-            except Exception:
-                pass
+        for item in items:
+            if id(item) in paths:
+                item.blob_display_url = signed_urls[ paths[id(item)] ]
 
     @classmethod
     async def generate_signed_url(
@@ -131,13 +134,13 @@ class BaseCtrl(ABC):
             assert data is not None and isinstance(data, SignedUrlRequest.PostSignedUrlRequest)
 
             post_id     = data.id if data.id else await cls.Model.get_next_primary_key_value()
-            post_path   = f'{prefix_url}/{post_id}/{data.filename}'
+            post_path   = cls.get_upload_path(prefix_url, post_id, data.filename)
             delete_url  = blob_storage_ctrl.get_delete_signed_url(post_path)
             display_url = blob_storage_ctrl.get_signed_url(post_path)
 
             if data.num_parts > 1:   # POST MULTIPART
-                upload_id, complete_url, abort_url = blob_storage_ctrl.get_multipart_data(post_path)
-                urls = blob_storage_ctrl.generate_parts_signed_url(
+                upload_id, complete_url, abort_url = await blob_storage_ctrl.get_multipart_data(post_path)
+                urls = await blob_storage_ctrl.generate_parts_signed_url(
                     upload_id = upload_id,
                     num_parts = data.num_parts,
                     path      = post_path
@@ -175,8 +178,8 @@ class BaseCtrl(ABC):
             delete_url = blob_storage_ctrl.get_delete_signed_url(path)
 
             if data.num_parts > 1:   # PUT MULTIPART
-                upload_id, complete_url, abort_url = blob_storage_ctrl.get_multipart_data(path)
-                urls = blob_storage_ctrl.generate_parts_signed_url(
+                upload_id, complete_url, abort_url = await blob_storage_ctrl.get_multipart_data(path)
+                urls = await blob_storage_ctrl.generate_parts_signed_url(
                     upload_id = upload_id,
                     num_parts = data.num_parts,
                     path      = path
@@ -207,6 +210,104 @@ class BaseCtrl(ABC):
         else:
             return None
 
+    @classmethod
+    def get_upload_path(cls, prefix_url: str, reserved_id: Union[int, str], filename: str) -> str:
+        """
+        Blob path of the files uploaded with a POST signed URL, the prefix must identify the owner so the
+        multipart operations built from it can't reach uploads of other users
+        """
+        return f'{prefix_url}/{reserved_id}/{filename}'
+
+    @staticmethod
+    def _raise_multipart_error(e: ClientError, upload_id: str):
+        code = e.response.get('Error', {}).get('Code')
+
+        if code == 'NoSuchUpload':
+            raise exceptions.NotFoundError()
+
+        raise exceptions.ValidationError(
+            loc  = ['upload_id', upload_id],
+            msg  = f'The multipart upload operation failed: {code}',
+            type = exceptions.ErrorType.BAD_REQUEST
+        )
+
+    @classmethod
+    async def get_multipart_parts(
+            cls,
+            prefix_url  : str,
+            reserved_id : int,
+            filename    : str,
+            upload_id   : str
+    ) -> SignedUrlResponse.MultipartPartsResponse:
+        """
+        Parts already uploaded, allows clients to resume an interrupted upload
+        """
+        path = cls.get_upload_path(prefix_url, reserved_id, filename)
+
+        try:
+            parts = await blob_storage_ctrl.list_parts(path, upload_id)
+        except ClientError as e:
+            cls._raise_multipart_error(e, upload_id)
+
+        # noinspection PyUnboundLocalVariable
+        return SignedUrlResponse.MultipartPartsResponse(upload_id=upload_id, parts=parts)
+
+    @classmethod
+    async def get_multipart_part_urls(
+            cls,
+            prefix_url  : str,
+            reserved_id : int,
+            filename    : str,
+            upload_id   : str,
+            first_part  : int,
+            count       : int
+    ) -> SignedUrlResponse.MultipartPartUrlsResponse:
+        """
+        Signed URLs for a range of parts, big uploads can request them by batches instead of all at once
+        """
+        count = min(count, MAX_UPLOAD_PARTS - first_part + 1)
+        urls  = await blob_storage_ctrl.generate_parts_signed_url(
+            upload_id  = upload_id,
+            num_parts  = count,
+            path       = cls.get_upload_path(prefix_url, reserved_id, filename),
+            first_part = first_part
+        )
+
+        return SignedUrlResponse.MultipartPartUrlsResponse(upload_id=upload_id, first_part=first_part, urls=urls)
+
+    @classmethod
+    async def complete_multipart_upload(
+            cls,
+            prefix_url : str,
+            upload_id  : str,
+            data       : SignedUrlRequest.CompleteMultipartRequest
+    ) -> SignedUrlResponse.GetSignedUrlResponse:
+        path  = cls.get_upload_path(prefix_url, data.reserved_id, data.filename)
+        parts = [ part.dict() for part in data.parts ] if data.parts is not None else None
+
+        try:
+            await blob_storage_ctrl.complete_multipart_upload(path, upload_id, parts)
+        except ClientError as e:
+            cls._raise_multipart_error(e, upload_id)
+
+        return SignedUrlResponse.GetSignedUrlResponse( display_url=blob_storage_ctrl.get_signed_url(path) )
+
+    @classmethod
+    async def abort_multipart_upload(
+            cls,
+            prefix_url  : str,
+            reserved_id : int,
+            filename    : str,
+            upload_id   : str
+    ) -> None:
+        try:
+            await blob_storage_ctrl.abort_multipart_upload(
+                cls.get_upload_path(prefix_url, reserved_id, filename),
+                upload_id
+            )
+        except ClientError as e:
+            cls._raise_multipart_error(e, upload_id)
+
     @classmethod
     def list_to_id_map(cls, items: List[TBaseModel]) -> Dict:
         pkey_col_names = [pk_column.name for pk_column in cls.Model.Table.primary_key.columns.values()]
@@ -311,6 +412,22 @@ class braceletRedisCtrl(BaseCtrl):
         """
         return await cls.Model.get_static(id, raise_not_found=raise_not_found)
 
+    @classmethod
+    async def get_many(
+            cls,
+            ids             : Sequence[Union[int, str]],
+            raise_not_found : bool = False
+    ) -> List[Optional[TbraceletRedisModel]]:
+        """
+        Get several records from Redis with a single round trip
+
+        :param ids: records ids
+        :param raise_not_found: raise not found error if any of the records is not found
+
+        :return: records in the same order as ids, None for the missing ones
+        """
+        return await cls.Model.get_many_static(ids, raise_not_found=raise_not_found)
+
     @classmethod
     async def delete(cls, id: Union[int, str], raise_not_found : bool = True) -> None:
         await cls.Model.delete_static(id, raise_not_found=raise_not_found)
@@ -325,6 +442,16 @@ class braceletRedisCtrl(BaseCtrl):
 
         return await cls.Model.save_static(prep_data)
 
+    @classmethod
+    async def create_many(
+            cls,
+            data_list : Sequence[Union[pydantic.BaseModel, TbraceletRedisModel, Dict]],
+            validate  : bool = True
+    ) -> List[TbraceletRedisModel]:
+        prep_data_list = [cls._prepare_data(data, cls.Model.CreateValidator, validate=validate) for data in data_list]
+
+        return await cls.Model.save_many_static(prep_data_list)
+
     @classmethod
     async def update(
             cls,
@@ -602,6 +729,59 @@ class braceletBaseCtrl(BaseCtrl):
 
         return builder
 
+    # noinspection PyDefaultArgument
+    @classmethod
+    def apply_fts_sort_builder(
+            cls,
+            builder    : QueryBuilder,
+            fts        : str,
+            fields_map : Dict[Union[str, Column], Any] = {},
+            sort_map   : OrderedDict                   = {}
+    ) -> QueryBuilder:
+        """
+        Filter the records whose Model.SearchDocument is similar to the text and sort them by trigram distance. The
+        document is a generated column with its own GIN trigram index, so only the search text is unaccented here
+        """
+        model_t  = cls.Model.Table
+        document = cls.Model.SearchDocument
+        fts_text = unaccent_text(fts)
+
+        # We use to filter both % and %>, the later being word similarity, this is needed to find small search texts
+        # the full document is too big to search in all the text with only a keyword, you don't pass the threshold.
+        # It's a derived table so match_distance is a real column that the pagination can use in its conditions
+        fts_query = select([
+            model_t.c.id,
+            cast(
+                document.op('<->')(fts_text),
+                Numeric(5, 4)
+            ).label('match_distance')
+        ]).select_from(
+            model_t
+        ).where(
+            or_(
+                document.op('%')(fts_text),
+                document.op('%>')(fts_text)
+            )
+        ).alias('fts')
+
+        builder = builder.add_join(
+            JoinMeta(
+                table    = fts_query,
+                onclause = JoinMeta.OnClause(
+                    left  = model_t.c.id,
+                    right = fts_query.c.id
+                )
+            )
+        )
+
+        return cls.apply_special_sort(
+            builder    = builder,
+            column     = fts_query.c.match_distance,
+            sort_order = 'asc',
+            fields_map = fields_map,
+            sort_map   = sort_map
+        )
+
     # noinspection PyDefaultArgument, Duplicates
     @classmethod
     async def apply_embed(
@@ -911,25 +1091,22 @@ class braceletBaseCtrl(BaseCtrl):
 
     # noinspection PyDefaultArgument
     @classmethod
-    async def search(
+    def _build_search_query(
             cls,
-            builder            : QueryBuilder                  = None,
-            fields_map         : Dict[Union[str, Column], Any] = {},
-            embed_map          : Dict[str, Union[bool, Dict]]  = {},
-            sort_map           : Union[OrderedDict, Dict]      = {},
-            reverse_query_sort : bool                          = False,
-            reverse_records    : bool                          = False,
-            limit              : Optional[int]                 = None,
-            offset             : Optional[int]                 = None,
-            where_conds        : Sequence[Tuple[str, Mapping]] = (),
-            extra_args         : Dict[str, Any]                = {},  # This is added to allow flexibility in children
-            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
-    ) -> Tuple[List[TbraceletModel], bool]:
+            builder             : Optional[QueryBuilder],
+            fields_map          : Dict[Union[str, Column], Any],
+            sort_map            : Union[OrderedDict, Dict],
+            reverse_query_sort  : bool,
+            limit               : Optional[int],
+            offset              : Optional[int],
+            where_conds         : Sequence[Tuple[str, Mapping]],
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ]
+    ) -> QueryBuilder:
         if not builder:
             builder = QueryBuilder(cls.Model)
 
         if limit:
-            builder = builder.limit(limit + 1)
+            builder = builder.limit(limit)
 
         if offset:
             builder = builder.offset(offset)
@@ -947,6 +1124,47 @@ class braceletBaseCtrl(BaseCtrl):
         for where_text, values in where_conds:
             builder = builder.where( text(where_text).bindparams(**values) )
 
+        return builder
+
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def search(
+            cls,
+            builder            : QueryBuilder                  = None,
+            fields_map         : Dict[Union[str, Column], Any] = {},
+            embed_map          : Dict[str, Union[bool, Dict]]  = {},
+            sort_map           : Union[OrderedDict, Dict]      = {},
+            reverse_query_sort : bool                          = False,
+            reverse_records    : bool                          = False,
+            limit              : Optional[int]                 = None,
+            offset             : Optional[int]                 = None,
+            where_conds        : Sequence[Tuple[str, Mapping]] = (),
+            extra_args         : Dict[str, Any]                = {},  # This is added to allow flexibility in children
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
+    ) -> Tuple[List[TbraceletModel], bool]:
+        """
+        :param extra_args: 'fts' is a text to search in Model.SearchDocument, the results are sorted by similarity
+        """
+        fts_text = extra_args.get('fts')
+        if fts_text is not None and cls.Model.SearchDocument is not None:
+            builder = cls.apply_fts_sort_builder(
+                builder    = builder or QueryBuilder(cls.Model),
+                fts        = fts_text,
+                fields_map = fields_map,
+                sort_map   = sort_map
+            )
+
+        builder = cls._build_search_query(
+            builder             = builder,
+            fields_map          = fields_map,
+            sort_map            = sort_map,
+            reverse_query_sort  = reverse_query_sort,
+            limit               = limit + 1 if limit else None,
+            offset              = offset,
+            where_conds         = where_conds,
+            dynamic_rel_context = dynamic_rel_context
+        )
+
         db_records   = await database_manager.get_db_conn().fetch_all(builder.build())
         records      = db_records[:limit]
         is_last_page = len(db_records) == len(records)
@@ -966,6 +1184,71 @@ class braceletBaseCtrl(BaseCtrl):
 
         return records, is_last_page
 
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def iterate(
+            cls,
+            builder             : QueryBuilder                  = None,
+            fields_map          : Dict[Union[str, Column], Any] = {},
+            embed_map           : Dict[str, Union[bool, Dict]]  = {},
+            sort_map            : Union[OrderedDict, Dict]      = {},
+            limit               : Optional[int]                 = None,
+            where_conds         : Sequence[Tuple[str, Mapping]] = (),
+            batch_size          : int                           = 500,
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
+    ) -> AsyncGenerator[TbraceletModel, None]:
+        """
+        Streams the records of a search using a server side cursor, for exports and background jobs where
+        the whole result doesn't fit in memory. The rows are fetched and embedded by batches.
+
+        The cursor lives in a transaction of the current connection, opened while iterating, the consumer
+        can run other queries between records (they are done in the same transaction)
+
+        :param builder: pre-filtered builder, children filters applied by search(extra_args) are not applied here
+        :param batch_size: rows fetched from the cursor, and embedded, at once
+        """
+        builder = cls._build_search_query(
+            builder             = builder,
+            fields_map          = fields_map,
+            sort_map            = sort_map,
+            reverse_query_sort  = False,
+            limit               = limit,
+            offset              = None,
+            where_conds         = where_conds,
+            dynamic_rel_context = dynamic_rel_context
+        )
+        query       = builder.build()
+        cursor_name = f'iterate_{cls.Model.Table.name}_{next(_cursor_ids)}'
+        fetch_query = text(f'FETCH {int(batch_size)} FROM {cursor_name}').columns(*query.selected_columns)
+        db_conn     = database_manager.get_db_conn()
+
+        # Database.iterate can't be used, it holds the connection lock until the end and embeds would deadlock
+        async with db_conn.transaction():
+            await db_conn.execute( DeclareCursor(cursor_name, query) )
+
+            while True:
+                db_records = await db_conn.fetch_all(fetch_query)
+                if not db_records:
+                    break
+
+                records = list( cls.Model.from_db_multi(db_records) )
+
+                if embed_map:
+                    await cls.apply_embed(
+                        records,
+                        fields_map,
+                        embed_map,
+                        dynamic_rel_context = dynamic_rel_context
+                    )
+
+                for record in records:
+                    yield record
+
+                if len(db_records) < batch_size:
+                    break
+
+            await db_conn.execute(f'CLOSE {cursor_name}')
+
     # noinspection PyDefaultArgument
     @classmethod
     async def get(
@@ -1049,15 +1332,61 @@ class braceletBaseCtrl(BaseCtrl):
             ignore_rel_entities = ignore_rel_entities
         )
 
-        if not embed_map:
-            return created
+        return await cls._embed_saved(created, embed_map, dynamic_rel_context)
+
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def _embed_saved(
+            cls,
+            record              : Optional[TbraceletModel],
+            embed_map           : Optional[Dict[str, Union[bool, Dict]]],
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
+    ) -> Optional[TbraceletModel]:
+        """
+        The records returned by the save methods come from INSERT/UPDATE ... RETURNING, so they are already
+        complete, the DB is only queried again to load the requested embeds
+        """
+        if record is not None and embed_map:
+            await cls.apply_embed([record], None, embed_map, dynamic_rel_context=dynamic_rel_context)
+
+        return record
+
+    @classmethod
+    async def create_many(
+            cls,
+            data_list           : Sequence[Union[pydantic.BaseModel, TbraceletModel, Dict]],
+            validate            : bool = True,
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List[TbraceletModel]:
+        prep_data_list = [cls._prepare_data(data, cls.Model.CreateValidator, validate=validate) for data in data_list]
+
+        return await cls.Model.save_many_static(
+            prep_data_list,
+            with_transaction    = with_transaction,
+            ignore_rel_entities = ignore_rel_entities
+        )
 
-        created    = created.dict()
-        created_id = []
-        for col in cls.Model.get_primary_key_columns():
-            created_id.append( created[ col.name ] )
+    @classmethod
+    async def update_many(
+            cls,
+            data_list           : Sequence[Union[pydantic.BaseModel, TbraceletModel, Dict]],
+            validate            : bool = True,
+            raise_not_found     : bool = True,
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List[Optional[TbraceletModel]]:
+        """
+        The ids are taken from the primary key columns of every item
+        """
+        prep_data_list = [cls._prepare_data(data, cls.Model.UpdateValidator, validate=validate) for data in data_list]
 
-        return await cls.get(created_id, embed_map=embed_map, dynamic_rel_context=dynamic_rel_context)
+        return await cls.Model.update_many_static(
+            prep_data_list,
+            raise_not_found     = raise_not_found,
+            with_transaction    = with_transaction,
+            ignore_rel_entities = ignore_rel_entities
+        )
 
     @classmethod
     def _check_id_in_sync(
@@ -1092,7 +1421,6 @@ class braceletBaseCtrl(BaseCtrl):
             ignore_rel_entities : bool = False  # Used when we don't want to automatically update related entities
     ) -> Optional[TbraceletModel]:
         prep_data = cls._prepare_data(data, cls.Model.UpdateValidator, validate=validate)
-        print('merge??', id,prep_data)
         cls._check_id_in_sync(id, prep_data)
 
         updated = await cls.Model.update_static(
@@ -1103,10 +1431,7 @@ class braceletBaseCtrl(BaseCtrl):
             ignore_rel_entities = ignore_rel_entities
         )
 
-        if embed_map is not None:
-            updated = await cls.get(id, embed_map=embed_map, dynamic_rel_context=dynamic_rel_context)
-
-        return updated
+        return await cls._embed_saved(updated, embed_map, dynamic_rel_context)
 
     # noinspection PyDefaultArgument
     @classmethod
@@ -1131,10 +1456,7 @@ class braceletBaseCtrl(BaseCtrl):
             raise_not_found  = raise_not_found,
             with_transaction = with_transaction
         )
-        if embed_map is not None:
-            merged = await cls.get(id, embed_map=embed_map, dynamic_rel_context=dynamic_rel_context)
-
-        return merged
+        return await cls._embed_saved(merged, embed_map, dynamic_rel_context)
 
     # noinspection PyDefaultArgument
     @classmethod
@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import logging
+
+import aioredis
+import orjson
+
+from collections import defaultdict
+from typing import Optional, Dict, Set, Any, AsyncIterator
+
+from bracelet_lib.cache import cache
+from bracelet_lib.models.common import StrEnum
+
+
+logger = logging.getLogger('bracelet_lib.chat_events')
+
+
+class ChatEventType(StrEnum):
+    message = 'message'  # Created message, published by MessageCtrl.create
+    typing  = 'typing'
+    read    = 'read'     # The user has read the messages until message_id
+
+
+class ChatSubscription:
+    """
+    Events of a chat for one websocket, a None event means the subscription was dropped (the client was too slow
+    or the Redis subscription was lost) and the client must reconnect and reload the history
+    """
+
+    def __init__(self, chat_id: int, max_size: int):
+        self.chat_id = chat_id
+        self.queue   : asyncio.Queue = asyncio.Queue(max_size)
+        self.dropped : bool          = False
+
+    def push(self, event: Optional[Dict[str, Any]]) -> bool:
+        if self.dropped:
+            return True
+
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def drop(self) -> None:
+        self.dropped = True
+
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+        self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        return await self.queue.get()
+
+
+class ChatEventsHub:
+    """
+    Fan-out of the chat events between the API workers: the events are published in a single Redis channel and
+    each worker keeps one subscription, dispatching every event to the websockets of its chat opened in the worker
+    """
+    Channel         : str = 'chat-events'
+    ResubscribeWait : int = 1
+
+    def __init__(self):
+        self.queue_size     : int = 100
+        self._subscriptions : Dict[int, Set[ChatSubscription]] = defaultdict(set)
+        self._listen_task   : Optional[asyncio.Task]           = None
+
+    def init(self, queue_size: int = 100):
+        """
+        :param queue_size: max events waiting to be sent to a websocket, it's dropped if it doesn't keep up
+        """
+        self.queue_size = queue_size
+
+    def start(self) -> None:
+        if self._listen_task is None:
+            self._listen_task = asyncio.get_running_loop().create_task( self._listen() )
+
+    async def close(self) -> None:
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+            self._listen_task = None
+
+        self._drop_all()
+
+    async def publish(self, chat_id: int, event_type: ChatEventType, data: Dict[str, Any]) -> None:
+        await cache.publish(self.Channel, orjson.dumps({
+            'type'    : event_type,
+            'chat_id' : chat_id,
+            **data
+        }))
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, chat_id: int) -> AsyncIterator[ChatSubscription]:
+        subscription = ChatSubscription(chat_id, self.queue_size)
+        self._subscriptions[chat_id].add(subscription)
+
+        try:
+            yield subscription
+        finally:
+            chat_subscriptions = self._subscriptions.get(chat_id)
+            if chat_subscriptions is not None:
+                chat_subscriptions.discard(subscription)
+                if not chat_subscriptions:
+                    del self._subscriptions[chat_id]
+
+    def _drop_all(self) -> None:
+        for chat_subscriptions in self._subscriptions.values():
+            for subscription in chat_subscriptions:
+                subscription.drop()
+
+    def _dispatch(self, raw: bytes) -> None:
+        try:
+            event   = orjson.loads(raw)
+            chat_id = event['chat_id']
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            logger.warning(f'Invalid chat event: {raw!r}')
+            return
+
+        for subscription in tuple( self._subscriptions.get(chat_id, ()) ):
+            if not subscription.push(event):
+                logger.warning(f'Chat {chat_id} websocket too slow, its subscription is dropped')
+                subscription.drop()
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                channel, = await cache.conn.subscribe(self.Channel)
+
+                while await channel.wait_message():
+                    self._dispatch( await channel.get() )
+
+                logger.warning('Chat events channel closed')
+
+            except asyncio.CancelledError:
+                with contextlib.suppress(aioredis.errors.RedisError, ConnectionError):
+                    await cache.conn.unsubscribe(self.Channel)
+                raise
+            except (aioredis.errors.RedisError, ConnectionError) as e:
+                logger.warning(f'Chat events subscription error: {e}')
+
+            # Events could be lost until the new subscription, the clients reconnect and reload what they missed
+            self._drop_all()
+            await asyncio.sleep(self.ResubscribeWait)
+
+
+# singleton
+chat_events_hub = ChatEventsHub()
@@ -1,12 +1,21 @@
+import logging
+
 from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List
 import sqlalchemy as sa
 from sqlalchemy import Column, or_, asc, desc
 
 from ..controllers.base_ctrl import braceletBaseCtrl
+from ..controllers.chat_events import chat_events_hub, ChatEventType
+from ..models import database_manager
 from ..models.chats import Chat
+from ..models.messages import Message
 from ..models.users import UserAccount
 from ..models.query_builder import QueryBuilder, JoinMeta
 
+
+logger = logging.getLogger('bracelet_lib.chats')
+
+
 class ChatCtrl(braceletBaseCtrl):
     """
     Controller for Chat model. Soporta CRUD, filtrado por participante
@@ -15,6 +24,159 @@ class ChatCtrl(braceletBaseCtrl):
     Model       = Chat
     OwnerColumn = None
 
+    @classmethod
+    async def is_participant(cls, chat_id: int, user_id: int) -> bool:
+        """
+        Comprueba si el usuario es uno de los dos participantes del chat
+        """
+        query = sa.select(cls.Model.Table.c.id).where(
+            cls.Model.Table.c.id == chat_id,
+            or_(cls.Model.Table.c.user1_id == user_id, cls.Model.Table.c.user2_id == user_id)
+        )
+
+        return await database_manager.get_db_conn().fetch_val(query) is not None
+
+    @staticmethod
+    def has_unread(chat: Union[Chat, Chat.FullValidator], user_id: int) -> bool:
+        """
+        True si el chat tiene mensajes que el usuario no ha leído, sin consultar la tabla de mensajes
+        """
+        if chat.last_message_id is None:
+            return False
+
+        if user_id == chat.user1_id:
+            last_read = chat.user1_last_read_message_id
+        else:
+            last_read = chat.user2_last_read_message_id
+
+        return last_read is None or last_read < chat.last_message_id
+
+    @classmethod
+    async def set_last_message(cls, message: Message) -> None:
+        """
+        Registra el mensaje como último del chat si es posterior al actual (por ts e id), el remitente lo ha leído.
+        Se llama desde MessageCtrl.create, en la misma transacción que el insert
+        """
+        chat_t   = cls.Model.Table
+        is_newer = sa.or_(
+            chat_t.c.last_message_ts.is_(None),
+            sa.tuple_(chat_t.c.last_message_ts, chat_t.c.last_message_id) < sa.tuple_(message.ts, message.id)
+        )
+
+        query = sa.update(chat_t).where(
+            chat_t.c.id == message.chat_id
+        ).values(
+            last_message_id = sa.case((is_newer, message.id), else_=chat_t.c.last_message_id),
+            last_message_ts = sa.case((is_newer, message.ts), else_=chat_t.c.last_message_ts),
+            **cls._last_read_values(message.sender_id, message.id)
+        )
+
+        await database_manager.get_db_conn().execute(query)
+
+    @classmethod
+    def _last_read_values(cls, user_id: Optional[int], message_id: Union[int, sa.sql.ColumnElement]) -> Dict:
+        """
+        Valores del UPDATE que avanzan el último mensaje leído del participante user_id, nunca retroceden
+        """
+        chat_t = cls.Model.Table
+        values = {}
+
+        if user_id is None:
+            return values
+
+        for user_col, last_read_col in (
+                (chat_t.c.user1_id, chat_t.c.user1_last_read_message_id),
+                (chat_t.c.user2_id, chat_t.c.user2_last_read_message_id)
+        ):
+            values[last_read_col.name] = sa.case(
+                (user_col == user_id, sa.func.greatest(last_read_col, message_id)),  # greatest ignores NULL
+                else_ = last_read_col
+            )
+
+        return values
+
+    @classmethod
+    async def mark_read(cls, chat_id: int, user_id: int, message_id: int) -> Optional[int]:
+        """
+        Avanza el último mensaje leído por el usuario, limitado al último mensaje del chat, y lo notifica a los
+        websockets del chat
+        :return: el último mensaje leído por el usuario o None si no participa en el chat
+        """
+        chat_t    = cls.Model.Table
+        # NULL (nothing to advance) if the chat has no messages
+        last_read = sa.case(
+            (chat_t.c.last_message_id.isnot(None), sa.func.least(message_id, chat_t.c.last_message_id))
+        )
+
+        query = sa.update(chat_t).where(
+            chat_t.c.id == chat_id,
+            or_(chat_t.c.user1_id == user_id, chat_t.c.user2_id == user_id)
+        ).values(
+            **cls._last_read_values(user_id, last_read)
+        ).returning(
+            sa.case(
+                (chat_t.c.user1_id == user_id, chat_t.c.user1_last_read_message_id),
+                else_ = chat_t.c.user2_last_read_message_id
+            )
+        )
+
+        last_read_id = await database_manager.get_db_conn().fetch_val(query)
+
+        # La notificación es best effort, la lectura ya está guardada
+        if last_read_id is not None:
+            try:
+                await chat_events_hub.publish(
+                    chat_id,
+                    ChatEventType.read,
+                    { 'user_id': user_id, 'message_id': last_read_id }
+                )
+            except Exception as e:
+                logger.warning(f'Error publishing the read message {last_read_id} of the chat {chat_id}: {e}')
+
+        return last_read_id
+
+    @classmethod
+    async def refresh_last_message(cls, chat_ids: Sequence[int]) -> None:
+        """
+        Recalcula el último mensaje de los chats, usado cuando se borran mensajes
+        """
+        if not chat_ids:
+            return
+
+        chat_t = cls.Model.Table
+        msg_t  = Message.Table
+
+        def last_message_col(col):
+            return sa.select(col).where(
+                msg_t.c.chat_id == chat_t.c.id
+            ).order_by(
+                msg_t.c.ts.desc(), msg_t.c.id.desc()
+            ).limit(1).scalar_subquery()
+
+        query = sa.update(chat_t).where(
+            chat_t.c.id.in_(chat_ids)
+        ).values(
+            last_message_id = last_message_col(msg_t.c.id),
+            last_message_ts = last_message_col(msg_t.c.ts)
+        )
+
+        await database_manager.get_db_conn().execute(query)
+
+    @classmethod
+    async def get_last_messages(cls, chats: Sequence[Union[Chat, Chat.FullValidator]]) -> Dict[int, Message]:
+        """
+        Últimos mensajes de los chats con una sola consulta por clave primaria
+        :return: chat_id -> último mensaje
+        """
+        message_ids = [ chat.last_message_id for chat in chats if chat.last_message_id is not None ]
+        if not message_ids:
+            return {}
+
+        query    = sa.select(Message.Table).where( Message.Table.c.id.in_(message_ids) )
+        messages = Message.from_db_multi( await database_manager.get_db_conn().fetch_all(query) )
+
+        return { message.chat_id: message for message in messages }
+
     @classmethod
     async def _check_administration_status(cls, user1_id: int, user2_id: int) -> bool:
         """
@@ -106,6 +268,7 @@ class ChatCtrl(braceletBaseCtrl):
 
         return {
             'create_ts'        : chat_t.c.create_ts,
+            'last_message_ts'  : chat_t.c.last_message_ts,
             'administration'   : chat_t.c.administration,
             'other_first_name' : user_t.c.first_name,
             'other_last_name'  : user_t.c.last_name,
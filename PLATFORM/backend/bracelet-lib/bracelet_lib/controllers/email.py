@@ -1,17 +1,76 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+
 import aiosmtplib
+import orjson
 
 from email.header import Header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr, formatdate
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Any
 from mako import exceptions as mako_exceptions
+from mako.lookup import TemplateLookup
 from mako.template import Template
 
+from bracelet_lib.cache import cache
 from bracelet_lib.exceptions import EmailException
 
 
+logger = logging.getLogger('bracelet_lib.email')
+
+
+# Move the retries whose time has come back to the queue
+MOVE_DUE_RETRIES_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+    redis.call('LPUSH', KEYS[2], unpack(due))
+end
+return #due
+"""
+
+
+# Move back to the queue the emails of a processing list
+# KEYS: processing list, queue
+REQUEUE_PROCESSING_SCRIPT = """
+local moved = 0
+while redis.call('RPOPLPUSH', KEYS[1], KEYS[2]) do
+    moved = moved + 1
+end
+return moved
+"""
+
+
+# Move back to the queue the emails taken by workers whose heartbeat expired (the process died while sending them)
+# KEYS: workers set, queue
+# ARGV: processing list prefix, heartbeat key prefix
+RECOVER_ORPHANS_SCRIPT = """
+local recovered = 0
+for _, worker_id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if redis.call('EXISTS', ARGV[2] .. worker_id) == 0 then
+        while redis.call('RPOPLPUSH', ARGV[1] .. worker_id, KEYS[2]) do
+            recovered = recovered + 1
+        end
+        redis.call('SREM', KEYS[1], worker_id)
+    end
+end
+return recovered
+"""
+
+
 class EmailCtrl:
+    QueueKey         : str = 'email-queue'             # list, LPUSH to queue and BRPOPLPUSH to consume
+    RetryKey         : str = 'email-queue-retry'       # sorted set, scored with the time of the next attempt
+    FailedKey        : str = 'email-queue-failed'      # list, emails discarded after all the attempts
+    WorkersKey       : str = 'email-queue-workers'     # set, ids of the workers consuming the queue
+    ProcessingPrefix : str = 'email-queue-processing-' # list per worker, emails taken and not sent yet
+    HeartbeatPrefix  : str = 'email-queue-worker-'     # key per worker, its processing list is recovered if expired
+    PollSeconds      : int = 5                         # BRPOPLPUSH timeout, the retries are checked between polls
+    HeartbeatSeconds : int = 60                        # refreshed on every poll and sent email
 
     # noinspection PyTypeChecker
     def __init__(self):
@@ -24,6 +83,17 @@ class EmailCtrl:
         self.email_enable_ssl     : bool = None
         self.email_enable_tls     : bool = None
         self.email_template_dir   : str  = None
+        self.queue_batch_size     : int  = None
+        self.queue_max_attempts   : int  = None
+        self.queue_retry_seconds  : int  = None
+        self.smtp_idle_seconds    : int  = None
+
+        self._templates   : Optional[TemplateLookup]      = None
+        self._smtp        : Optional[aiosmtplib.SMTP]     = None
+        self._smtp_lock   : asyncio.Lock                  = asyncio.Lock()
+        self._smtp_used   : float                         = 0
+        self._worker_task : Optional[asyncio.Task]        = None
+        self._worker_id   : str                           = secrets.token_hex(8)
 
     def init(
             self,
@@ -35,8 +105,19 @@ class EmailCtrl:
             email_password       : str,
             email_enable_ssl     : bool = True,
             email_enable_tls     : bool = False,
-            email_template_dir   : str  = None
+            email_template_dir   : str  = None,
+            queue_batch_size     : int  = 20,
+            queue_max_attempts   : int  = 5,
+            queue_retry_seconds  : int  = 30,
+            smtp_idle_seconds    : int  = 60
     ):
+        """
+        :param email_template_dir: the .mako files in this directory are compiled here, once
+        :param queue_batch_size: max emails taken from the queue and sent with the same SMTP connection
+        :param queue_max_attempts: attempts to send a queued email before moving it to FailedKey
+        :param queue_retry_seconds: delay of the first retry, doubled on each attempt
+        :param smtp_idle_seconds: the SMTP connection is kept open between emails until it's idle this time
+        """
         self.email_smtp_hostname   = email_smtp_hostname
         self.email_smtp_port       = email_smtp_port
         self.email_from_real_name  = email_from_real_name
@@ -46,41 +127,74 @@ class EmailCtrl:
         self.email_enable_ssl      = email_enable_ssl
         self.email_enable_tls      = email_enable_tls
         self.email_template_dir    = email_template_dir
+        self.queue_batch_size      = queue_batch_size
+        self.queue_max_attempts    = queue_max_attempts
+        self.queue_retry_seconds   = queue_retry_seconds
+        self.smtp_idle_seconds     = smtp_idle_seconds
+
+        self._load_templates()
 
     @property
     def is_configured(self):
         return self.email_smtp_hostname is not None
 
-    @staticmethod
-    def render_tpl(tpl: str, tpl_data: Dict):
-        mako_tpl = Template(tpl, input_encoding='utf-8')
+    def _load_templates(self) -> None:
+        """
+        Compile all the templates at startup, the lookup keeps them in memory and doesn't check the files again
+        """
+        if not self.email_template_dir:
+            return
+
+        self._templates = TemplateLookup(
+            directories       = [self.email_template_dir],
+            input_encoding    = 'utf-8',
+            filesystem_checks = False
+        )
+
+        if os.path.isdir(self.email_template_dir):
+            for fname in sorted(os.listdir(self.email_template_dir)):
+                if fname.endswith('.mako'):
+                    self._templates.get_template(fname)
 
+    @staticmethod
+    def _render(mako_tpl: Template, tpl_data: Dict) -> str:
         try:
             rendered = mako_tpl.render(**tpl_data)
         except Exception:
-            print( mako_exceptions.text_error_template().render() )
+            logger.error( mako_exceptions.text_error_template().render() )
             raise  # stop here
 
         return rendered
 
-    async def send_email(
+    @classmethod
+    def render_tpl(cls, tpl: str, tpl_data: Dict) -> str:
+        """
+        Render a template source, it's compiled on each call, use render_template for the files in
+        email_template_dir
+        """
+        return cls._render(Template(tpl, input_encoding='utf-8'), tpl_data)
+
+    def render_template(self, tpl_fname: str, tpl_data: Dict) -> str:
+        """
+        Render a template of email_template_dir using its compiled version
+        :param tpl_fname: file name of the template, ex: email_unlock_account.mako
+        """
+        if self._templates is None:
+            raise EmailException(
+                error             = 'email_templates_not_configured',
+                error_description = 'Email templates directory not configured'
+            )
+
+        return self._render(self._templates.get_template(tpl_fname), tpl_data)
+
+    def build_message(
             self,
             subject   : str,
             to        : List[str],
             body_txt  : str           = 'Please open this email in an mail client capable of HTML rendering',
             body_html : Optional[str] = None,
             charset   : str           = "utf-8"
-    ):
-        """
-        Function to send email using smtp server
-        :return:
-        """
-        if not self.is_configured:
-            raise EmailException(
-                error             = 'smtp_not_configured',
-                error_description = 'SMTP Server not configured properly'
-            )
-
+    ) -> MIMEMultipart:
         mail    = MIMEMultipart()
         content = MIMEText(body_txt, 'plain', _charset=charset)
 
@@ -96,37 +210,263 @@ class EmailCtrl:
         mail['To']      = ', '.join(to)
         mail['Subject'] = Header(subject, charset)
 
-        try:
-            # print({
-            #     "hostname"  : self.email_smtp_hostname,
-            #     "port"      : self.email_smtp_port,
-            #     "username"  : self.email_user_account,
-            #     "password"  : self.email_password,
-            #     "use_tls"   : self.email_enable_ssl,
-            #     "start_tls" : self.email_enable_tls
-            # })
-
-            await aiosmtplib.send(
-                mail,
-                hostname  = self.email_smtp_hostname,
-                port      = self.email_smtp_port,
-                username  = self.email_user_account,
-                password  = self.email_password,
-                use_tls   = self.email_enable_ssl,
-                start_tls = self.email_enable_tls
+        return mail
+
+    def _check_configured(self) -> None:
+        if not self.is_configured:
+            raise EmailException(
+                error             = 'smtp_not_configured',
+                error_description = 'SMTP Server not configured properly'
             )
+
+    async def _get_smtp(self) -> aiosmtplib.SMTP:
+        """
+        Shared SMTP connection, it's opened again if the server closed it
+        """
+        async with self._smtp_lock:
+            if self._smtp is None or not self._smtp.is_connected:
+                smtp = aiosmtplib.SMTP(
+                    hostname  = self.email_smtp_hostname,
+                    port      = self.email_smtp_port,
+                    username  = self.email_user_account,
+                    password  = self.email_password,
+                    use_tls   = self.email_enable_ssl,
+                    start_tls = self.email_enable_tls
+                )
+                await smtp.connect()
+                self._smtp = smtp
+
+            self._smtp_used = time.monotonic()
+
+            return self._smtp
+
+    async def _close_smtp(self) -> None:
+        async with self._smtp_lock:
+            smtp, self._smtp = self._smtp, None
+
+            if smtp is not None and smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except aiosmtplib.errors.SMTPException:
+                    smtp.close()
+
+    async def _send_message(self, mail: MIMEMultipart) -> None:
+        try:
+            smtp = await self._get_smtp()
+            try:
+                await smtp.send_message(mail)
+            except aiosmtplib.errors.SMTPServerDisconnected:
+                # The server closed the idle connection, one more try with a new one
+                smtp = await self._get_smtp()
+                await smtp.send_message(mail)
+
         except aiosmtplib.errors.SMTPAuthenticationError:
+            await self._close_smtp()
             raise EmailException(
                 error             = 'email_login_error',
                 error_description = 'Error when try to login to smtp host'
             )
+        except aiosmtplib.errors.SMTPRecipientsRefused:
+            raise EmailException(
+                error             = 'email_recipients_refused',
+                error_description = 'All the recipients were refused by the smtp host'
+            )
         except aiosmtplib.errors.SMTPException as e:
-            print(e)
+            logger.warning(f'Error sending email: {e}')
+            await self._close_smtp()
             raise EmailException(
                 error             = 'email_not_controlled_error',
                 error_description = 'Generic error, see more details in the API log'
             )
 
+    async def send_email(
+            self,
+            subject   : str,
+            to        : List[str],
+            body_txt  : str           = 'Please open this email in an mail client capable of HTML rendering',
+            body_html : Optional[str] = None,
+            charset   : str           = "utf-8"
+    ):
+        """
+        Function to send email using smtp server, it waits until the email is sent, use queue_email to
+        send it in background
+        :return:
+        """
+        self._check_configured()
+
+        await self._send_message( self.build_message(subject, to, body_txt, body_html, charset) )
+
+    async def queue_email(
+            self,
+            subject   : str,
+            to        : List[str],
+            body_txt  : str           = 'Please open this email in an mail client capable of HTML rendering',
+            body_html : Optional[str] = None,
+            charset   : str           = "utf-8"
+    ) -> None:
+        """
+        Add the email to the Redis queue, it's sent by the queue worker of any API process, see
+        start_queue_worker
+        """
+        self._check_configured()
+
+        await cache.conn.lpush(self.QueueKey, orjson.dumps({
+            'id'        : secrets.token_hex(8),  # Makes the payload unique in RetryKey
+            'subject'   : subject,
+            'to'        : to,
+            'body_txt'  : body_txt,
+            'body_html' : body_html,
+            'charset'   : charset,
+            'attempts'  : 0
+        }))
+
+    def start_queue_worker(self) -> None:
+        """
+        Consume the emails queue in background, several processes can run it at the same time. The emails taken
+        by a worker are kept in its processing list until they are sent (or scheduled again), if the worker dies
+        they are queued again by the others once its heartbeat expires, so an email may be sent twice but it's
+        never lost
+        """
+        if self._worker_task is not None:
+            return
+
+        self._worker_task = asyncio.get_running_loop().create_task( self._queue_worker() )
+
+    @property
+    def _processing_key(self) -> str:
+        return f'{self.ProcessingPrefix}{self._worker_id}'
+
+    async def _heartbeat(self) -> None:
+        async with cache.pipeline() as pipe:
+            pipe.set(f'{self.HeartbeatPrefix}{self._worker_id}', b'1', expire=self.HeartbeatSeconds)
+            pipe.sadd(self.WorkersKey, self._worker_id)
+
+    async def _queue_worker(self) -> None:
+        while True:
+            try:
+                # A new connection after any error, BRPOPLPUSH would keep failing on a closed one
+                async with cache.dedicated_connection() as conn:
+                    await self._consume_queue(conn)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Error processing the emails queue: {e}')
+                await asyncio.sleep(self.PollSeconds)
+
+    async def _requeue_processing(self) -> None:
+        await cache.eval_script(REQUEUE_PROCESSING_SCRIPT, keys=[self._processing_key, self.QueueKey])
+
+    async def _consume_queue(self, conn) -> None:
+        # Left by a batch interrupted by an error
+        await self._requeue_processing()
+
+        while True:
+            await self._heartbeat()
+            await cache.eval_script(
+                RECOVER_ORPHANS_SCRIPT,
+                keys = [self.WorkersKey, self.QueueKey],
+                args = [self.ProcessingPrefix, self.HeartbeatPrefix]
+            )
+            await cache.eval_script(
+                MOVE_DUE_RETRIES_SCRIPT,
+                keys = [self.RetryKey, self.QueueKey],
+                args = [time.time(), self.queue_batch_size]
+            )
+
+            popped = await conn.brpoplpush(self.QueueKey, self._processing_key, timeout=self.PollSeconds)
+            if popped is None:
+                if self._smtp is not None and time.monotonic() - self._smtp_used > self.smtp_idle_seconds:
+                    await self._close_smtp()
+                continue
+
+            # The rest of the batch without waiting
+            async with cache.pipeline() as pipe:
+                futures = [
+                    pipe.rpoplpush(self.QueueKey, self._processing_key) for _ in range(self.queue_batch_size - 1)
+                ]
+
+            payloads = [ popped ] + [ f.result() for f in futures if f.result() is not None ]
+
+            await self._send_batch(payloads)
+
+    async def _send_batch(self, payloads: List[bytes]) -> None:
+        """
+        Send the emails using the shared SMTP connection, the failed ones are scheduled again with an exponential
+        backoff, except if the server refused all the recipients. Each email leaves the processing list once it's
+        sent or scheduled again
+        """
+        retries  : Dict[bytes, float] = {}
+        failed   : List[bytes]        = []
+
+        for payload in payloads:
+            try:
+                email_data: Dict[str, Any] = orjson.loads(payload)
+                mail = self.build_message(
+                    subject   = email_data['subject'],
+                    to        = email_data['to'],
+                    body_txt  = email_data['body_txt'],
+                    body_html = email_data['body_html'],
+                    charset   = email_data['charset']
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f'Invalid email payload discarded: {payload!r} ({e!r})')
+                failed.append(payload)
+                continue
+
+            try:
+                await self._send_message(mail)
+
+                async with cache.pipeline() as pipe:
+                    pipe.lrem(self._processing_key, 1, payload)
+                    pipe.set(f'{self.HeartbeatPrefix}{self._worker_id}', b'1', expire=self.HeartbeatSeconds)
+                continue
+
+            except EmailException as e:
+                error = e.error
+            except (OSError, asyncio.TimeoutError) as e:
+                error = repr(e)
+                await self._close_smtp()
+
+            email_data['attempts'] += 1
+
+            if error == 'email_recipients_refused' or email_data['attempts'] >= self.queue_max_attempts:
+                logger.error(f'Email to {email_data["to"]} discarded after {email_data["attempts"]} attempts: {error}')
+                failed.append( orjson.dumps(email_data) )
+            else:
+                delay = self.queue_retry_seconds * 2 ** (email_data['attempts'] - 1)
+                retries[ orjson.dumps(email_data) ] = time.time() + delay
+
+        if retries or failed:
+            # Scheduled and removed from the processing list at once
+            async with cache.pipeline(transaction=True) as pipe:
+                if retries:
+                    pipe.zadd(self.RetryKey, *[ v for item in retries.items() for v in item[::-1] ])
+                if failed:
+                    pipe.lpush(self.FailedKey, *failed)
+
+                pipe.delete(self._processing_key)
+
+    async def close(self) -> None:
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+
+            # The emails of an interrupted batch are queued again without waiting for the heartbeat to expire
+            try:
+                await self._requeue_processing()
+                async with cache.pipeline() as pipe:
+                    pipe.delete(f'{self.HeartbeatPrefix}{self._worker_id}')
+                    pipe.srem(self.WorkersKey, self._worker_id)
+            except Exception as e:
+                logger.warning(f'Error releasing the emails queue worker: {e}')
+
+        await self._close_smtp()
+
 
 # singleton
 email_ctrl = EmailCtrl()
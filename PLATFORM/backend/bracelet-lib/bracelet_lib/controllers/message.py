@@ -1,9 +1,23 @@
+import logging
+
 from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List
+
+import pydantic
+import sqlalchemy as sa
 from sqlalchemy import Column
+from .. import exceptions
 from ..controllers.base_ctrl import braceletBaseCtrl
+from ..controllers.chat_events import chat_events_hub, ChatEventType
+from ..controllers.chats import ChatCtrl
+from ..models import database_manager
+from ..models.chats import Chat
 from ..models.messages import Message
 from ..models.query_builder import QueryBuilder
 
+
+logger = logging.getLogger('bracelet_lib.messages')
+
+
 class MessageCtrl(braceletBaseCtrl):
     """
     Controller for Message model. Supports CRUD and optional filtering by chat_id and sender_id.
@@ -11,6 +25,121 @@ class MessageCtrl(braceletBaseCtrl):
     Model = Message
     OwnerColumn = None  # Messages are not 'owned' by a single user, access control via chat membership
 
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def create(
+            cls,
+            data                : Union[pydantic.BaseModel, Message, Dict],
+            validate            : bool = True,
+            embed_map           : Optional[Dict[str, Union[bool, Dict]]] = None,
+            with_transaction    : bool = True,
+            extra_args          : Mapping[str, Any] = {},
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {},
+            ignore_rel_entities : bool = False
+    ) -> Message:
+        """
+        The chat last message (and the sender last read message) is updated in the same transaction, the created
+        message is pushed to the websockets of the chat once committed, see ChatEventsHub
+        """
+        async with database_manager.get_db_conn().transaction():
+            created = await super().create(
+                data,
+                validate            = validate,
+                embed_map           = embed_map,
+                with_transaction    = with_transaction,
+                extra_args          = extra_args,
+                dynamic_rel_context = dynamic_rel_context,
+                ignore_rel_entities = ignore_rel_entities
+            )
+
+            await ChatCtrl.set_last_message(created)
+
+        # Best effort, the message is already stored and the clients get it from the history anyway
+        try:
+            await chat_events_hub.publish(
+                created.chat_id,
+                ChatEventType.message,
+                { 'message': Message.FullValidator.from_model(created).dict(exclude={'chat', 'sender'}) }
+            )
+        except Exception as e:
+            logger.warning(f'Error publishing the message {created.id} of the chat {created.chat_id}: {e}')
+
+        return created
+
+    @classmethod
+    async def history(
+            cls,
+            chat_id   : int,
+            before_id : Optional[int] = None,
+            after_id  : Optional[int] = None,
+            limit     : int           = 50
+    ) -> Tuple[List[Message], bool]:
+        """
+        Page of the chat history using keyset pagination over (ts, id) with the index ix_message_chat_id_ts_id,
+        the cost doesn't depend on the position of the page in the chat
+        :param before_id: messages previous to this one, the latest messages if neither before_id nor after_id are set
+        :param after_id: messages following this one
+        :return: messages sorted by ts and id ascending and if there are more messages in the requested direction
+        """
+        if before_id is not None and after_id is not None:
+            raise exceptions.ValidationError(
+                loc  = ['query', 'before_id'],
+                msg  = 'before_id and after_id can not be used at the same time',
+                type = exceptions.ErrorType.BAD_REQUEST
+            )
+
+        msg_t     = cls.Model.Table
+        anchor_id = before_id if before_id is not None else after_id
+        query     = sa.select(msg_t).where(msg_t.c.chat_id == chat_id)
+
+        if anchor_id is not None:
+            anchor = await database_manager.get_db_conn().fetch_one(
+                sa.select(msg_t.c.ts, msg_t.c.id).where(msg_t.c.id == anchor_id, msg_t.c.chat_id == chat_id)
+            )
+            if anchor is None:
+                raise exceptions.NotFoundError()
+
+            if before_id is not None:
+                query = query.where( sa.tuple_(msg_t.c.ts, msg_t.c.id) < sa.tuple_(anchor['ts'], anchor['id']) )
+            else:
+                query = query.where( sa.tuple_(msg_t.c.ts, msg_t.c.id) > sa.tuple_(anchor['ts'], anchor['id']) )
+
+        if after_id is not None:
+            query = query.order_by(msg_t.c.ts.asc(), msg_t.c.id.asc())
+        else:
+            query = query.order_by(msg_t.c.ts.desc(), msg_t.c.id.desc())
+
+        # One more record to know if there is another page
+        db_records = await database_manager.get_db_conn().fetch_all( query.limit(limit + 1) )
+        has_more   = len(db_records) > limit
+        messages   = list( cls.Model.from_db_multi(db_records[:limit]) )
+
+        if after_id is None:
+            messages.reverse()
+
+        return messages, has_more
+
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def delete(
+            cls,
+            id               : Union[int, str, List[Union[int, str]]],
+            raise_not_found  : bool = True,
+            extra_args       : Mapping[str, Any] = {},
+            with_transaction : bool = True
+    ) -> None:
+        """
+        The chats whose last message is deleted get the previous one
+        """
+        ids   = id if isinstance(id, list) else [id]
+        query = sa.select(Chat.Table.c.id).where( Chat.Table.c.last_message_id.in_(ids) )
+
+        async with database_manager.get_db_conn().transaction():
+            chat_ids = [ record[0] for record in await database_manager.get_db_conn().fetch_all(query) ]
+
+            await super().delete(id, raise_not_found=raise_not_found, extra_args=extra_args, with_transaction=False)
+            await ChatCtrl.refresh_last_message(chat_ids)
+
     # noinspection PyDefaultArgument
     @classmethod
     async def search(
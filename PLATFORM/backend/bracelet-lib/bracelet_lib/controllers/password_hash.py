@@ -0,0 +1,209 @@
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import secrets
+
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+
+class PasswordHasher(ABC):
+    """
+    Base class for password hashing algorithms, the encoded hashes must be self describing so
+    the controller is able to know which hasher generated a stored value
+    """
+    algorithm: str = None
+
+    @abstractmethod
+    def identify(self, encoded: str) -> bool:
+        pass
+
+    @abstractmethod
+    def hash(self, password: str) -> str:
+        pass
+
+    @abstractmethod
+    def verify(self, password: str, encoded: str) -> bool:
+        pass
+
+    def needs_update(self, encoded: str) -> bool:
+        """
+        Used to know if a hash generated by this hasher should be recalculated, ex: the cost parameters changed
+        """
+        return False
+
+
+class LegacySha256Hasher(PasswordHasher):
+    """
+    Single sha256 round with a static salt, only kept to verify hashes stored before the KDF migration
+    """
+    algorithm = 'legacy_sha256'
+
+    def identify(self, encoded: str) -> bool:
+        if len(encoded) != 64:
+            return False
+
+        try:
+            int(encoded, 16)
+        except ValueError:
+            return False
+
+        return True
+
+    def hash(self, password: str) -> str:
+        # Create entropy for password
+        text     = f'_a21_{password}_12a_'
+        hash_obj = hashlib.sha256()
+        hash_obj.update(text.encode())
+
+        return hash_obj.hexdigest()
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return hmac.compare_digest(self.hash(password), encoded)
+
+    def needs_update(self, encoded: str) -> bool:
+        return True
+
+
+class ScryptHasher(PasswordHasher):
+    """
+    scrypt KDF from the standard library, the hash is stored as: scrypt$n$r$p$salt$key (base64 salt and key)
+    """
+    algorithm = 'scrypt'
+
+    def __init__(self, n: int = 2**14, r: int = 8, p: int = 1, salt_size: int = 16, key_size: int = 32):
+        self.n         = n
+        self.r         = r
+        self.p         = p
+        self.salt_size = salt_size
+        self.key_size  = key_size
+
+    def _derive(self, password: str, salt: bytes, n: int, r: int, p: int, key_size: int) -> bytes:
+        return hashlib.scrypt(
+            password.encode(),
+            salt   = salt,
+            n      = n,
+            r      = r,
+            p      = p,
+            maxmem = 256 * n * r,  # 128 * n * r is needed, we leave some margin
+            dklen  = key_size
+        )
+
+    @staticmethod
+    def _split(encoded: str) -> Tuple[int, int, int, bytes, bytes]:
+        _, n, r, p, salt, key = encoded.split('$')
+
+        return int(n), int(r), int(p), base64.b64decode(salt), base64.b64decode(key)
+
+    def identify(self, encoded: str) -> bool:
+        return encoded.startswith(f'{self.algorithm}$')
+
+    def hash(self, password: str) -> str:
+        salt = secrets.token_bytes(self.salt_size)
+        key  = self._derive(password, salt, self.n, self.r, self.p, self.key_size)
+
+        return '$'.join((
+            self.algorithm,
+            str(self.n),
+            str(self.r),
+            str(self.p),
+            base64.b64encode(salt).decode(),
+            base64.b64encode(key).decode()
+        ))
+
+    def verify(self, password: str, encoded: str) -> bool:
+        try:
+            n, r, p, salt, key = self._split(encoded)
+        except ValueError:
+            return False
+
+        return hmac.compare_digest(self._derive(password, salt, n, r, p, len(key)), key)
+
+    def needs_update(self, encoded: str) -> bool:
+        n, r, p, _, key = self._split(encoded)
+
+        return (n, r, p, len(key)) != (self.n, self.r, self.p, self.key_size)
+
+
+class PasswordHashCtrl:
+    """
+    Runs the password hashing algorithms in a bounded thread pool (hashlib releases the GIL while deriving keys),
+    so the event loop is never blocked by a KDF, the semaphore caps the hashes in flight to avoid login storms
+    eating all the CPU of the worker
+    """
+
+    # noinspection PyTypeChecker
+    def __init__(self):
+        self.hashers         : Dict[str, PasswordHasher]             = {}
+        self.default_hasher  : PasswordHasher                        = None
+        self.max_concurrency : int                                   = None
+        self._executor       : concurrent.futures.ThreadPoolExecutor = None
+        self._semaphore      : asyncio.Semaphore                     = None
+
+        self.init()
+
+    def init(
+            self,
+            algorithm       : str = ScryptHasher.algorithm,
+            max_workers     : int = 4,
+            max_concurrency : int = 8
+    ):
+        self.register(LegacySha256Hasher())
+        self.register(ScryptHasher())
+
+        if algorithm not in self.hashers:
+            raise ValueError(f'Unknown password hash algorithm: {algorithm}')
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+        self.default_hasher  = self.hashers[algorithm]
+        self.max_concurrency = max_concurrency
+        self._executor       = concurrent.futures.ThreadPoolExecutor(
+            max_workers        = max_workers,
+            thread_name_prefix = 'password-hash'
+        )
+        self._semaphore      = None  # Created lazily, it needs to be bound to the running loop
+
+    def register(self, hasher: PasswordHasher):
+        """
+        Allows to add new algorithms, ex: argon2 or bcrypt if those libraries are available
+        """
+        self.hashers[hasher.algorithm] = hasher
+
+    def get_hasher(self, encoded: str) -> Optional[PasswordHasher]:
+        for hasher in self.hashers.values():
+            if hasher.identify(encoded):
+                return hasher
+
+    async def _run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def hash_password(self, password: str) -> str:
+        return await self._run(self.default_hasher.hash, password)
+
+    async def verify_password(self, password: str, encoded: Optional[str]) -> Tuple[bool, bool]:
+        """
+        Verify a password against the stored hash
+        :return: a tuple (valid, needs_rehash), needs_rehash is only meaningful if the password is valid and
+                 means the stored value should be replaced by a hash generated with the default hasher
+        """
+        hasher = self.get_hasher(encoded) if encoded else None
+        if hasher is None:
+            return False, False
+
+        valid = await self._run(hasher.verify, password, encoded)
+
+        needs_rehash = valid and (hasher is not self.default_hasher or hasher.needs_update(encoded))
+
+        return valid, needs_rehash
+
+
+# singleton
+password_hash_ctrl = PasswordHashCtrl()
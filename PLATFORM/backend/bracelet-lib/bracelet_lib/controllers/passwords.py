@@ -28,6 +28,9 @@ class PasswordsCtrl:
         self.jwt_refresh_token_expire_minutes       : int = None
         self.login_max_attempts_until_block         : int = None
         self.login_attempts_ttl_minutes             : int = None
+        self.login_max_attempts_per_ip              : int = None
+        self.login_backoff_step_ms                  : int = None
+        self.login_backoff_max_ms                   : int = None
         self.account_block_duration_hours           : int = None
         self.reset_password_token_expire_minutes    : int = None
         self.unlock_account_token_expire_minutes    : int = None
@@ -41,6 +44,9 @@ class PasswordsCtrl:
             jwt_refresh_token_expire_minutes       : int = 24*60,
             login_max_attempts_until_block         : int = 10,
             login_attempts_ttl_minutes             : int = 60*5,
+            login_max_attempts_per_ip              : int = 100,
+            login_backoff_step_ms                  : int = 100,
+            login_backoff_max_ms                   : int = 5000,
             account_block_duration_hours           : int = 24,
             reset_password_token_expire_minutes    : int = 24*60,
             unlock_account_token_expire_minutes    : int = 24*60,
@@ -52,6 +58,9 @@ class PasswordsCtrl:
         self.jwt_refresh_token_expire_minutes       = jwt_refresh_token_expire_minutes
         self.login_max_attempts_until_block         = login_max_attempts_until_block
         self.login_attempts_ttl_minutes             = login_attempts_ttl_minutes
+        self.login_max_attempts_per_ip              = login_max_attempts_per_ip
+        self.login_backoff_step_ms                  = login_backoff_step_ms
+        self.login_backoff_max_ms                   = login_backoff_max_ms
         self.account_block_duration_hours           = account_block_duration_hours
         self.reset_password_token_expire_minutes    = reset_password_token_expire_minutes
         self.unlock_account_token_expire_minutes    = unlock_account_token_expire_minutes
@@ -0,0 +1,168 @@
+from typing import Optional, Dict, Sequence, List, Type
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from ..controllers.base_ctrl import braceletBaseCtrl
+from ..models import database_manager
+from ..models.alarm import Alarm
+from ..models.base_model import braceletBaseModel
+from ..models.patient_latest_vitals import PatientLatestVitals
+from ..models.patients import Patient
+from ..models.studies import Study
+
+
+class PatientLatestVitalsCtrl(braceletBaseCtrl):
+    """
+    Keeps the latest study and alarm of every patient. StudyCtrl and AlarmCtrl call it in the same transaction
+    as their inserts and deletes.
+    """
+    Model       = PatientLatestVitals
+    OwnerColumn = Patient.Table.c.owner_user_id
+
+    StudyColumns = {
+        'study_id'   : 'id',
+        'step_count' : 'step_count',
+        'bpm'        : 'bpm',
+        'spo2'       : 'spo2',
+        'study_ts'   : 'ts'
+    }
+
+    AlarmColumns = {
+        'last_alarm_id'        : 'id',
+        'last_alarm_type'      : 'alarm_type',
+        'last_alarm_ts'        : 'ts',
+        'last_alarm_is_urgent' : 'is_urgent'
+    }
+
+    @classmethod
+    async def _upsert_latest(
+            cls,
+            records : Sequence[Dict],
+            columns : Dict[str, str],
+            ts_col  : str,
+            id_col  : str
+    ) -> None:
+        """
+        Stores the latest of the records of each patient, unless the stored one is newer (by ts and id)
+        """
+        latest = {}
+        for record in records:
+            current = latest.get(record['patient_id'])
+            if current is None or (current['ts'], current['id']) < (record['ts'], record['id']):
+                latest[record['patient_id']] = record
+
+        if not latest:
+            return
+
+        vitals_t = cls.Model.Table
+        query    = insert(vitals_t).values([
+            {
+                'patient_id' : patient_id,
+                **{ col_name: record[attr_name] for col_name, attr_name in columns.items() }
+            }
+            for patient_id, record in latest.items()
+        ])
+
+        query = query.on_conflict_do_update(
+            index_elements = [vitals_t.c.patient_id],
+            set_           = {
+                **{ col_name: query.excluded[col_name] for col_name in columns },
+                'update_ts' : sa.func.now()
+            },
+            where          = sa.or_(
+                vitals_t.c[ts_col].is_(None),
+                sa.tuple_(vitals_t.c[ts_col], vitals_t.c[id_col]) <=
+                sa.tuple_(query.excluded[ts_col], query.excluded[id_col])
+            )
+        )
+
+        await database_manager.get_db_conn().execute(query)
+
+    @classmethod
+    async def record_studies(cls, studies: Sequence[Study]) -> None:
+        await cls._upsert_latest(
+            [ study.dict() for study in studies ],
+            cls.StudyColumns,
+            ts_col = 'study_ts',
+            id_col = 'study_id'
+        )
+
+    @classmethod
+    async def record_alarms(cls, alarms: Sequence[Alarm]) -> None:
+        await cls._upsert_latest(
+            [ alarm.dict() for alarm in alarms ],
+            cls.AlarmColumns,
+            ts_col = 'last_alarm_ts',
+            id_col = 'last_alarm_id'
+        )
+
+    @classmethod
+    async def _refresh(
+            cls,
+            patient_ids : Sequence[int],
+            model       : Type[braceletBaseModel],
+            columns     : Dict[str, str],
+            ts_col      : str,
+            id_col      : str
+    ) -> None:
+        if not patient_ids:
+            return
+
+        # The patients without any record left keep the columns empty
+        await database_manager.get_db_conn().execute(
+            sa.update(cls.Model.Table).where(
+                cls.Model.Table.c.patient_id.in_(patient_ids)
+            ).values(
+                **{ col_name: None for col_name in columns },
+                update_ts = sa.func.now()
+            )
+        )
+
+        model_t = model.Table
+        query   = sa.select(model_t).distinct(model_t.c.patient_id).where(
+            model_t.c.patient_id.in_(patient_ids)
+        ).order_by(
+            model_t.c.patient_id, model_t.c.ts.desc(), model_t.c.id.desc()
+        )
+
+        records = await database_manager.get_db_conn().fetch_all(query)
+        await cls._upsert_latest([ dict(record) for record in records ], columns, ts_col=ts_col, id_col=id_col)
+
+    @classmethod
+    async def refresh_studies(cls, patient_ids: Sequence[int]) -> None:
+        """
+        Recalculates the latest study of the patients, used when studies are deleted
+        """
+        await cls._refresh(patient_ids, Study, cls.StudyColumns, ts_col='study_ts', id_col='study_id')
+
+    @classmethod
+    async def refresh_alarms(cls, patient_ids: Sequence[int]) -> None:
+        """
+        Recalculates the latest alarm of the patients, used when alarms are deleted
+        """
+        await cls._refresh(patient_ids, Alarm, cls.AlarmColumns, ts_col='last_alarm_ts', id_col='last_alarm_id')
+
+    @classmethod
+    async def get_board(cls, owner_user_id: Optional[int] = None) -> List[PatientLatestVitals]:
+        """
+        Latest vitals and alarm of all the patients of a doctor, the patients without readings are also returned
+        :param owner_user_id: None for all the patients
+        """
+        vitals_t  = cls.Model.Table
+        patient_t = Patient.Table
+
+        query = sa.select([
+            patient_t.c.id.label('patient_id'),
+            patient_t.c.code,
+            *[ col for col in vitals_t.c if col.name != 'patient_id' ]
+        ]).select_from(
+            patient_t.outerjoin(vitals_t, vitals_t.c.patient_id == patient_t.c.id)
+        ).order_by(
+            patient_t.c.code
+        )
+
+        if owner_user_id is not None:
+            query = query.where(patient_t.c.owner_user_id == owner_user_id)
+
+        return list( cls.Model.from_db_multi( await database_manager.get_db_conn().fetch_all(query) ) )
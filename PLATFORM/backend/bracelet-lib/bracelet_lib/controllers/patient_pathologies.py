@@ -137,8 +137,6 @@ class PatientPathologyCtrl(braceletBaseCtrl):
             patient_id  : int,
             pathologies : List[PatientPathology]
     ):
-        coros = []
-
         linked: List[PatientPathology] = []
 
         tx = await database_manager.get_db_conn().transaction()
@@ -172,6 +170,9 @@ class PatientPathologyCtrl(braceletBaseCtrl):
                 else:
                     update_operation.append(patient_pathology)
 
+            to_update: List[PatientPathology] = []
+            to_create: List[PatientPathology] = []
+
             # Select all others
             for pathology in pathologies:
                 # Check if they are the ones that were initially selected to do nothing,
@@ -183,23 +184,20 @@ class PatientPathologyCtrl(braceletBaseCtrl):
 
                 if prev_selected_initial is not None:
                     prev_selected_initial.detection_date = pathology.detection_date
-                    coros.append(PatientPathologyCtrl.update(
-                        prev_selected_initial.id,
-                        prev_selected_initial
-                    ))
+                    to_update.append(prev_selected_initial)
                 else:
-                    new_link_patient_pathology = PatientPathology(
+                    to_create.append(PatientPathology(
                         patient_id     = patient_id,
                         pathology_id   = pathology.id,
                         detection_date = pathology.detection_date
-                    )
-
-                    coros.append(PatientPathologyCtrl.create(
-                        new_link_patient_pathology, with_transaction=False
                     ))
 
-            for coro in coros:
-                linked.append(await coro)
+            # One statement for all the updates and another one for all the new links
+            updated = await PatientPathologyCtrl.update_many(to_update, with_transaction=False)
+            created = await PatientPathologyCtrl.create_many(to_create, with_transaction=False)
+
+            linked.extend(updated)
+            linked.extend(created)
         except Exception as e:
             await tx.rollback()
             raise e
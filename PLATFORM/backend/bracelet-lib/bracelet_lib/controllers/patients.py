@@ -1,12 +1,135 @@
+import asyncio
+from datetime import datetime, timezone
+
 from sqlalchemy import Column
 import sqlalchemy as sa
 
+from .. import exceptions
 from ..controllers.base_ctrl import braceletBaseCtrl
+from ..models import database_manager
+from ..models.alarm import Alarm
+from ..models.pathologies import Pathology
+from ..models.patient_pathologies import PatientPathology
 from ..models.patients import Patient, GenderType
-from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List
+from ..models.studies import Study
+from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List, Callable, Awaitable
+
+from ..models.query_builder import QueryBuilder
+
+
+class PatientDashboardLoader:
+    """
+    Loads the patient dashboard sections for a single request. Each query runs once and its result is shared by
+    the sections using it, the last study gives both the latest vitals and today's steps. The queries run
+    concurrently, each one with its own pool connection
+    """
+
+    def __init__(self, patient_id: int):
+        self.patient_id = patient_id
+        self._loads     : Dict[str, asyncio.Future] = {}
+
+    def _load_once(self, name: str, load_fn: Callable[[], Awaitable]) -> asyncio.Future:
+        async def run():
+            async with database_manager.task_connection():
+                return await load_fn()
+
+        load = self._loads.get(name)
+        if load is None:
+            load = self._loads[name] = asyncio.ensure_future( run() )
+
+        return load
+
+    async def patient(self) -> Optional[Patient]:
+        async def load():
+            query = sa.select(Patient.Table).where( Patient.Table.c.id == self.patient_id )
+            row   = await database_manager.get_db_conn().fetch_one(query)
+
+            return Patient.from_db(row) if row else None
+
+        return await self._load_once('patient', load)
+
+    async def pathologies(self) -> List[Dict[str, Any]]:
+        async def load():
+            pp_t  = PatientPathology.Table
+            query = sa.select([
+                Pathology.Table.c.id,
+                Pathology.Table.c.name,
+                pp_t.c.detection_date
+            ]).select_from(
+                pp_t.join(Pathology.Table, pp_t.c.pathology_id == Pathology.Table.c.id)
+            ).where(
+                pp_t.c.patient_id == self.patient_id
+            ).order_by(
+                pp_t.c.detection_date.desc()
+            )
+
+            return [ dict(row) for row in await database_manager.get_db_conn().fetch_all(query) ]
+
+        return await self._load_once('pathologies', load)
+
+    async def latest_study(self) -> Optional[Study]:
+        async def load():
+            # Backward scan of uq_study_patient_ts
+            query = sa.select(Study.Table).where(
+                Study.Table.c.patient_id == self.patient_id
+            ).order_by(
+                Study.Table.c.ts.desc()
+            ).limit(1)
+            row = await database_manager.get_db_conn().fetch_one(query)
+
+            return Study.from_db(row) if row else None
+
+        return await self._load_once('latest_study', load)
+
+    async def today_steps(self) -> int:
+        """
+        step_count is cumulative during the day, so today's steps are the ones of the last study if it's from today
+        """
+        study = await self.latest_study()
+        if study is None:
+            return 0
+
+        # study.ts is a naive TIMESTAMP in UTC, an aware one is converted in case it comes from a validator
+        ts = study.ts if study.ts.tzinfo is None else study.ts.astimezone(timezone.utc).replace(tzinfo=None)
+        if ts.date() != datetime.now(timezone.utc).date():
+            return 0
+
+        return study.step_count
+
+    async def recent_alarms(self, limit: int) -> List[Alarm]:
+        async def load():
+            query = sa.select(Alarm.Table).where(
+                Alarm.Table.c.patient_id == self.patient_id
+            ).order_by(
+                Alarm.Table.c.ts.desc()
+            ).limit(limit)
+
+            return list( Alarm.from_db_multi( await database_manager.get_db_conn().fetch_all(query) ) )
+
+        return await self._load_once(f'recent_alarms-{limit}', load)
 
-from ..models.query_builder import QueryBuilder, JoinMeta
-from ..models import unaccent_text
+    async def load(self, alarms_limit: int) -> Dict[str, Any]:
+        """
+        :raises NotFoundError: When the patient is not found
+        """
+        patient, pathologies, latest_vitals, today_steps, alarms = await asyncio.gather(
+            self.patient(),
+            self.pathologies(),
+            self.latest_study(),
+            self.today_steps(),
+            self.recent_alarms(alarms_limit)
+        )
+
+        if patient is None:
+            raise exceptions.NotFoundError()
+
+        return {
+            'patient'       : patient,
+            'pathologies'   : pathologies,
+            'latest_vitals' : latest_vitals,
+            'today_steps'   : today_steps,
+            'alarms'        : alarms
+        }
 
 
 class PatientCtrl(braceletBaseCtrl):
@@ -50,55 +173,6 @@ class PatientCtrl(braceletBaseCtrl):
             
         return builder
 
-    # noinspection PyDefaultArgument
-    @classmethod
-    async def _apply_fts_sort_builder(
-            cls,
-            builder    : QueryBuilder                  = None,
-            fts        : str                           = "",
-            fields_map : Dict[Union[str, Column], Any] = {},
-            sort_map   : OrderedDict                   = {}
-    ):
-        if not builder:
-            builder = QueryBuilder(cls.Model)
-
-        patient_t = cls.Model.Table
-
-        fts_query = sa.select([
-            patient_t.c.id,
-            sa.cast(
-                patient_t.c.code.op('<->')(fts),
-                sa.Numeric(5, 4)
-            ).label('match_distance')
-        ]).select_from(
-            patient_t
-        ).where(
-            sa.or_(
-                unaccent_text(patient_t.c.code) % unaccent_text(fts),
-                unaccent_text(patient_t.c.code).op('%>')(unaccent_text(fts))
-            )
-        ).alias('fts')
-
-        builder = builder.add_join(
-            JoinMeta(
-                table    = fts_query,
-                onclause = JoinMeta.OnClause(
-                    left  = cls.Model.Table.c.id,
-                    right = fts_query.c.id
-                )
-            )
-        )
-
-        builder = cls.apply_special_sort(
-            builder    = builder,
-            column     = fts_query.c.match_distance,
-            sort_order = 'asc',
-            fields_map = fields_map,
-            sort_map   = sort_map
-        )
-
-        return builder
-
     # noinspection PyDefaultArgument
     @classmethod
     async def search(
@@ -115,7 +189,6 @@ class PatientCtrl(braceletBaseCtrl):
             extra_args         : Dict[str, Any]                           = {},
             dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
     ) -> Tuple[List[Patient], bool]:
-        fts_text = extra_args.get('fts')
         auth_user_info = extra_args.get('auth_user_info', {})
 
         if not builder:
@@ -129,14 +202,6 @@ class PatientCtrl(braceletBaseCtrl):
                 extra_args=extra_args
             )
 
-        if fts_text is not None:
-            builder = await cls._apply_fts_sort_builder(
-                builder    = builder,
-                fts        = fts_text,
-                fields_map = fields_map,
-                sort_map   = sort_map
-            )
-
         return await super().search(
             builder             = builder,
             fields_map          = fields_map,
@@ -185,6 +250,16 @@ class PatientCtrl(braceletBaseCtrl):
         
         return results[0] if results else None
 
+    @classmethod
+    async def get_dashboard(cls, patient_id: int, alarms_limit: int = 10) -> Dict[str, Any]:
+        """
+        Patient, pathologies, latest vitals, today's steps and recent alarms queried concurrently. The access to the
+        patient must be already checked, the other records are only filtered by patient_id
+
+        :raises NotFoundError: When the patient is not found
+        """
+        return await PatientDashboardLoader(patient_id).load(alarms_limit)
+
 
 class GenderTypeCtrl(braceletBaseCtrl):
     Model = GenderType
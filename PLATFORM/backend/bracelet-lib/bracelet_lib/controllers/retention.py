@@ -0,0 +1,324 @@
+import asyncio
+import contextlib
+import datetime
+import io
+import logging
+
+import pyarrow
+import pyarrow.parquet
+import sqlalchemy as sa
+
+from typing import Optional, List, Mapping, Sequence, Tuple, Type
+from sqlalchemy.dialects import postgresql
+
+from bracelet_lib.cache import cache
+from bracelet_lib.controllers.chats import ChatCtrl
+from bracelet_lib.controllers.patient_latest_vitals import PatientLatestVitalsCtrl
+from bracelet_lib.controllers.storage import blob_storage_ctrl
+from bracelet_lib.controllers.studies import StudyCtrl
+from bracelet_lib.models import database_manager
+from bracelet_lib.models.alarm import Alarm
+from bracelet_lib.models.base_model import braceletBaseModel
+from bracelet_lib.models.chats import Chat
+from bracelet_lib.models.messages import Message
+from bracelet_lib.models.studies import Study, StudyDaily
+
+
+logger = logging.getLogger('bracelet_lib.retention')
+
+
+def _to_parquet(rows: Sequence[Mapping]) -> bytes:
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(
+        pyarrow.Table.from_pylist([ dict(row) for row in rows ]),
+        buffer,
+        compression = 'zstd'
+    )
+
+    return buffer.getvalue()
+
+
+def _parquet_num_rows(data: bytes) -> int:
+    return pyarrow.parquet.read_metadata( pyarrow.BufferReader(data) ).num_rows
+
+
+class RetentionCtrl:
+    """
+    Lifecycle of the telemetry and chat rows: the rows older than the retention days of their table are
+    exported as Parquet to the blob storage and deleted by batches, the studies are also added to the daily
+    rollups (study_daily) before. The hot tables only keep the recent rows used by the live queries.
+
+    Each batch is uploaded before taking any lock, so the rows aren't kept locked during the upload. Then, in a
+    single transaction, the rows still there are locked (FOR UPDATE SKIP LOCKED, so concurrent runs don't process
+    them twice), rolled up and deleted, if anything fails nothing is deleted. The rows skipped or not deleted are
+    exported again in a later batch, the archives can have duplicated ids.
+
+    The patients whose latest study or alarm is archived get the previous one, as when they are deleted, see
+    PatientLatestVitalsCtrl
+    """
+    LockKey : str = 'retention-job'
+
+    def __init__(self):
+        self.study_days     : int = 0
+        self.alarm_days     : int = 0
+        self.message_days   : int = 0
+        self.batch_size     : int = 5000
+        self.archive_prefix : str = 'archive'
+        self._task          : Optional[asyncio.Task] = None
+
+    def init(
+            self,
+            study_days     : int = 0,
+            alarm_days     : int = 0,
+            message_days   : int = 0,
+            batch_size     : int = 5000,
+            archive_prefix : str = 'archive'
+    ):
+        """
+        :param study_days: days the raw studies are kept, 0 keeps them forever
+        :param alarm_days: days the alarms are kept, 0 keeps them forever
+        :param message_days: days the chat messages are kept, 0 keeps them forever
+        :param batch_size: rows archived in each transaction (and Parquet file)
+        :param archive_prefix: BlobStorage path of the archives, {prefix}/{table}/{YYYY-MM-DD}/{first id}-{last id}
+        """
+        self.study_days     = study_days
+        self.alarm_days     = alarm_days
+        self.message_days   = message_days
+        self.batch_size     = batch_size
+        self.archive_prefix = archive_prefix
+
+    @staticmethod
+    def _cutoff(days: int) -> datetime.datetime:
+        """
+        Start of the day, so the rollups get the days complete
+        """
+        today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        return today - datetime.timedelta(days=days)
+
+    def _select_batch_query(self, model: Type[braceletBaseModel], cutoff: datetime.datetime) -> sa.sql.Select:
+        # Both conditions, ts is the time of the reading and create_ts is indexed. The rows uploaded late (the
+        # devices keep the readings while offline) are archived once their create_ts is also old
+        model_t = model.Table
+
+        return sa.select(model_t).where(
+            model_t.c.create_ts < cutoff.replace(tzinfo=datetime.timezone.utc),
+            model_t.c.ts < cutoff
+        ).order_by(
+            model_t.c.create_ts
+        ).limit(
+            self.batch_size
+        )
+
+    async def _upload(self, model: Type[braceletBaseModel], rows: Sequence[Mapping]) -> None:
+        ids  = [ row['id'] for row in rows ]
+        path = (
+            f'{self.archive_prefix}/{model.Table.name}/{datetime.datetime.utcnow():%Y-%m-%d}/'
+            f'{min(ids)}-{max(ids)}.parquet'
+        )
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, _to_parquet, rows)
+
+        await blob_storage_ctrl.put_object(path, data)
+
+        # The rows are deleted after this, the archive is read back to check it's stored and complete
+        stored   = await blob_storage_ctrl.get_object(path)
+        num_rows = await loop.run_in_executor(None, _parquet_num_rows, stored)
+        if num_rows != len(rows):
+            raise RuntimeError(f'The archive {path} has {num_rows} rows instead of {len(rows)}')
+
+    @staticmethod
+    async def _rollup_studies(ids: List[int]) -> None:
+        study_t = Study.Table
+        daily_t = StudyDaily.Table
+        day     = sa.cast(study_t.c.ts, sa.DATE())
+
+        rollup = sa.select([
+            study_t.c.patient_id,
+            day,
+            sa.func.count(),
+            sa.func.min(study_t.c.ts),
+            sa.func.max(study_t.c.ts),
+            postgresql.array_agg( postgresql.aggregate_order_by(study_t.c.step_count, study_t.c.ts.desc()) )[1],
+            sa.func.min(study_t.c.bpm),
+            sa.func.max(study_t.c.bpm),
+            sa.func.sum(study_t.c.bpm),
+            sa.func.min(study_t.c.spo2),
+            sa.func.max(study_t.c.spo2),
+            sa.func.coalesce(sa.func.sum(study_t.c.spo2), 0),
+            sa.func.count(study_t.c.spo2)
+        ]).where(
+            study_t.c.id.in_(ids)
+        ).group_by(
+            study_t.c.patient_id, day
+        )
+
+        query = postgresql.insert(daily_t).from_select(
+            [
+                'patient_id', 'day', 'count', 'first_ts', 'last_ts', 'last_step_count', 'bpm_min', 'bpm_max',
+                'bpm_sum', 'spo2_min', 'spo2_max', 'spo2_sum', 'spo2_count'
+            ],
+            rollup
+        )
+        excluded = query.excluded
+
+        # A day can be archived in several batches, or get late readings, its rows are merged
+        query = query.on_conflict_do_update(
+            index_elements = [daily_t.c.patient_id, daily_t.c.day],
+            set_           = {
+                'count'           : daily_t.c['count'] + excluded['count'],
+                'first_ts'        : sa.func.least(daily_t.c.first_ts, excluded.first_ts),
+                'last_ts'         : sa.func.greatest(daily_t.c.last_ts, excluded.last_ts),
+                'last_step_count' : sa.case(
+                    (excluded.last_ts >= daily_t.c.last_ts, excluded.last_step_count),
+                    else_ = daily_t.c.last_step_count
+                ),
+                'bpm_min'         : sa.func.least(daily_t.c.bpm_min, excluded.bpm_min),
+                'bpm_max'         : sa.func.greatest(daily_t.c.bpm_max, excluded.bpm_max),
+                'bpm_sum'         : daily_t.c.bpm_sum + excluded.bpm_sum,
+                'spo2_min'        : sa.func.least(daily_t.c.spo2_min, excluded.spo2_min),  # least ignores NULL
+                'spo2_max'        : sa.func.greatest(daily_t.c.spo2_max, excluded.spo2_max),
+                'spo2_sum'        : daily_t.c.spo2_sum + excluded.spo2_sum,
+                'spo2_count'      : daily_t.c.spo2_count + excluded.spo2_count,
+                'update_ts'       : sa.func.now()
+            }
+        )
+
+        await database_manager.get_db_conn().execute(query)
+
+    @staticmethod
+    async def _refresh_chats(ids: List[int]) -> None:
+        """
+        The chats whose last message is archived get the previous one, if any
+        """
+        query    = sa.select(Chat.Table.c.id).where( Chat.Table.c.last_message_id.in_(ids) )
+        chat_ids = [ record[0] for record in await database_manager.get_db_conn().fetch_all(query) ]
+
+        await ChatCtrl.refresh_last_message(chat_ids)
+
+    @staticmethod
+    async def _refresh_latest_vitals(model: Type[braceletBaseModel], ids: List[int]) -> None:
+        """
+        The patients whose latest study or alarm is archived get the previous one, if any
+        """
+        vitals_t    = PatientLatestVitalsCtrl.Model.Table
+        id_col      = vitals_t.c.study_id if model is Study else vitals_t.c.last_alarm_id
+        query       = sa.select(vitals_t.c.patient_id).where( id_col.in_(ids) )
+        patient_ids = [ record[0] for record in await database_manager.get_db_conn().fetch_all(query) ]
+
+        if model is Study:
+            await PatientLatestVitalsCtrl.refresh_studies(patient_ids)
+        else:
+            await PatientLatestVitalsCtrl.refresh_alarms(patient_ids)
+
+    async def _archive_batch(self, model: Type[braceletBaseModel], cutoff: datetime.datetime) -> Tuple[int, int]:
+        """
+        :return: rows selected and rows archived, the selected ones locked by a concurrent run are skipped
+        """
+        model_t = model.Table
+        db_conn = database_manager.get_db_conn()
+
+        rows = await db_conn.fetch_all( self._select_batch_query(model, cutoff) )
+        if not rows:
+            return 0, 0
+
+        await self._upload(model, rows)
+
+        async with db_conn.transaction():
+            # A concurrent run could have archived some of them meanwhile
+            query = sa.select(model_t.c.id).where(
+                model_t.c.id.in_([ row['id'] for row in rows ])
+            ).with_for_update(
+                skip_locked = True
+            )
+            ids = [ record[0] for record in await db_conn.fetch_all(query) ]
+            if not ids:
+                return len(rows), 0
+
+            if model is Study:
+                await self._rollup_studies(ids)
+
+            await db_conn.execute( sa.delete(model_t).where(model_t.c.id.in_(ids)) )
+
+            if model is Message:
+                await self._refresh_chats(ids)
+            else:
+                await self._refresh_latest_vitals(model, ids)
+
+        # The archived days are read from study_daily now, the cached dates of the patients are computed again
+        if model is Study:
+            archived_ids = set(ids)
+            await StudyCtrl.bump_dates_version( row['patient_id'] for row in rows if row['id'] in archived_ids )
+
+        return len(rows), len(ids)
+
+    async def archive(self, model: Type[braceletBaseModel], days: int) -> int:
+        """
+        Archives all the rows of the model older than days
+        :return: rows archived
+        """
+        if days <= 0:
+            return 0
+
+        cutoff   = self._cutoff(days)
+        archived = 0
+
+        while True:
+            selected, batch_archived = await self._archive_batch(model, cutoff)
+            archived                += batch_archived
+
+            # The batches can be smaller than batch_size (SKIP LOCKED), so it only stops when there is nothing
+            # left, or when all the rows are being archived by a concurrent run, they would be selected again
+            if not selected or not batch_archived:
+                return archived
+
+    async def run(self) -> None:
+        for model, days in ((Study, self.study_days), (Alarm, self.alarm_days), (Message, self.message_days)):
+            archived = await self.archive(model, days)
+            if archived:
+                logger.info(f'{model.Table.name}: {archived} rows archived')
+
+    def start(self, interval_minutes: int) -> None:
+        """
+        Runs the job periodically in background, only one API worker runs it each interval
+        """
+        if interval_minutes <= 0 or self._task is not None:
+            return
+
+        if not (self.study_days or self.alarm_days or self.message_days):
+            return
+
+        self._task = asyncio.get_running_loop().create_task( self._run_periodically(interval_minutes * 60) )
+
+    async def _run_periodically(self, interval: int) -> None:
+        while True:
+            try:
+                # The key expires with the interval, so the first worker getting it runs the job
+                acquired = await cache.conn.set(
+                    self.LockKey,
+                    '1',
+                    expire = interval,
+                    exist  = cache.conn.SET_IF_NOT_EXIST
+                )
+
+                if acquired:
+                    await self.run()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Error running the retention job: {e}')
+
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+            self._task = None
+
+
+# singleton
+retention_ctrl = RetentionCtrl()
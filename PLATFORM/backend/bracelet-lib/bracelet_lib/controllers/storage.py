@@ -1,32 +1,157 @@
-from typing import List, Optional, Tuple
+import asyncio
+import contextlib
+import datetime
+import functools
+import hashlib
+import hmac
+import logging
+import urllib.parse
+
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 import boto3
 from botocore.client import BaseClient as BotoClient
 from botocore.exceptions import ClientError
 
+from bracelet_lib.cache import LocalCache, cache
 from bracelet_lib.models.storage import BlobOpType
 
 
+logger = logging.getLogger('bracelet_lib.storage')
+
+class S3UrlSigner:
+    """
+    AWS Signature Version 4 presigned URLs (query string auth) computed locally with hmac/hashlib, it's the
+    same algorithm used by boto3 generate_presigned_url without the botocore request machinery, the signing
+    key only changes once a day so it's cached
+    """
+
+    def __init__(
+            self,
+            access_key_id     : str,
+            secret_access_key : str,
+            region            : str,
+            bucket            : str,
+            endpoint_url      : Optional[str] = None
+    ):
+        self.access_key_id     = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region            = region
+        self.bucket            = bucket
+
+        if endpoint_url:  # S3 compatible services (minio, moto...), path style addressing
+            parsed           = urllib.parse.urlparse(endpoint_url)
+            self.scheme      = parsed.scheme
+            self.host        = parsed.netloc
+            self.path_prefix = f'/{bucket}'
+        else:
+            self.scheme      = 'https'
+            self.host        = f'{bucket}.s3.{region}.amazonaws.com'
+            self.path_prefix = ''
+
+    @functools.lru_cache(maxsize=2)
+    def _get_signing_key(self, datestamp: str) -> bytes:
+        key = f'AWS4{self.secret_access_key}'.encode()
+        for msg in (datestamp, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+        return key
+
+    @staticmethod
+    def _quote(value: str, safe: str = '-_.~') -> str:
+        return urllib.parse.quote(value, safe=safe)
+
+    def presign(
+            self,
+            method     : str,
+            path       : str,
+            expires_in : int,
+            params     : Optional[Mapping[str, str]] = None
+    ) -> str:
+        """
+        :param method: HTTP method the URL will be used with
+        :param path: object key
+        :param expires_in: seconds the URL is valid
+        :param params: subresource query params, ex: uploadId and partNumber
+        """
+        now       = datetime.datetime.utcnow()
+        amz_date  = now.strftime('%Y%m%dT%H%M%SZ')
+        datestamp = amz_date[:8]
+        scope     = f'{datestamp}/{self.region}/s3/aws4_request'
+
+        query = {
+            **(params or {}),
+            'X-Amz-Algorithm'     : 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential'    : f'{self.access_key_id}/{scope}',
+            'X-Amz-Date'          : amz_date,
+            'X-Amz-Expires'       : str(expires_in),
+            'X-Amz-SignedHeaders' : 'host'
+        }
+        canonical_query = '&'.join(
+            f'{self._quote(k)}={self._quote(str(v))}' for k, v in sorted(query.items())
+        )
+        canonical_uri     = self._quote(f'{self.path_prefix}/{path}', safe='/-_.~')
+        canonical_request = '\n'.join((
+            method,
+            canonical_uri,
+            canonical_query,
+            f'host:{self.host}\n',
+            'host',
+            'UNSIGNED-PAYLOAD'
+        ))
+        string_to_sign = '\n'.join((
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256( canonical_request.encode() ).hexdigest()
+        ))
+        signature = hmac.new(self._get_signing_key(datestamp), string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        return f'{self.scheme}://{self.host}{canonical_uri}?{canonical_query}&X-Amz-Signature={signature}'
+
+
 class BlobStorageCtrl:
+    """
+    Presigned URLs are signed locally (S3UrlSigner), so they never block the event loop, only the calls really
+    sent to S3 (ex: create_multipart_upload) use boto3 and run in the default executor.
+
+    Display (GET) URLs are cached per path until shortly before they expire, so lists don't sign every item on
+    every request and the browsers get the same URL, and can use their cache, while it's valid
+    """
     s3_access_key_id     : str
     s3_secret_access_key : str
     s3_region            : str
     s3_bucket            : str
     s3_ttl               : int
     s3_client            : BotoClient
+    signer               : S3UrlSigner
+    display_url_cache    : LocalCache
+
+    DisplayUrlPrefix   = 'signed-url-'
+    PartsSignBatchSize = 250  # Part URLs signed between event loop releases
 
     # noinspection PyTypeChecker
     def __init__(self):
         super().__init__()
 
+        self._cleanup_task : Optional[asyncio.Task] = None
+
     def init(
             self,
             s3_access_key_id     : str,
             s3_secret_access_key : str,
             s3_region            : str,
             s3_bucket            : str,
-            s3_ttl               : int = 3600
+            s3_ttl               : int = 3600,
+            s3_endpoint_url      : Optional[str] = None,
+            url_cache_size       : int = 10000,
+            url_cache_margin     : int = 300
     ):
+        """
+        :param s3_endpoint_url: only for S3 compatible services (minio, moto...), empty for AWS
+        :param url_cache_size: max display URLs kept in memory
+        :param url_cache_margin: seconds before their expiration the cached display URLs are signed again
+        """
         self.s3_access_key_id     = s3_access_key_id
         self.s3_secret_access_key = s3_secret_access_key
         self.s3_region            = s3_region
@@ -36,33 +161,50 @@ class BlobStorageCtrl:
             's3',
             aws_access_key_id     = s3_access_key_id,
             aws_secret_access_key = s3_secret_access_key,
-            region_name           = s3_region
+            region_name           = s3_region,
+            endpoint_url          = s3_endpoint_url or None
+        )
+        self.signer               = S3UrlSigner(
+            access_key_id     = s3_access_key_id,
+            secret_access_key = s3_secret_access_key,
+            region            = s3_region,
+            bucket            = s3_bucket,
+            endpoint_url      = s3_endpoint_url
+        )
+        self.display_url_cache    = LocalCache(
+            [self.DisplayUrlPrefix],
+            max_size = url_cache_size,
+            ttl      = max(0, s3_ttl - url_cache_margin)
         )
 
+    @staticmethod
+    async def _run(fn, **kwargs):
+        """
+        Runs a blocking boto3 call in the default executor
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, **kwargs))
+
     def get_signed_url(self, path: str) -> Optional[str ]:
         """
-        Generate a signed url for a GET request
+        Generate a signed url for a GET request, cached until shortly before its expiration
         :param path: file location at BlobStorage
         :return: Signed url for fetch the GET request
         """
-        method_parameters = {
-            'Bucket': self.s3_bucket,
-            'Key'   : path
-        }
+        key        = f'{self.DisplayUrlPrefix}{path}'
+        found, url = self.display_url_cache.get(key, self.DisplayUrlPrefix)
 
-        try:
-            response = self.s3_client.generate_presigned_url(
-                ClientMethod = 'get_object',
-                Params       = method_parameters,
-                ExpiresIn    = self.s3_ttl,
-                HttpMethod   = 'GET'
-            )
+        if not found:
+            url = self.signer.presign('GET', path, self.s3_ttl)
+            self.display_url_cache.set(key, url)
 
-        except ClientError:
-            # print("--> Couldn't get a pre-signed GET URL ", e)
-            return None
+        return url
 
-        return response
+    def get_signed_urls(self, paths: List[str]) -> Dict[str, str]:
+        """
+        Batch version of get_signed_url, signing is CPU only so there's nothing to await or parallelize
+        :return: map path -> signed url
+        """
+        return { path: self.get_signed_url(path) for path in set(paths) }
 
     def get_delete_signed_url(self, path: str) -> Optional[str ]:
         """
@@ -70,24 +212,7 @@ class BlobStorageCtrl:
         :param path: file location at BlobStorage
         :return: Signed url for fetch the DELETE request
         """
-        method_parameters = {
-            'Bucket': self.s3_bucket,
-            'Key'   : path
-        }
-
-        try:
-            response = self.s3_client.generate_presigned_url(
-                ClientMethod = 'delete_object',
-                Params       = method_parameters,
-                ExpiresIn    = self.s3_ttl,
-                HttpMethod   = 'DELETE'
-            )
-
-        except ClientError:
-            # print("--> Couldn't get a pre-signed DELETE URL ", e)
-            return None
-
-        return response
+        return self.signer.presign('DELETE', path, self.s3_ttl)
 
     def get_upload_signed_url(self, path: str) -> Optional[str ]:
         """
@@ -95,26 +220,9 @@ class BlobStorageCtrl:
         :param path: file location at BlobStorage
         :return: Signed url for fetch the operation
         """
-        method_parameters = {
-            'Bucket': self.s3_bucket,
-            'Key'   : path
-        }
+        return self.signer.presign('PUT', path, self.s3_ttl)
 
-        try:
-            response = self.s3_client.generate_presigned_url(
-                ClientMethod = 'put_object',
-                Params       = method_parameters,
-                ExpiresIn    = self.s3_ttl,
-                HttpMethod   = 'PUT'
-            )
-
-        except ClientError:
-            # print("--> Couldn't get a pre-signed POST/PUT URL ", e)
-            return None
-
-        return response
-
-    def get_multipart_data(self, path: str) -> Optional[Tuple[str, str, str ] ]:
+    async def get_multipart_data(self, path: str) -> Optional[Tuple[str, str, str ] ]:
         """
         Create a multipart upload request to BlobStorage
         :param path: file location at BlobStorage
@@ -122,79 +230,204 @@ class BlobStorageCtrl:
         """
 
         try:
-            upload = self.s3_client.create_multipart_upload(
+            upload = await self._run(
+                self.s3_client.create_multipart_upload,
                 Bucket  = self.s3_bucket,
                 Key     = path,
                 Expires = self.s3_ttl
             )
 
-            upload_id = upload['UploadId']
-            method_parameters = {
-                'Bucket'     : self.s3_bucket,
-                'Key'        : path,
-                'UploadId'   : upload_id
-            }
-
-            complete_url = self.s3_client.generate_presigned_url(
-                ClientMethod = 'complete_multipart_upload',
-                Params       = method_parameters,
-                ExpiresIn    = self.s3_ttl,
-                HttpMethod   = 'POST'
-            )
-
-            abort_url = self.s3_client.generate_presigned_url(
-                ClientMethod = 'abort_multipart_upload',
-                Params       = method_parameters,
-                ExpiresIn    = self.s3_ttl,
-                HttpMethod   = 'POST'
-            )
-
-            return upload_id, complete_url, abort_url
-
         except ClientError:
             # print("--> Couldn't get a pre-signed {http_method} URL ", e)
             return None
 
-    def generate_parts_signed_url(
+        upload_id    = upload['UploadId']
+        complete_url = self.signer.presign('POST', path, self.s3_ttl, {'uploadId': upload_id})
+        abort_url    = self.signer.presign('DELETE', path, self.s3_ttl, {'uploadId': upload_id})
+
+        return upload_id, complete_url, abort_url
+
+    async def generate_parts_signed_url(
             self,
             upload_id  : str,
             num_parts  : int,
-            path       : str
+            path       : str,
+            first_part : int = 1
     ) -> Optional[List[str]]:
         """
-        Generate signed url for all parts of the multipart upload operation
+        Generate signed url for the parts of the multipart upload operation, signing is CPU only, so the event
+        loop is released between batches to keep big uploads (thousands of parts) from blocking other requests
         :param upload_id: ID of the multipart upload operation
         :param num_parts: Number of parts which must be generated
         :param path: file location at BlobStorage
-        :return: List of signed urls for all parts of the multipart upload operation
+        :param first_part: number of the first part, allows clients to request the URLs by ranges
+        :return: List of signed urls for the parts of the multipart upload operation
         """
-        signed_urls: [str] = []
+        signed_urls: List[str] = []
 
-        method_parameters = {
-            'Bucket'     : self.s3_bucket,
-            'Key'        : path,
-            'UploadId'   : upload_id,
-            'PartNumber' : None
-        }
+        for part_number in range(first_part, first_part + num_parts):
+            signed_urls.append(
+                self.signer.presign('PUT', path, self.s3_ttl, {'partNumber': str(part_number), 'uploadId': upload_id})
+            )
+
+            if part_number % self.PartsSignBatchSize == 0:
+                await asyncio.sleep(0)
+
+        return signed_urls
+
+    async def list_parts(self, path: str, upload_id: str) -> List[Dict[str, Union[int, str]]]:
+        """
+        Parts already uploaded to a multipart upload operation
+        :return: list of dicts with the keys part_number, etag and size, sorted by part_number
+        """
+        parts  = []
+        marker = 0
+
+        while True:
+            response = await self._run(
+                self.s3_client.list_parts,
+                Bucket           = self.s3_bucket,
+                Key              = path,
+                UploadId         = upload_id,
+                PartNumberMarker = marker
+            )
+
+            parts.extend(
+                {'part_number': part['PartNumber'], 'etag': part['ETag'], 'size': part['Size']}
+                for part in response.get('Parts', [])
+            )
+
+            if not response.get('IsTruncated'):
+                return parts
+
+            marker = response['NextPartNumberMarker']
+
+    async def complete_multipart_upload(
+            self,
+            path      : str,
+            upload_id : str,
+            parts     : Optional[Sequence[Mapping[str, Union[int, str]]]] = None
+    ) -> None:
+        """
+        :param parts: dicts with part_number and etag, if not set all the uploaded parts are used
+        """
+        if parts is None:
+            parts = await self.list_parts(path, upload_id)
+
+        await self._run(
+            self.s3_client.complete_multipart_upload,
+            Bucket          = self.s3_bucket,
+            Key             = path,
+            UploadId        = upload_id,
+            MultipartUpload = {
+                'Parts': [
+                    {'PartNumber': part['part_number'], 'ETag': part['etag']}
+                    for part in sorted(parts, key=lambda part: part['part_number'])
+                ]
+            }
+        )
+
+    async def abort_multipart_upload(self, path: str, upload_id: str) -> None:
+        await self._run(
+            self.s3_client.abort_multipart_upload,
+            Bucket   = self.s3_bucket,
+            Key      = path,
+            UploadId = upload_id
+        )
 
-        for i in range(1, num_parts + 1):
-            method_parameters['PartNumber'] = i
+    async def put_object(self, path: str, data: bytes, content_type: str = 'application/octet-stream') -> None:
+        """
+        Uploads a file generated by the server in a single request, ex: the archives of RetentionCtrl
+        :param path: file location at BlobStorage
+        """
+        await self._run(
+            self.s3_client.put_object,
+            Bucket      = self.s3_bucket,
+            Key         = path,
+            Body        = data,
+            ContentType = content_type
+        )
+
+    async def get_object(self, path: str) -> bytes:
+        """
+        Downloads a file in a single request, ex: to verify the archives of RetentionCtrl
+        :param path: file location at BlobStorage
+        """
+        response = await self._run(
+            self.s3_client.get_object,
+            Bucket = self.s3_bucket,
+            Key    = path
+        )
+
+        return await asyncio.get_running_loop().run_in_executor(None, response['Body'].read)
+
+    async def abort_stale_multipart_uploads(self, max_age_hours: int, prefix: str = '') -> int:
+        """
+        Aborts the multipart uploads started more than max_age_hours ago, abandoned uploads keep their parts
+        stored (and billed) until they are completed or aborted
+        :return: number of uploads aborted
+        """
+        limit_ts   = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(hours=max_age_hours)
+        aborted    = 0
+        list_args  = {'Bucket': self.s3_bucket, 'Prefix': prefix}
 
+        while True:
+            response = await self._run(self.s3_client.list_multipart_uploads, **list_args)
+
+            for upload in response.get('Uploads', []):
+                if upload['Initiated'] < limit_ts:
+                    try:
+                        await self.abort_multipart_upload(upload['Key'], upload['UploadId'])
+                        aborted += 1
+                    except ClientError as e:
+                        logger.warning(f'Error aborting stale upload {upload["Key"]}: {e}')
+
+            if not response.get('IsTruncated'):
+                return aborted
+
+            list_args['KeyMarker']      = response['NextKeyMarker']
+            list_args['UploadIdMarker'] = response['NextUploadIdMarker']
+
+    def start_stale_uploads_cleanup(self, interval_minutes: int, max_age_hours: int) -> None:
+        """
+        Runs abort_stale_multipart_uploads periodically in background, only one API worker runs it each interval
+        """
+        if interval_minutes <= 0 or self._cleanup_task is not None:
+            return
+
+        self._cleanup_task = asyncio.get_running_loop().create_task(
+            self._stale_uploads_cleanup(interval_minutes * 60, max_age_hours)
+        )
+
+    async def _stale_uploads_cleanup(self, interval: int, max_age_hours: int) -> None:
+        while True:
             try:
-                part_signed_url = self.s3_client.generate_presigned_url(
-                    ClientMethod = 'upload_part',
-                    Params       = method_parameters,
-                    ExpiresIn    = self.s3_ttl,
-                    HttpMethod   = 'PUT'
+                # The key expires with the interval, so the first worker getting it runs the cleanup
+                acquired = await cache.conn.set(
+                    'blob-storage-stale-uploads-cleanup',
+                    '1',
+                    expire = interval,
+                    exist  = cache.conn.SET_IF_NOT_EXIST
                 )
 
-            except ClientError:
-                # print("--> Couldn't get a pre-signed {http_method} URL ", e)
-                return None
+                if acquired:
+                    aborted = await self.abort_stale_multipart_uploads(max_age_hours)
+                    logger.info(f'Stale multipart uploads aborted: {aborted}')
 
-            signed_urls.append(part_signed_url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Error cleaning stale multipart uploads: {e}')
 
-        return signed_urls
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._cleanup_task
+
+            self._cleanup_task = None
 
 
 # singleton
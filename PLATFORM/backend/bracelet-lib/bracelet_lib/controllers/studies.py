@@ -1,8 +1,12 @@
-from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List
+from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List, Iterable
 from sqlalchemy import Column
 
+import pydantic
 import sqlalchemy as sa
+from ..cache import cache
 from ..controllers.base_ctrl import braceletBaseCtrl
+from ..controllers.patient_latest_vitals import PatientLatestVitalsCtrl
+from ..models import database_manager
 from ..models.patients import Patient
 from ..models.studies import Study
 from ..models.query_builder import QueryBuilder
@@ -15,6 +19,114 @@ class StudyCtrl(braceletBaseCtrl):
     Model = Study
     OwnerColumn = Patient.Table.c.owner_user_id
 
+    # Seconds the dates version of a patient is kept after its last change, longer than any cached dates list
+    DatesVersionTTL = 24 * 3600
+
+    @staticmethod
+    def _get_dates_version_key(patient_id: int) -> str:
+        return f'study-dates-version-{patient_id}'
+
+    @classmethod
+    async def get_dates_version(cls, patient_id: int) -> str:
+        """
+        Version of the study dates of a patient, part of the cache keys of its dates so they are invalidated
+        when its studies change
+        """
+        version = await cache.get( cls._get_dates_version_key(patient_id) )
+
+        return (version or b'0').decode()
+
+    @classmethod
+    async def bump_dates_version(cls, patient_ids: Iterable[int]) -> None:
+        """
+        Invalidates the cached study dates of the patients, to be called once the changes are committed
+        """
+        async with cache.pipeline() as pipe:
+            for patient_id in set(patient_ids):
+                pipe.incr( cls._get_dates_version_key(patient_id) )
+                pipe.expire( cls._get_dates_version_key(patient_id), cls.DatesVersionTTL )
+
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def create(
+            cls,
+            data                : Union[pydantic.BaseModel, Study, Dict],
+            validate            : bool = True,
+            embed_map           : Optional[Dict[str, Union[bool, Dict]]] = None,
+            with_transaction    : bool = True,
+            extra_args          : Mapping[str, Any] = {},
+            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {},
+            ignore_rel_entities : bool = False
+    ) -> Study:
+        """
+        The patient latest vitals are updated in the same transaction, see PatientLatestVitalsCtrl
+        """
+        async with database_manager.get_db_conn().transaction():
+            created = await super().create(
+                data,
+                validate            = validate,
+                embed_map           = embed_map,
+                with_transaction    = with_transaction,
+                extra_args          = extra_args,
+                dynamic_rel_context = dynamic_rel_context,
+                ignore_rel_entities = ignore_rel_entities
+            )
+
+            await PatientLatestVitalsCtrl.record_studies([created])
+
+        await cls.bump_dates_version([created.patient_id])
+
+        return created
+
+    @classmethod
+    async def create_many(
+            cls,
+            data_list           : Sequence[Union[pydantic.BaseModel, Study, Dict]],
+            validate            : bool = True,
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List[Study]:
+        async with database_manager.get_db_conn().transaction():
+            created = await super().create_many(
+                data_list,
+                validate            = validate,
+                with_transaction    = with_transaction,
+                ignore_rel_entities = ignore_rel_entities
+            )
+
+            await PatientLatestVitalsCtrl.record_studies(created)
+
+        await cls.bump_dates_version( study.patient_id for study in created )
+
+        return created
+
+    # noinspection PyDefaultArgument
+    @classmethod
+    async def delete(
+            cls,
+            id               : Union[int, str, List[Union[int, str]]],
+            raise_not_found  : bool = True,
+            extra_args       : Mapping[str, Any] = {},
+            with_transaction : bool = True
+    ) -> None:
+        """
+        The patients whose latest study is deleted get the previous one
+        """
+        ids           = id if isinstance(id, list) else [id]
+        vitals_t      = PatientLatestVitalsCtrl.Model.Table
+        latest_query  = sa.select(vitals_t.c.patient_id).where( vitals_t.c.study_id.in_(ids) )
+        patient_query = sa.select(cls.Model.Table.c.patient_id).distinct().where( cls.Model.Table.c.id.in_(ids) )
+        db_conn       = database_manager.get_db_conn()
+
+        async with db_conn.transaction():
+            latest_patient_ids = [ record[0] for record in await db_conn.fetch_all(latest_query) ]
+            patient_ids        = [ record[0] for record in await db_conn.fetch_all(patient_query) ]
+
+            await super().delete(id, raise_not_found=raise_not_found, extra_args=extra_args, with_transaction=False)
+            await PatientLatestVitalsCtrl.refresh_studies(latest_patient_ids)
+
+        await cls.bump_dates_version(patient_ids)
+
     # noinspection PyDefaultArgument
     @classmethod
     async def search(
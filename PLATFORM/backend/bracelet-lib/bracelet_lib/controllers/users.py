@@ -1,15 +1,14 @@
-import asyncio
+import secrets
+
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Union, Any, OrderedDict, Sequence, Tuple, Mapping, List
 
-import sqlalchemy as sa
 from sqlalchemy import Column
 
 from .. import exceptions
 from ..cache import cache
 from ..exceptions import ErrorType
 from ..models import database_manager
-from ..models.query_builder import JoinMeta
 from ..models.users import (
     UserAccount,
     UserRole,
@@ -25,6 +24,7 @@ from ..models.query_builder import QueryBuilder
 
 from ..controllers.base_ctrl import braceletBaseCtrl
 from ..controllers.email import email_ctrl
+from ..controllers.password_hash import password_hash_ctrl
 from ..controllers.passwords import TokenType, password_ctrl
 
 
@@ -97,8 +97,19 @@ class UserAccountCtrl(braceletBaseCtrl):
             )
 
     @classmethod
-    def verify_password(cls, plain_password: str, hashed_password: str) -> bool:
-        return cls.Model.get_password_hash(plain_password) == hashed_password
+    async def verify_password(cls, plain_password: str, hashed_password: str, user_id: int = None) -> bool:
+        """
+        Check the password against the stored hash
+        :param user_id: if present and the stored hash was generated by an outdated hasher, it's replaced
+                        with a new one generated by the default hasher
+        """
+        valid, needs_rehash = await password_hash_ctrl.verify_password(plain_password, hashed_password)
+
+        if valid and needs_rehash and user_id is not None:
+            new_hash = await password_hash_ctrl.hash_password(plain_password)
+            await cls.Model.update_password_hash(user_id, new_hash)
+
+        return valid
 
     @classmethod
     async def send_email_unlock_account(cls, user_account: UserAccount):
@@ -109,36 +120,78 @@ class UserAccountCtrl(braceletBaseCtrl):
         )
 
         email_subject = f'Your account has been locked out due to several login attempts!'
-        tpl_fpath = f'{email_ctrl.email_template_dir}/email_unlock_account.mako'
-        with open(tpl_fpath, encoding='utf-8') as fh:
-            tpl      = fh.read()
-            tpl_data = {
-                'user'         : user_account,
-                'token'        : password_token,
-                'prefix_url'   : 'https://localhost/',
-                'unlock_hours' : password_ctrl.account_block_duration_hours
-            }
+        tpl_data = {
+            'user'         : user_account,
+            'token'        : password_token,
+            'prefix_url'   : 'https://localhost/',
+            'unlock_hours' : password_ctrl.account_block_duration_hours
+        }
 
-            email_html = email_ctrl.render_tpl(tpl, tpl_data)
+        email_html = email_ctrl.render_template('email_unlock_account.mako', tpl_data)
 
         password_token_info = password_ctrl.get_redis_refresh_token_info(password_token)
         cache_timeout       = password_ctrl.unlock_account_token_expire_minutes * 60
         await cache.set( password_token_info['key'], password_token_info['data'], cache_timeout )
-        await email_ctrl.send_email(email_subject, [user_account.email], body_html=email_html)
+        await email_ctrl.queue_email(email_subject, [user_account.email], body_html=email_html)
 
     @classmethod
-    async def get_login_redis_info(cls, email: str) -> Dict:
-        data = await cache.get(f"login-failed-{email}")
-        key  = f"login-failed-{email}"
-
-        return {
-            "key"      : key,
-            "attempts" : int(data) if data is not None else 0,
-            "ttl"      : password_ctrl.login_attempts_ttl_minutes
+    def get_login_limits(cls, email: str, client_ip: Optional[str] = None) -> Dict[str, Tuple[int, int]]:
+        """
+        Sliding windows used to limit the login attempts, the email window has no limit because the account is
+        blocked when it reaches login_max_attempts_until_block, it's only delayed with an increasing backoff
+        :return: window key -> (limit, backoff step in ms)
+        """
+        limits = {
+            f'login-attempts-{email}' : (0, password_ctrl.login_backoff_step_ms)
         }
 
+        if client_ip:
+            limits[f'login-attempts-ip-{client_ip}'] = (password_ctrl.login_max_attempts_per_ip, 0)
+
+        return limits
+
     @classmethod
-    async def get_user_login(cls, email: str, password: str) -> Optional[UserAccount]:
+    async def check_login_limits(cls, limits: Dict[str, Tuple[int, int]], member: str) -> List[int]:
+        """
+        Reserve a login attempt in the login windows, checked and added in a single script so concurrent attempts
+        can't all pass the check. Raises TooManyRequestsError with the seconds to wait if the caller must retry
+        later, in that case nothing is reserved
+        :param member: id of the attempt, needed to give it back with refund_login_attempt
+        :return: attempts count for each window, including the reserved one
+        """
+        retry_after, counts = await cache.sliding_window(
+            limits,
+            window      = password_ctrl.login_attempts_ttl_minutes * 60,
+            max_backoff = password_ctrl.login_backoff_max_ms,
+            reserve     = True,
+            member      = member
+        )
+
+        if retry_after > 0:
+            raise exceptions.TooManyRequestsError(
+                loc         = [ 'user_account' ],
+                type        = exceptions.ErrorType.LOGIN_TOO_MANY_ATTEMPTS,
+                retry_after = retry_after
+            )
+
+        return counts
+
+    @classmethod
+    async def refund_login_attempt(cls, limits: Dict[str, Tuple[int, int]], member: str) -> None:
+        """
+        Gives back an attempt reserved by check_login_limits, it isn't a failed attempt
+        """
+        await cache.sliding_window_refund(list(limits.keys()), member)
+
+    @classmethod
+    async def get_user_login(cls, email: str, password: str, client_ip: Optional[str] = None) -> Optional[UserAccount]:
+        limits = cls.get_login_limits(email, client_ip)
+        member = secrets.token_hex(8)
+
+        # Rejected before touching the DB or hashing anything. Every attempt is counted as failed up front and
+        # given back if it succeeds, so a burst of concurrent attempts can't skip the backoff
+        attempts = (await cls.check_login_limits(limits, member))[0]
+
         user_account = await cls.get(id=email, field_name='email', raise_not_found=False)
 
         if user_account is None or user_account.user_status_name in ('pending', 'inactive'):
@@ -147,6 +200,7 @@ class UserAccountCtrl(braceletBaseCtrl):
         if user_account.blocked_ts is not None:
             if user_account.blocked_ts + timedelta(hours=password_ctrl.account_block_duration_hours) \
                     >= datetime.now(timezone.utc):
+                await cls.refund_login_attempt(limits, member)
                 raise exceptions.DataConflictError(
                     loc   = [ 'user_account' ],
                     type  = exceptions.ErrorType.LOGIN_INVALID_CREDENTIALS_USER_BLOCKED,
@@ -155,40 +209,34 @@ class UserAccountCtrl(braceletBaseCtrl):
             user_account.blocked_ts = None
             await cls.update(user_account.id, user_account)
 
-        login_redis_info = await cls.get_login_redis_info(email)
-        if cls.verify_password(plain_password=password, hashed_password=user_account.password):
-            if login_redis_info is not None:
-                await cache.delete(login_redis_info['key'])
+        email_key = f'login-attempts-{email}'
+
+        if await cls.verify_password(
+            plain_password  = password,
+            hashed_password = user_account.password,
+            user_id         = user_account.id
+        ):
+            await cls.refund_login_attempt(limits, member)
+            await cache.delete(email_key)
             return user_account
 
-        if login_redis_info['attempts'] == password_ctrl.login_max_attempts_until_block - 1:
+        if attempts >= password_ctrl.login_max_attempts_until_block:
             user_account.blocked_ts = datetime.now(timezone.utc)
             await cls.update(user_account.id, user_account)
-            await cache.delete(login_redis_info['key'])
+            await cache.delete(email_key)
             await cls.send_email_unlock_account(user_account)
             raise exceptions.DataConflictError(
                 loc   = [ 'user_account' ],
                 type  = exceptions.ErrorType.LOGIN_INVALID_CREDENTIALS_USER_BLOCKED,
             )
 
-        else:
-            current_attempt = login_redis_info['attempts']
-            login_redis_info['attempts'] += 1
-            await cache.set(
-                login_redis_info['key'],
-                str(login_redis_info['attempts']),
-                login_redis_info['ttl']
-            )
-
-            delay = 0.1 * current_attempt
-            await asyncio.sleep(delay)
-            raise exceptions.DataConflictError(
-                loc   = [ 'user_account' ],
-                type  = exceptions.ErrorType.LOGIN_INVALID_CREDENTIALS,
-                extra = {
-                    'attempts_left' : password_ctrl.login_max_attempts_until_block - login_redis_info['attempts']
-                }
-            )
+        raise exceptions.DataConflictError(
+            loc   = [ 'user_account' ],
+            type  = exceptions.ErrorType.LOGIN_INVALID_CREDENTIALS,
+            extra = {
+                'attempts_left' : password_ctrl.login_max_attempts_until_block - attempts
+            }
+        )
 
     @classmethod
     async def edit_password(cls, user_id: int, new_password: str) -> UserAccount:
@@ -204,7 +252,7 @@ class UserAccountCtrl(braceletBaseCtrl):
     async def change_password(cls, user_id: int, old_password: str, new_password: str):
         user_account = await cls.get(user_id, fields_map={'password': True})
 
-        if user_account.password != cls.Model.get_password_hash(old_password):
+        if not await cls.verify_password(old_password, user_account.password):
             raise exceptions.ValidationError(
                 loc  = ['body', 'old_password'],
                 msg  = 'Invalid old password',
@@ -272,132 +320,20 @@ class UserAccountCtrl(braceletBaseCtrl):
         else:
             raise NotImplemented("This token_type is not supported in this function")
 
-        tpl_fpath = f'{email_ctrl.email_template_dir}/{tpl_fname}'
-        with open(tpl_fpath, encoding='utf-8') as fh:
-            tpl      = fh.read()
-            tpl_data = {
-                'user'  : user_account,
-                'prefix_url': 'https://localhost/',
-                # 'prefix_url'   : redirect_url,
-                'token' : password_token
-            }
+        tpl_data = {
+            'user'  : user_account,
+            'prefix_url': 'https://localhost/',
+            # 'prefix_url'   : redirect_url,
+            'token' : password_token
+        }
 
-            email_html = email_ctrl.render_tpl(tpl, tpl_data)
+        email_html = email_ctrl.render_template(tpl_fname, tpl_data)
 
         password_token_info = password_ctrl.get_redis_refresh_token_info(password_token)
 
         await cache.set( password_token_info['key'], password_token_info['data'], cache_timeout )
 
-        await email_ctrl.send_email(email_subject, [user_email], body_html=email_html)
-
-    # noinspection PyDefaultArgument
-    @classmethod
-    async def _apply_fts_sort_builder(
-            cls,
-            builder    : QueryBuilder                  = None,
-            fts        : str                           = "",
-            fields_map : Dict[Union[str, Column], Any] = {},
-            sort_map   : OrderedDict                   = {}
-    ):
-        if not builder:
-            builder = QueryBuilder(cls.Model)
-
-        user_t = cls.Model.Table
-        # This expression is the same used for the trigram gist index
-        col_expr = user_t.c.email \
-            .concat(' ') \
-            .concat(user_t.c.first_name) \
-            .concat(' ') \
-            .concat(user_t.c.first_name) \
-            .concat(' ') \
-            .concat(user_t.c.last_name) \
-            .concat(
-            sa.func.coalesce(
-                sa.literal(' ').concat(user_t.c.phone),
-                sa.literal('')
-            )
-        )
-
-        # We use to filter both % and %>, the later being word similarity, this is needed to find small search texts
-        # the full column is too big to search in all the text with only a keyword, you don't pass the threshold
-        fts_query = sa.select([
-            *user_t.c,
-            sa.cast(
-                col_expr.op('<->')(fts),
-                sa.Numeric(5, 4)
-            ).label('match_distance')
-        ]).select_from(
-            user_t
-        ).where(
-            sa.or_(
-                col_expr % fts,
-                col_expr.op('%>')(fts)
-
-            )
-        ).alias('fts')
-
-        builder = builder.add_join(
-            JoinMeta(
-                table    = fts_query,
-                onclause = JoinMeta.OnClause(
-                    left  = cls.Model.Table.c.id,
-                    right = fts_query.c.id
-                )
-            )
-        )
-
-        builder = cls.apply_special_sort(
-            builder    = builder,
-            column     = fts_query.c.match_distance,
-            sort_order = 'asc',
-            fields_map = fields_map,
-            sort_map   = sort_map
-        )
-
-        return builder
-
-    # noinspection PyDefaultArgument
-    @classmethod
-    async def search(
-            cls,
-            builder            : QueryBuilder                             = None,
-            fields_map         : Dict[Union[str, Column], Any]            = {},
-            embed_map          : Dict[str, Union[bool, Dict]]             = {},
-            sort_map           : Union[OrderedDict, Dict]                 = {},
-            reverse_query_sort : bool                                     = False,
-            reverse_records    : bool                                     = False,
-            limit              : Optional[int]                            = None,
-            offset             : Optional[int]                            = None,
-            where_conds        : Sequence[Tuple[str, Mapping]]            = (),
-            extra_args         : Dict[str, Any]                           = {},
-            dynamic_rel_context : Dict[ str, Dict[str, Union[str, int]] ] = {}
-    ) -> Tuple[List[UserAccount], bool]:
-        fts_text = extra_args.get('fts')
-
-        if not builder:
-            builder = QueryBuilder(cls.Model)
-
-        if fts_text is not None:
-            builder = await cls._apply_fts_sort_builder(
-                builder    = builder,
-                fts        = fts_text,
-                fields_map = fields_map,
-                sort_map   = sort_map
-            )
-
-        return await super().search(
-            builder             = builder,
-            fields_map          = fields_map,
-            embed_map           = embed_map,
-            sort_map            = sort_map,
-            reverse_query_sort  = reverse_query_sort,
-            reverse_records     = reverse_records,
-            limit               = limit,
-            offset              = offset,
-            where_conds         = where_conds,
-            extra_args          = extra_args,
-            dynamic_rel_context = dynamic_rel_context
-        )
+        await email_ctrl.queue_email(email_subject, [user_email], body_html=email_html)
 
 
 class UserStatusCtrl(braceletBaseCtrl):
@@ -19,6 +19,7 @@ class ErrorType(Enum):
     # Login custom messages
     LOGIN_INVALID_CREDENTIALS              = 1004
     LOGIN_INVALID_CREDENTIALS_USER_BLOCKED = 1005
+    LOGIN_TOO_MANY_ATTEMPTS                = 1006
 
     def error_msg(self) -> str:
         error_codes: typing.Dict[int, str] = {
@@ -36,7 +37,9 @@ class ErrorType(Enum):
             self.LOGIN_INVALID_CREDENTIALS.value:
                 'Invalid credentials to login',
             self.LOGIN_INVALID_CREDENTIALS_USER_BLOCKED.value:
-                'The user was blocked due to several login attempts. Email sent.'
+                'The user was blocked due to several login attempts. Email sent.',
+            self.LOGIN_TOO_MANY_ATTEMPTS.value:
+                'Too many login attempts, retry later'
         }
 
         return error_codes[self.value]
@@ -100,6 +103,19 @@ class DataConflictError(ValidationError):
                 )
 
 
+class TooManyRequestsError(ValidationError):
+    # noinspection PyDefaultArgument
+    def __init__(
+            self,
+            loc         : typing.List  = [],
+            msg         : str          = "",
+            type        : ErrorType    = ErrorType.BAD_REQUEST,
+            retry_after : float        = 0
+    ):
+        super().__init__(loc, msg, type, {'retry_after': retry_after})
+        self.retry_after = retry_after
+
+
 class NotFoundError(Exception): pass
 
 
@@ -1,3 +1,4 @@
+import contextlib
 import time
 import typing
 import re
@@ -5,7 +6,9 @@ import databases
 import sqlparse
 import sqlalchemy as sa
 
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.base import Executable
 from sqlalchemy.sql.functions import ReturnTypeFromArgs
 
 
@@ -14,6 +17,31 @@ class unaccent_text(ReturnTypeFromArgs):
     pass
 
 
+def search_document_column(table: sa.Table, name: str = 'search_document') -> sa.sql.expression.ColumnClause:
+    """
+    Column generated by the database with the unaccented text used by the trigram FTS. It's not added to table.c,
+    so the model queries never select it and the inserts/updates don't try to write it
+    """
+    return sa.sql.expression.ColumnClause(name, sa.TEXT(), _selectable=table)
+
+
+class DeclareCursor(Executable, ClauseElement):
+    """
+    DECLARE <name> NO SCROLL CURSOR FOR <query>, the query is compiled as part of the statement so its parameters
+    keep their types. Cursors only live inside a transaction, rows are read with FETCH <n> FROM <name>
+    """
+    inherit_cache = False
+
+    def __init__(self, name: str, query: ClauseElement):
+        self.name  = name
+        self.query = query
+
+
+@compiles(DeclareCursor)
+def _compile_declare_cursor(element: DeclareCursor, compiler, **kwargs) -> str:
+    return f'DECLARE {element.name} NO SCROLL CURSOR FOR {compiler.process(element.query, **kwargs)}'
+
+
 class DebugDatabases(databases.Database):
     # noinspection PyUnresolvedReferences
     def __init__(self, url: typing.Union[str, "DatabaseURL"], **options: typing.Any):
@@ -90,6 +118,22 @@ class DatabaseManager:
 
         return self.__db_conn
 
+    @contextlib.asynccontextmanager
+    async def task_connection(self) -> typing.AsyncIterator[databases.core.Connection]:
+        """
+        Binds a new pool connection to the current task. The tasks created by a request copy its context, so
+        without this they share the request connection and their queries run one after the other
+        """
+        db_conn    = self.get_db_conn()
+        connection = databases.core.Connection(db_conn._backend)
+        token      = db_conn._connection_context.set(connection)
+
+        try:
+            async with connection:
+                yield connection
+        finally:
+            db_conn._connection_context.reset(token)
+
     def get_metadata(self) -> sa.MetaData:
         """
         Returns SQL Alchemy metadata object
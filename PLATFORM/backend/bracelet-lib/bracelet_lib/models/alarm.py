@@ -85,16 +85,22 @@ class Alarm(braceletBaseModel):
     MergeValidator  = AlarmMerge
     SearchValidator = AlarmSearch
 
+    TrustedSerialization = True
+
+    # Devices resend readings on timeouts, the retries return the stored record instead of a duplicate
+    IdempotencyColumns = ('patient_id', 'alarm_type', 'ts')
+
     Table = sa.Table(
         'alarm',
         database_manager.get_metadata(),
         sa.Column('id', sa.INTEGER(), primary_key=True, autoincrement=True),
-        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False, index=True),
+        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False),
         sa.Column('alarm_type', sa.VARCHAR(64), nullable=False, comment="'fall_detected', 'strange_bpm', 'button_alarm', etc."),
         sa.Column('ts', sa.TIMESTAMP(), nullable=False, comment="Time when alarm was raised"),
         sa.Column('is_urgent', sa.BOOLEAN(), nullable=False, server_default=sa.text('FALSE'), comment="True if urgent"),
         sa.Column('create_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'), index=True),
-        sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'))
+        sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()')),
+        sa.UniqueConstraint('patient_id', 'alarm_type', 'ts', name='uq_alarm_patient_type_ts')  # Also patient_id index
     )
 
     id         : int      = None
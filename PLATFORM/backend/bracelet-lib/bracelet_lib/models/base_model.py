@@ -11,33 +11,62 @@ from typing import (
     List,
     Generator,
     Sequence,
+    Iterable,
     Mapping,
     TypeVar,
     Callable,
     Set,
+    FrozenSet,
     Any,
     Optional,
-    Tuple
+    Tuple,
+    get_args
 )
 
 from decimal import Decimal
 from abc import ABC, abstractmethod
-from sqlalchemy import Table, select, Column, PrimaryKeyConstraint, func
+from dataclasses import dataclass
+from sqlalchemy import Table, select, Column, PrimaryKeyConstraint, func, cast, bindparam, ARRAY, Integer
 from sqlalchemy.sql import Alias
+from sqlalchemy.sql.expression import ColumnClause
+from sqlalchemy.dialects import postgresql
 
 from .relation import RelationType
 # noinspection PyCompatibility
 from .. import exceptions
 from ..cache import cache
-from . import database_manager, relation
+from . import database_manager, relation, codecs
 from .common import modelClass
 
 
+# asyncpg limit of parameters by query, used to split bulk statements
+MAX_QUERY_PARAMS = 32767
+
+
 class SaveAction(enum.Enum):
     CREATE = 1
     UPDATE = 2
 
 
+# Order in which the embedded relations are saved, the first ones are needed to fill FKs of the main record
+SAVE_STAGES = (
+    (RelationType.HasOneDependingRelation,),
+    (RelationType.BelongsToOneRelation,),
+    (RelationType.HasOneRelation, RelationType.HasManyRelation)
+)
+
+
+@dataclass(frozen=True)
+class SavePlan:
+    """
+    What save_static/update_static need to know about a model, calculated once by model
+    """
+    default_columns    : Tuple[Column, ...]          # Columns with Python side defaults
+    relations          : Dict[str, relation.Relation]
+    relation_stages    : Dict[str, Optional[int]]    # Index in SAVE_STAGES, None for relations never saved
+    dynamic_properties : Tuple[str, ...]
+
+
 def json_dumps(obj):
     """
     Helper to use orjson.dumps but allowing bracelet & Pydantic Models
@@ -93,6 +122,32 @@ class BaseModel(ABC):
 
         super().__setattr__(name, value)
 
+    @classmethod
+    @functools.lru_cache()
+    def get_decimal_fields(cls) -> FrozenSet[str]:
+        """
+        Fields automatically cast to Decimal, calculated once per class for the models loaded without __setattr__
+        """
+        return frozenset( name for name, annotation in cls.__annotations__.items() if annotation == 'Decimal' )
+
+    @classmethod
+    def _build_from_items(cls, items: Iterable[Tuple[str, Any]]) -> 'TBaseModel':
+        """
+        Same result as cls(**dict(items)) but skipping the custom __setattr__ for every field. The values are set
+        with object.__setattr__ and not through __dict__, so the instances keep their values inline (accessing
+        __dict__ creates a dict per instance, 40% more memory)
+        """
+        decimal_fields = cls.get_decimal_fields()
+        obj            = cls.__new__(cls)
+
+        for name, value in items:
+            if value is not None and name in decimal_fields and not isinstance(value, Decimal):
+                value = Decimal( str(value) )
+
+            object.__setattr__(obj, name, value)
+
+        return obj
+
     @classmethod
     def from_pydantic(cls, pyd: pydantic.BaseModel, full=True ) -> 'TBaseModel':
         return cls( **pyd.dict(exclude_unset=not full) )
@@ -204,13 +259,52 @@ class BaseModel(ABC):
 
 
 class braceletRedisModel(BaseModel):
-    Prefix  : str = None
-    FieldID : str = 'id'
+    Prefix        : str               = None
+    FieldID       : str               = 'id'
+    Codec         : codecs.RedisCodec = codecs.msgpack_codec
+    SchemaVersion : int               = 1  # Bump it (0-255) when the fields change, older records will be validated
 
     @classmethod
     def _get_full_id(cls, id: Union[int, str]):
         return f'{cls.Prefix}-{id}'
 
+    @classmethod
+    def _encode(cls, data: Mapping) -> bytes:
+        return cls.Codec.encode(data, cls.SchemaVersion)
+
+    @classmethod
+    @functools.lru_cache()
+    def get_enum_fields(cls) -> Dict[str, Type[enum.Enum]]:
+        """
+        Fields annotated with an Enum (or Optional Enum), the codecs store them by value
+        """
+        enum_fields = {}
+        for name, annotation in cls.__annotations__.items():
+            for type_ in (annotation, *get_args(annotation)):
+                if inspect.isclass(type_) and issubclass(type_, enum.Enum):
+                    enum_fields[name] = type_
+                    break
+
+        return enum_fields
+
+    @classmethod
+    def from_redis(cls, raw: bytes) -> 'TbraceletRedisModel':
+        """
+        Records written by this service with the current schema and a codec keeping the types are trusted and
+        loaded without pydantic, only the enums are cast back. The rest (JSON codec, old schema versions or plain
+        JSON records) are validated and cast with FullValidator
+        """
+        data, schema_version, codec = codecs.decode(raw)
+
+        if codec is not None and codec.RoundTripsTypes and schema_version == cls.SchemaVersion:
+            for name, enum_type in cls.get_enum_fields().items():
+                if data.get(name) is not None:
+                    data[name] = enum_type( data[name] )
+
+            return cls(**data)
+
+        return cls.from_dict(data)
+
     @classmethod
     async def get_static(
             cls,
@@ -221,12 +315,29 @@ class braceletRedisModel(BaseModel):
         record = await cache.get( cls._get_full_id(id) )
 
         if record is not None:
-            ret = cls.from_str(record)
+            ret = cls.from_redis(record)
         elif raise_not_found:
             raise exceptions.NotFoundError()
 
         return ret
 
+    @classmethod
+    async def get_many_static(
+            cls,
+            ids             : Sequence[Union[int, str]],
+            raise_not_found : bool = False
+    ) -> List[Optional['TbraceletRedisModel']]:
+        """
+        Load several records with a single round trip
+        :return: records in the same order as ids, None for the missing ones
+        """
+        records = await cache.mget( [cls._get_full_id(id) for id in ids] )
+
+        if raise_not_found and any(record is None for record in records):
+            raise exceptions.NotFoundError()
+
+        return [cls.from_redis(record) if record is not None else None for record in records]
+
     @classmethod
     async def save_static(cls, data: Dict, ttl: Optional[int] = None) -> 'TbraceletRedisModel':
         # If the field_id has a value in the payload we used that, in other case we create an internal ID
@@ -235,21 +346,41 @@ class braceletRedisModel(BaseModel):
             id_value          = await cache.get_next(cls.Prefix)
             data[cls.FieldID] = id_value
 
-        await cache.set( cls._get_full_id(id_value), json_dumps(data), ttl=ttl )
+        await cache.set( cls._get_full_id(id_value), cls._encode(data), ttl=ttl )
 
         return cls.from_dict(data)
 
+    @classmethod
+    async def save_many_static(
+            cls,
+            data_list : Sequence[Dict],
+            ttl       : Optional[int] = None
+    ) -> List['TbraceletRedisModel']:
+        """
+        Save several records with a single round trip (two if some of them need an internal ID)
+        """
+        without_id = [data for data in data_list if data.get(cls.FieldID) is None]
+        if without_id:
+            # Reserve all the IDs at once, same sequence used by save_static
+            id_values = await cache.get_next_many(cls.Prefix, len(without_id))
+            for id_value, data in zip(id_values, without_id):
+                data[cls.FieldID] = id_value
+
+        await cache.mset(
+            { cls._get_full_id(data[cls.FieldID]): cls._encode(data) for data in data_list },
+            ttl = ttl
+        )
+
+        return [cls.from_dict(data) for data in data_list]
+
     async def save(self, action: Optional[SaveAction] = None, ttl: Optional[int] = None) -> 'TbraceletRedisModel':
         cur_id          = getattr(self, self.FieldID, None)
-        raise_not_found = True  # Optimization in case of update, no need to check if already loaded from Redis
+        raise_not_found = True
 
-        if action is None:  # We need to infer the action first
-            if cur_id is None:
-                action = SaveAction.CREATE
-            else:
-                rec    = await cache.get( self._get_full_id(cur_id) )
-                action = SaveAction.CREATE if rec is None else SaveAction.UPDATE
-                raise_not_found = False
+        if action is None:
+            # Creating and updating a record with a known ID are the same SET, no need to check if it exists
+            action          = SaveAction.CREATE if cur_id is None else SaveAction.UPDATE
+            raise_not_found = False
 
         if action == SaveAction.CREATE:
             ret = await self.save_static(self.dict(), ttl=ttl)
@@ -269,7 +400,7 @@ class braceletRedisModel(BaseModel):
         if raise_not_found:
             await cls.get_static(id, raise_not_found=True)
 
-        await cache.set( cls._get_full_id(id), json_dumps(data), ttl=ttl )
+        await cache.set( cls._get_full_id(id), cls._encode(data), ttl=ttl )
         return cls.from_dict(data)
 
     @classmethod
@@ -287,6 +418,21 @@ class braceletBaseModel(BaseModel):
     SearchValidator : modelClass = None
     Table           : Union[Table, Alias, select] = None
 
+    # True if dict() of a loaded record is exactly what FullValidator would serve (no secrets, aliases or
+    # transformations), this allows to serialize DB records directly skipping pydantic
+    TrustedSerialization : bool = False
+
+    # True if the GET responses of the entity can use the HTTP response cache (http_cache of braceletCtrlProxy),
+    # the writes done through the proxy only invalidate it for these models
+    ResponseCached : bool = False
+
+    # Columns of a unique constraint identifying a record, ex: (patient_id, ts) for device readings. If set,
+    # inserts use ON CONFLICT DO NOTHING and a retry of an already saved record returns the stored one
+    IdempotencyColumns : Optional[Tuple[str, ...]] = None
+
+    # Generated column searched by the 'fts' extra arg of braceletBaseCtrl.search, see search_document_column
+    SearchDocument : Optional[ColumnClause] = None
+
     # The following attrs are only needed in models with different names in attr class and DB table columns
     column_translation     : Dict[str, str] = {}
     rev_column_translation : Dict[str, str] = {}
@@ -351,6 +497,21 @@ class braceletBaseModel(BaseModel):
 
         return rec[0]
 
+    @classmethod
+    async def get_next_primary_key_values(cls, count: int) -> List[int]:
+        """
+        Bulk version of get_next_primary_key_value, reserves `count` values of the sequence with one query
+        """
+        if len(cls.Table.primary_key.columns) != 1 or not cls.Table.primary_key.columns[0].autoincrement:
+            raise ValueError("The table's primary key is not a single autoincrement column")
+
+        pk_column = cls.Table.primary_key.columns[0]
+
+        query = select( func.nextval(f'{cls.Table.name}_{pk_column.name}_seq') ) \
+            .select_from( func.generate_series(cast(1, Integer), cast(count, Integer)) )
+
+        return [ rec[0] for rec in await database_manager.get_db_conn().fetch_all( query ) ]
+
     @classmethod
     def apply_id_where(cls, query: select, id) -> select:
         """
@@ -373,12 +534,17 @@ class braceletBaseModel(BaseModel):
 
     @classmethod
     def from_db(cls, record: Mapping) -> 'TbraceletModel':
-        return cls( **dict(record.items()) )
+        return cls._build_from_items( record.items() )
 
     @classmethod
     def from_db_multi(cls, records: Sequence[Mapping]) -> Generator['TbraceletModel', None, None]:
+        if not records:
+            return
+
+        # All the records share the same columns, so the keys are read once and zipped with the values
+        keys = list( records[0].keys() )
         for record in records:
-            yield cls( **dict(record.items()) )
+            yield cls._build_from_items( zip(keys, record.values()) )
 
     @classmethod
     async def _load_defaults(cls, data) -> None:
@@ -387,9 +553,8 @@ class braceletBaseModel(BaseModel):
         Databases need this because of this issue: https://github.com/encode/databases/issues/72
         :param data:
         """
-        # noinspection PyTypeChecker
-        for column in cls.Table.columns:  # type 'sqlalchemy.sql.base.ImmutableColumnCollection'
-            if column.default is not None and column.name not in data:
+        for column in cls.get_save_plan().default_columns:
+            if column.name not in data:
                 value = column.default.arg
 
                 if column.default.is_callable:
@@ -399,6 +564,36 @@ class braceletBaseModel(BaseModel):
 
                 data[column.name] = value
 
+    @classmethod
+    def _pop_save_data(
+            cls,
+            data                : Dict,
+            ignore_rel_entities : bool
+    ) -> Optional[ List[ Dict[str, Dict[str, Any]] ] ]:
+        """
+        Removes from data the dynamic properties and the embedded relations
+        :return: the relation data grouped by SAVE_STAGES, None if there isn't any to save
+        """
+        plan = cls.get_save_plan()
+
+        # Not saving dynamic properties
+        for dyn_col in plan.dynamic_properties:
+            data.pop(dyn_col, None)
+
+        stages = None
+
+        for name in plan.relations.keys() & data.keys():
+            data_rel = data.pop(name)
+            stage    = plan.relation_stages[name]
+
+            if data_rel and ignore_rel_entities is False and stage is not None:
+                if stages is None:
+                    stages = [ {} for _ in SAVE_STAGES ]
+
+                stages[stage][name] = {'data': data_rel, 'relation': plan.relations[name]}
+
+        return stages
+
     @classmethod
     async def _save_relation_data(
             cls,
@@ -505,57 +700,28 @@ class braceletBaseModel(BaseModel):
             with_transaction    : bool = True,
             ignore_rel_entities : bool = False
     ) -> 'TbraceletModel':
-        await cls._load_defaults(data)
-
-        # Not saving dynamic properties
-        for dyn_col in cls.dynamic_properties:
-            data.pop(dyn_col, None)
-
-        rel_tables_data = {}
+        if cls.get_save_plan().default_columns:
+            await cls._load_defaults(data)
 
-        for name, rel in cls.get_relations().items():
-            data_rel = data.pop(name, None)
+        stages = cls._pop_save_data(data, ignore_rel_entities)
 
-            if data_rel and ignore_rel_entities is False:
-                rel_tables_data[name] = {'data': data_rel, 'relation': rel}
-
-        tx = await database_manager.get_db_conn().transaction() if with_transaction else None
+        # A single INSERT is atomic, the transaction is only needed to save embedded relations with it
+        tx = await database_manager.get_db_conn().transaction() if with_transaction and stages else None
         try:
-            await cls._save_relation_data(
-                {
-                    name: rel_info for name, rel_info in rel_tables_data.items()
-                    if rel_info['relation'].rel_type == RelationType.HasOneDependingRelation
-                },
-                data,
-                SaveAction.CREATE
-            )
-
-            # These need to be handled first because we need the generated ID columns
-            await cls._save_relation_data(
-                {
-                    name: rel_info for name, rel_info in rel_tables_data.items()
-                    if rel_info['relation'].rel_type == RelationType.BelongsToOneRelation
-                },
-                data,
-                SaveAction.CREATE
-            )
-
-            query = cls.Table \
-                .insert() \
-                .returning(cls.Table) \
-                .values(data)
+            if stages:
+                # These need to be handled first because we need the generated ID columns
+                await cls._save_relation_data(stages[0], data, SaveAction.CREATE)
+                await cls._save_relation_data(stages[1], data, SaveAction.CREATE)
 
+            query    = cls._insert_query(data)
             inserted = await database_manager.get_db_conn().fetch_one(query)
 
-            # Now, with the main record inserted, we can create the records depending on its ID values
-            await cls._save_relation_data(
-                {
-                    name: rel_info for name, rel_info in rel_tables_data.items()
-                    if rel_info['relation'].rel_type in (RelationType.HasOneRelation, RelationType.HasManyRelation)
-                },
-                inserted,
-                SaveAction.CREATE
-            )
+            if inserted is None:  # Already stored, a retry of the same record (IdempotencyColumns)
+                inserted, = await cls._get_idempotent_records([data])
+
+            if stages:
+                # Now, with the main record inserted, we can create the records depending on its ID values
+                await cls._save_relation_data(stages[2], inserted, SaveAction.CREATE)
 
         except Exception:
             if tx:
@@ -599,18 +765,7 @@ class braceletBaseModel(BaseModel):
             with_transaction    : bool = True,
             ignore_rel_entities : bool = False
     ) -> Optional['TbraceletModel']:
-
-        # Not saving dynamic properties
-        for dyn_col in cls.dynamic_properties:
-            data.pop(dyn_col, None)
-
-        rel_tables_data = {}
-
-        for name, rel in cls.get_relations().items():
-            data_rel = data.pop(name, None)
-
-            if data_rel and ignore_rel_entities is False:
-                rel_tables_data[name] = {'data': data_rel, 'relation': rel}
+        stages = cls._pop_save_data(data, ignore_rel_entities)
 
         query = cls.Table \
             .update() \
@@ -618,39 +773,20 @@ class braceletBaseModel(BaseModel):
 
         query = cls.apply_id_where(query, id)
 
-        tx = await database_manager.get_db_conn().transaction() if with_transaction else None
+        # A single UPDATE is atomic, the transaction is only needed to save embedded relations with it
+        tx = await database_manager.get_db_conn().transaction() if with_transaction and stages else None
         try:
-            await cls._save_relation_data(
-                {
-                    name: rel_info for name, rel_info in rel_tables_data.items()
-                    if rel_info['relation'].rel_type == RelationType.HasOneDependingRelation
-                },
-                data,
-                SaveAction.UPDATE
-            )
-
-            # These need to be handled first because we need the generated ID columns
-            await cls._save_relation_data(
-                {
-                    name: rel_info for name, rel_info in rel_tables_data.items()
-                    if rel_info['relation'].rel_type == RelationType.BelongsToOneRelation
-                },
-                data,
-                SaveAction.UPDATE
-            )
+            if stages:
+                # These need to be handled first because we need the generated ID columns
+                await cls._save_relation_data(stages[0], data, SaveAction.UPDATE)
+                await cls._save_relation_data(stages[1], data, SaveAction.UPDATE)
 
             updated = await database_manager.get_db_conn().fetch_one(query.values(data))
 
             if updated:
-                # Now, with the main record inserted, we can create the records depending on its ID values
-                await cls._save_relation_data(
-                    {
-                        name: rel_info for name, rel_info in rel_tables_data.items()
-                        if rel_info['relation'].rel_type in (RelationType.HasOneRelation, RelationType.HasManyRelation)
-                    },
-                    updated,
-                    SaveAction.UPDATE
-                )
+                if stages:
+                    # Now, with the main record updated, we can create the records depending on its ID values
+                    await cls._save_relation_data(stages[2], updated, SaveAction.UPDATE)
 
             elif raise_not_found:
                 raise exceptions.NotFoundError()
@@ -670,6 +806,368 @@ class braceletBaseModel(BaseModel):
 
         return obj
 
+    @classmethod
+    async def _prepare_many(
+            cls,
+            data_list           : Sequence[Dict],
+            ignore_rel_entities : bool,
+            load_defaults       : bool
+    ) -> List[ Optional[ List[ Dict[str, Dict[str, Any]] ] ] ]:
+        """
+        Same data preparation done by save_static/update_static, applied to every row of a bulk operation
+        :return: the relation data popped from every row (see _pop_save_data), in the same order
+        """
+        load_defaults = load_defaults and bool( cls.get_save_plan().default_columns )
+        stages_list   = []
+
+        for data in data_list:
+            if load_defaults:
+                await cls._load_defaults(data)
+
+            stages_list.append( cls._pop_save_data(data, ignore_rel_entities) )
+
+        return stages_list
+
+    @classmethod
+    async def _save_relation_data_before_many(
+            cls,
+            stages_list : Sequence[ Optional[ List[ Dict[str, Dict[str, Any]] ] ] ],
+            data_list   : Sequence[Dict],
+            action      : SaveAction
+    ) -> None:
+        """
+        HasOneDepending and BelongsToOne relations of bulk operations, they are needed to fill the FKs of every row
+        """
+        for stage in (0, 1):
+            for stages, data in zip(stages_list, data_list):
+                if stages:
+                    await cls._save_relation_data(stages[stage], data, action)
+
+    @classmethod
+    async def _create_children_many(
+            cls,
+            stages_list  : Sequence[ Optional[ List[ Dict[str, Dict[str, Any]] ] ] ],
+            main_records : Sequence[Mapping]
+    ) -> None:
+        """
+        Bulk version of the HasOne/HasMany part of _save_relation_data for CREATE, the children of all the main
+        records are grouped by relation and inserted with one save_many_static per relation
+        """
+        children: Dict[str, Tuple[relation.Relation, List[Dict]]] = {}
+
+        for stages, main_record in zip(stages_list, main_records):
+            if not stages:
+                continue
+
+            for rel_name, rel_info in stages[2].items():
+                # noinspection PyShadowingNames
+                relation = rel_info['relation']
+
+                # Validations and FK filling are the ones of _save_relation_data, done row by row
+                if relation.join.through or relation.model is None or (
+                        relation.rel_type == RelationType.HasManyRelation and not isinstance(rel_info['data'], list)
+                ):
+                    await cls._save_relation_data({rel_name: rel_info}, main_record, SaveAction.CREATE)
+                    continue
+
+                relation_data = rel_info['data'] if isinstance(rel_info['data'], list) else [ rel_info['data'] ]
+
+                for data_in in relation_data:
+                    for fk in relation.model.Table.foreign_keys:
+                        if fk.column.table is cls.Table:
+                            for col_t in fk.constraint.columns:
+                                if data_in.get(col_t.name, None) is None:
+                                    data_in[col_t.name] = main_record[fk.column.name]
+
+                children.setdefault(rel_name, (relation, []))[1].extend(relation_data)
+
+        for relation, relation_data in children.values():
+            await relation.model.save_many_static(relation_data, with_transaction=False)
+
+    @classmethod
+    def _unnest_rows(
+            cls,
+            columns         : Sequence[str],
+            rows            : Sequence[Mapping],
+            name            : str,
+            with_ordinality : Optional[str] = None
+    ):
+        """
+        Table valued unnest() of typed arrays, one per column, used to join a batch of rows with the table.
+        The arrays are typed so PostgreSQL knows the type of every parameter, a VALUES list would take them as text
+        """
+        arrays = [
+            cast(
+                bindparam(f'{name}_{i}', [ data[col] for data in rows ], type_=ARRAY(cls.Table.c[col].type)),
+                ARRAY(cls.Table.c[col].type)
+            )
+            for i, col in enumerate(columns)
+        ]
+
+        return func.unnest(*arrays).table_valued(*columns, with_ordinality=with_ordinality).render_derived(name=name)
+
+    @classmethod
+    def _insert_query(cls, values: Union[Dict, List[Dict]]):
+        if cls.IdempotencyColumns is None:
+            query = cls.Table.insert()
+        else:
+            query = postgresql.insert(cls.Table).on_conflict_do_nothing(index_elements=cls.IdempotencyColumns)
+
+        return query.returning(cls.Table).values(values)
+
+    @classmethod
+    async def _get_idempotent_records(cls, rows: Sequence[Mapping]) -> List[Mapping]:
+        """
+        Loads the already stored records matching the IdempotencyColumns of every row, in the same order. Raises
+        DataConflictError if any of them is missing: the conflicting record was deleted after the insert skipped
+        the row, so it's neither inserted nor stored
+        """
+        if len(rows) == 1:
+            query = cls.Table.select()
+            for col in cls.IdempotencyColumns:
+                query = query.where( cls.Table.c[col] == rows[0][col] )
+
+            found = [ await database_manager.get_db_conn().fetch_one(query) ]
+        else:
+            values = cls._unnest_rows(
+                cls.IdempotencyColumns, rows, 'idempotency_values', with_ordinality='row_index'
+            )
+            query  = select([ values.c.row_index, cls.Table ])
+            for col in cls.IdempotencyColumns:
+                query = query.where( cls.Table.c[col] == values.c[col] )
+
+            found = [None] * len(rows)
+            for record in await database_manager.get_db_conn().fetch_all(query):
+                found[ record['row_index'] - 1 ] = { c.name: record[c.name] for c in cls.Table.c }
+
+        if None in found:
+            raise exceptions.DataConflictError(
+                loc = ['body'] + list(cls.IdempotencyColumns),
+                msg = 'A stored record with the same values was deleted concurrently, the request can be retried'
+            )
+
+        return found
+
+    @classmethod
+    def _chunk_rows_by_columns(
+            cls,
+            rows : Sequence[Tuple[int, Dict]]
+    ) -> Generator[ Tuple[Tuple[str, ...], List[Tuple[int, Dict]]], None, None ]:
+        """
+        Multi-row statements need the same columns in every row and asyncpg allows up to 32767 parameters by
+        query, so rows are grouped by their column set and split to keep the parameters under that limit
+        """
+        groups: Dict[Tuple[str, ...], List[Tuple[int, Dict]]] = {}
+        for index, data in rows:
+            groups.setdefault(tuple( sorted(data.keys()) ), []).append( (index, data) )
+
+        for columns, group in groups.items():
+            chunk_size = max(1, MAX_QUERY_PARAMS // max(1, len(columns)))
+            for start in range(0, len(group), chunk_size):
+                yield columns, group[start:start + chunk_size]
+
+    @classmethod
+    async def save_many_static(
+            cls,
+            data_list           : Sequence[Dict],
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List['TbraceletModel']:
+        """
+        Bulk version of save_static, rows are inserted with multi-row INSERT ... RETURNING statements and the
+        embedded relations are saved in batches, all inside the same transaction. PostgreSQL doesn't guarantee
+        the order of the RETURNING rows, so the autoincrement ids are reserved before the insert and the records
+        are matched by primary key
+        :param data_list: rows to insert, the dicts are modified in place as in save_static
+        :return: the inserted records, in the same order as data_list
+        """
+        if not data_list:
+            return []
+
+        stages_list = await cls._prepare_many(data_list, ignore_rel_entities, load_defaults=True)
+        inserted: List[Optional[Mapping]] = [None] * len(data_list)
+
+        tx = await database_manager.get_db_conn().transaction() if with_transaction else None
+        try:
+            # These need to be handled first because we need the generated ID columns
+            await cls._save_relation_data_before_many(stages_list, data_list, SaveAction.CREATE)
+
+            pkey_cols   = [ c.name for c in cls.get_primary_key_columns() ]
+            serial_pk   = len(pkey_cols) == 1 and cls.Table.c[pkey_cols[0]].autoincrement is True
+            rows        = list(data_list)
+            missing_ids = [ index for index, data in enumerate(rows) if data.get(pkey_cols[0]) is None ]
+
+            if len(rows) > 1 and missing_ids and serial_pk:
+                # Copies, the ids are only returned in the records in case the transaction is rolled back
+                ids = await cls.get_next_primary_key_values( len(missing_ids) )
+                for index, pk_value in zip(missing_ids, ids):
+                    rows[index] = { **rows[index], pkey_cols[0]: pk_value }
+
+            for _, chunk in cls._chunk_rows_by_columns( list(enumerate(rows)) ):
+                records = await database_manager.get_db_conn().fetch_all(
+                    cls._insert_query([ data for _, data in chunk ])
+                )
+
+                if len(records) < len(chunk):  # Some rows were already stored (IdempotencyColumns)
+                    records = await cls._get_idempotent_records([ data for _, data in chunk ])
+
+                    for (index, _), record in zip(chunk, records):
+                        inserted[index] = record
+                elif len(chunk) == 1:
+                    inserted[ chunk[0][0] ] = records[0]
+                else:
+                    indexes = { tuple( data[pk] for pk in pkey_cols ): index for index, data in chunk }
+                    for record in records:
+                        inserted[ indexes[ tuple(record[pk] for pk in pkey_cols) ] ] = record
+
+            # Now, with the main records inserted, we can create the records depending on their ID values
+            await cls._create_children_many(stages_list, inserted)
+
+        except Exception:
+            if tx:
+                await tx.rollback()
+            raise
+        else:
+            if tx:
+                await tx.commit()
+
+        return list( cls.from_db_multi(inserted) )
+
+    @classmethod
+    async def update_many_static(
+            cls,
+            data_list           : Sequence[Dict],
+            raise_not_found     : bool = True,
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List[Optional['TbraceletModel']]:
+        """
+        Bulk version of update_static, the ids are taken from the primary key columns of every row and the rows
+        are updated with UPDATE ... FROM unnest(...) statements, one per group of rows setting the same columns
+        :param data_list: rows to update, all of them must include the primary key values
+        :return: the updated records in the same order as data_list, None for the ones not found if
+                 raise_not_found is False
+        """
+        if not data_list:
+            return []
+
+        pkey_cols  = [ c.name for c in cls.get_primary_key_columns() ]
+        for data in data_list:
+            if any( data.get(pk) is None for pk in pkey_cols ):
+                raise exceptions.ValidationError(
+                    loc  = ['body'] + pkey_cols,
+                    msg  = f'All the rows of a bulk update need the primary key columns: {pkey_cols}',
+                    type = exceptions.ErrorType.BAD_REQUEST
+                )
+
+        stages_list = await cls._prepare_many(data_list, ignore_rel_entities, load_defaults=False)
+        updated: List[Optional[Mapping]] = [None] * len(data_list)
+
+        tx = await database_manager.get_db_conn().transaction() if with_transaction else None
+        try:
+            await cls._save_relation_data_before_many(stages_list, data_list, SaveAction.UPDATE)
+
+            for columns, chunk in cls._chunk_rows_by_columns( list(enumerate(data_list)) ):
+                values = cls._unnest_rows(columns, [ data for _, data in chunk ], 'bulk_values')
+
+                set_values = { name: values.c[name] for name in columns if name not in pkey_cols }
+                if set_values:
+                    query = cls.Table \
+                        .update() \
+                        .returning(cls.Table) \
+                        .values(set_values)
+                else:  # Only the ids, ex: to update embedded relations, the records are just loaded
+                    query = cls.Table.select()
+
+                for pk in pkey_cols:
+                    query = query.where( cls.Table.c[pk] == values.c[pk] )
+
+                records = await database_manager.get_db_conn().fetch_all(query)
+
+                # UPDATE ... FROM doesn't keep any order, the records are matched by id
+                indexes = { tuple( data[pk] for pk in pkey_cols ): index for index, data in chunk }
+                for record in records:
+                    updated[ indexes[ tuple(record[pk] for pk in pkey_cols) ] ] = record
+
+            if raise_not_found and None in updated:
+                raise exceptions.NotFoundError()
+
+            # Children could be created or updated, so the generic relation handling is used for every record
+            for stages, record in zip(stages_list, updated):
+                if stages and record is not None:
+                    await cls._save_relation_data(stages[2], record, SaveAction.UPDATE)
+
+        except Exception:
+            if tx:
+                await tx.rollback()
+            raise
+
+        if tx:
+            await tx.commit()
+
+        return [ cls.from_db(record) if record is not None else None for record in updated ]
+
+    @classmethod
+    async def upsert_many_static(
+            cls,
+            data_list        : Sequence[Dict],
+            conflict_columns : Optional[Sequence[str]] = None,
+            update_columns   : Optional[Sequence[str]] = None,
+            with_transaction : bool = True
+    ) -> List['TbraceletModel']:
+        """
+        Bulk INSERT ... ON CONFLICT, embedded relations are not supported here and are ignored
+        :param conflict_columns: columns of the unique constraint/index, the primary key by default
+        :param update_columns: columns overwritten on conflicts, by default all the inserted columns except the
+                               conflict ones, an empty list means ON CONFLICT DO NOTHING
+        :return: the inserted or updated records, rows skipped by DO NOTHING are not returned. Rows with the same
+                 conflict values are upserted once, the last one wins, as ON CONFLICT DO UPDATE can't affect the
+                 same record twice in a statement
+        """
+        if not data_list:
+            return []
+
+        if conflict_columns is None:
+            conflict_columns = [ c.name for c in cls.get_primary_key_columns() ]
+
+        await cls._prepare_many(data_list, ignore_rel_entities=True, load_defaults=True)
+        upserted = []
+
+        unique_rows: Dict[Tuple, Dict] = {}
+        for data in data_list:
+            key = tuple( data.get(col) for col in conflict_columns )
+            # NULLs never conflict, those rows are always inserted
+            unique_rows[ object() if None in key else key ] = data
+
+        tx = await database_manager.get_db_conn().transaction() if with_transaction else None
+        try:
+            for columns, chunk in cls._chunk_rows_by_columns( list(enumerate(unique_rows.values())) ):
+                query = postgresql.insert(cls.Table).values([ data for _, data in chunk ])
+
+                set_columns = [
+                    name for name in (columns if update_columns is None else update_columns)
+                    if name not in conflict_columns
+                ]
+                if set_columns:
+                    query = query.on_conflict_do_update(
+                        index_elements = conflict_columns,
+                        set_           = { name: query.excluded[name] for name in set_columns }
+                    )
+                else:
+                    query = query.on_conflict_do_nothing(index_elements=conflict_columns)
+
+                upserted.extend( await database_manager.get_db_conn().fetch_all( query.returning(cls.Table) ) )
+
+        except Exception:
+            if tx:
+                await tx.rollback()
+            raise
+
+        if tx:
+            await tx.commit()
+
+        return list( cls.from_db_multi(upserted) )
+
     @classmethod
     async def delete_static(
             cls,
@@ -778,6 +1276,26 @@ class braceletBaseModel(BaseModel):
 
         return set( all_fields )
 
+    @classmethod
+    @functools.lru_cache()
+    def get_save_plan(cls) -> SavePlan:
+        """
+        Everything the save methods would otherwise calculate on every call from the Table and the relations
+        """
+        relations = cls.get_relations()
+        stages    = {}
+
+        for name, rel in relations.items():
+            stages[name] = next( (i for i, rel_types in enumerate(SAVE_STAGES) if rel.rel_type in rel_types), None )
+
+        # noinspection PyTypeChecker
+        return SavePlan(
+            default_columns    = tuple( c for c in cls.Table.columns if c.default is not None ),
+            relations          = relations,
+            relation_stages    = stages,
+            dynamic_properties = tuple(cls.dynamic_properties)
+        )
+
 
 # This is needed for places where the expected types are subclasses of this model
 TBaseModel            = TypeVar('TBaseModel', bound=BaseModel)
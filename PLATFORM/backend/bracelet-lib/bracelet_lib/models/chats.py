@@ -27,6 +27,24 @@ def get_chat_schema() -> Dict:
             'example': False,
             'description': 'True if one of the participants is an admin (technical support chat)'
         },
+        'last_message_id': {
+            'ge': 1,
+            'example': 10,
+            'description': 'Last message of the chat, maintained when the messages are created or deleted'
+        },
+        'last_message_ts': {
+            'example': '2025-05-26T12:34:56Z'
+        },
+        'user1_last_read_message_id': {
+            'ge': 1,
+            'example': 10,
+            'description': 'Last message read by user1, the chat has unread messages for user1 if it is lower than last_message_id'
+        },
+        'user2_last_read_message_id': {
+            'ge': 1,
+            'example': 9,
+            'description': 'Last message read by user2'
+        },
         'create_ts': {
             'example': '2025-05-26T12:34:56Z'
         },
@@ -52,6 +70,10 @@ class Chat(braceletBaseModel):
         user1_id      : Optional[int]      = Field(None, **chat_schema['user1_id'])
         user2_id      : Optional[int]      = Field(None, **chat_schema['user2_id'])
         administration: Optional[bool]     = Field(None, **chat_schema['administration'])
+        last_message_id           : Optional[int]      = Field(None, **chat_schema['last_message_id'])
+        last_message_ts           : Optional[datetime] = Field(None, **chat_schema['last_message_ts'])
+        user1_last_read_message_id: Optional[int]      = Field(None, **chat_schema['user1_last_read_message_id'])
+        user2_last_read_message_id: Optional[int]      = Field(None, **chat_schema['user2_last_read_message_id'])
         create_ts     : Optional[datetime] = Field(None, **chat_schema['create_ts'])
         update_ts     : Optional[datetime] = Field(None, **chat_schema['update_ts'])
 
@@ -89,6 +111,10 @@ class Chat(braceletBaseModel):
         sa.Column('user1_id', sa.INTEGER(), sa.ForeignKey('user_account.id', ondelete='CASCADE'), nullable=False, index=True),
         sa.Column('user2_id', sa.INTEGER(), sa.ForeignKey('user_account.id', ondelete='CASCADE'), nullable=False, index=True),
         sa.Column('administration', sa.BOOLEAN(), nullable=False, default=False, index=True),
+        sa.Column('last_message_id', sa.INTEGER(), nullable=True, comment="Last message, by ts and id"),
+        sa.Column('last_message_ts', sa.TIMESTAMP(), nullable=True, comment="Time when the last message was sent"),
+        sa.Column('user1_last_read_message_id', sa.INTEGER(), nullable=True, comment="Last message read by user1"),
+        sa.Column('user2_last_read_message_id', sa.INTEGER(), nullable=True, comment="Last message read by user2"),
         sa.Column('create_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'), index=True),
         sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'))
     )
@@ -97,6 +123,10 @@ class Chat(braceletBaseModel):
     user1_id      : int      = None
     user2_id      : int      = None
     administration: bool     = None
+    last_message_id           : int      = None
+    last_message_ts           : datetime = None
+    user1_last_read_message_id: int      = None
+    user2_last_read_message_id: int      = None
     create_ts     : datetime = None
     update_ts     : datetime = None
 
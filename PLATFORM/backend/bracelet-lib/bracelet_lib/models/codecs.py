@@ -0,0 +1,129 @@
+import enum
+import datetime
+import msgpack
+import orjson
+import pydantic
+
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from typing import Dict, Mapping, Tuple, Optional
+
+
+class RedisCodec(ABC):
+    """
+    Serialization used to store Redis models, every encoded value starts with two bytes:
+    the codec id, to know how to decode it, and the schema version of the model that wrote it
+    """
+    CodecId         : int  = None
+    RoundTripsTypes : bool = False  # True if the decoded values keep their types, so they can skip the validation
+
+    @abstractmethod
+    def dumps(self, data: Mapping) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, payload: bytes) -> Dict:
+        pass
+
+    def encode(self, data: Mapping, schema_version: int) -> bytes:
+        return bytes( (self.CodecId, schema_version) ) + self.dumps(data)
+
+
+def _default(o):
+    if isinstance(o, pydantic.BaseModel):
+        return o.dict(exclude_unset=True)
+
+    elif hasattr(o, 'dynamic_properties'):  # bracelet models, base_model can't be imported here
+        return o.dict()
+
+    elif isinstance(o, Decimal):
+        return str(o)
+
+    elif isinstance(o, enum.Enum):
+        return o.value
+
+    elif isinstance(o, datetime.date):  # datetime.datetime is handled by msgpack itself
+        return o.isoformat()
+
+    raise TypeError(f'Object of type {type(o).__name__} is not serializable')
+
+
+class OrjsonCodec(RedisCodec):
+    CodecId = 1
+
+    def dumps(self, data: Mapping) -> bytes:
+        return orjson.dumps(data, default=_default)
+
+    def loads(self, payload: bytes) -> Dict:
+        return orjson.loads(payload)
+
+
+class MsgpackCodec(RedisCodec):
+    """
+    Smaller than JSON and faster to decode. Timezone aware datetimes are kept as msgpack timestamps, naive
+    datetimes and dates as ext types, so they are loaded back with their types without any validation. Enums
+    are stored by value, braceletRedisModel casts them back
+    """
+    CodecId         = 3
+    RoundTripsTypes = True
+
+    ExtNaiveDatetime = 1
+    ExtDate          = 2
+
+    @classmethod
+    def _default(cls, o):
+        if isinstance(o, datetime.datetime):  # Only the naive ones get here
+            return msgpack.ExtType( cls.ExtNaiveDatetime, o.isoformat().encode() )
+
+        elif isinstance(o, datetime.date):
+            return msgpack.ExtType( cls.ExtDate, o.isoformat().encode() )
+
+        return _default(o)
+
+    @classmethod
+    def _ext_hook(cls, code: int, data: bytes):
+        if code == cls.ExtNaiveDatetime:
+            return datetime.datetime.fromisoformat( data.decode() )
+
+        elif code == cls.ExtDate:
+            return datetime.date.fromisoformat( data.decode() )
+
+        return msgpack.ExtType(code, data)
+
+    def dumps(self, data: Mapping) -> bytes:
+        return msgpack.packb(data, default=self._default, datetime=True)
+
+    def loads(self, payload: bytes) -> Dict:
+        return msgpack.unpackb(payload, timestamp=3, ext_hook=self._ext_hook)
+
+
+class LegacyMsgpackCodec(MsgpackCodec):
+    """
+    Records written before the ext types, their naive datetimes and dates are strings so they are validated
+    """
+    CodecId         = 2
+    RoundTripsTypes = False
+
+
+orjson_codec         = OrjsonCodec()
+msgpack_codec        = MsgpackCodec()
+legacy_msgpack_codec = LegacyMsgpackCodec()
+
+codecs_by_id: Dict[int, RedisCodec] = {
+    orjson_codec.CodecId         : orjson_codec,
+    msgpack_codec.CodecId        : msgpack_codec,
+    legacy_msgpack_codec.CodecId : legacy_msgpack_codec
+}
+
+
+def decode(raw: bytes) -> Tuple[Dict, Optional[int], Optional[RedisCodec]]:
+    """
+    Decode a value written by any codec
+    :return: the data, the schema version and the codec, None for values stored before the codecs (plain JSON)
+    """
+    if raw[:1] in (b'{', b'['):
+        return orjson.loads(raw), None, None
+
+    codec = codecs_by_id[raw[0]]
+
+    return codec.loads(raw[2:]), raw[1], codec
@@ -74,3 +74,5 @@ class Instrument(braceletBaseModel):
     class InstrumentMerge(InstrumentFull):
         class Config:
             extra = 'forbid'
+
+    ResponseCached = True
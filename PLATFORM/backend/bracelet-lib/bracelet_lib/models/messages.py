@@ -72,6 +72,12 @@ class Message(braceletBaseModel):
         class Config:
             extra = 'forbid'
 
+    class MessageHistory(CustomBaseModel):
+        items     : List['Message.MessageFull'] = Field(..., description='Messages sorted by ts and id ascending')
+        has_more  : bool                        = Field(..., description='More messages in the requested direction')
+        before_id : Optional[int]               = Field(None, example=1, description='Cursor for the previous page')
+        after_id  : Optional[int]               = Field(None, example=50, description='Cursor for the next page')
+
     # Search schema
     _search_tpl = braceletBaseModel.create_search_schema_static(
         'MessageSearch',
@@ -86,16 +92,20 @@ class Message(braceletBaseModel):
     MergeValidator  = MessageMerge
     SearchValidator = MessageSearch
 
+    TrustedSerialization = True
+
     Table = sa.Table(
         'message',
         database_manager.get_metadata(),
         sa.Column('id', sa.INTEGER(), primary_key=True, autoincrement=True),
-        sa.Column('chat_id', sa.INTEGER(), sa.ForeignKey('chat.id', ondelete='CASCADE'), nullable=False, index=True),
+        sa.Column('chat_id', sa.INTEGER(), sa.ForeignKey('chat.id', ondelete='CASCADE'), nullable=False),
         sa.Column('sender_id', sa.INTEGER(), sa.ForeignKey('user_account.id', ondelete='SET NULL'), nullable=True, index=True),
         sa.Column('content', sa.TEXT(), nullable=False, comment="Message body"),
         sa.Column('ts', sa.TIMESTAMP(), nullable=False, comment="Time when message was sent"),
         sa.Column('create_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'), index=True),
-        sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'))
+        sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()')),
+        # Chat history in (ts, id) order, keyset pagination and last message lookups
+        sa.Index('ix_message_chat_id_ts_id', 'chat_id', 'ts', 'id')
     )
 
     id        : int      = None
@@ -160,4 +170,7 @@ class Message(braceletBaseModel):
             data,
             raise_not_found  = raise_not_found,
             with_transaction = with_transaction
-        )
\ No newline at end of file
+        )
+
+
+Message.MessageHistory.update_forward_refs(Message=Message)
@@ -8,7 +8,7 @@ from sqlalchemy.sql import Alias
 
 from . import relation
 from .common import UTCTimeStamp, AllowBaseModel, CustomBaseModel
-from ..models import database_manager
+from ..models import database_manager, search_document_column
 from ..models.base_model import braceletBaseModel
 
 
@@ -71,6 +71,8 @@ class Pathology(braceletBaseModel):
     MergeValidator  = PathologyMerge
     SearchValidator = PathologySearch
 
+    ResponseCached = True
+
     Table = sa.Table(
         'pathology',
         database_manager.get_metadata(),
@@ -80,6 +82,8 @@ class Pathology(braceletBaseModel):
         sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'))
     )
 
+    SearchDocument = search_document_column(Table)  # Unaccented name
+
     id        : int      = None
     name      : str      = None
     create_ts : datetime = None
@@ -0,0 +1,122 @@
+from datetime import datetime
+from typing import Dict, Optional, List
+from pydantic import Field
+import sqlalchemy as sa
+
+from .common import UTCTimeStamp, AllowBaseModel
+from ..models import database_manager
+from ..models.base_model import braceletBaseModel
+
+
+def get_patient_latest_vitals_schema() -> Dict:
+    return {
+        'patient_id': {
+            'ge': 1,
+            'example': 1
+        },
+        'code': {
+            'max_length': 255,
+            'example': 'P-0001'
+        },
+        'study_id': {
+            'ge': 1,
+            'example': 1
+        },
+        'step_count': {
+            'ge': 0,
+            'example': 1000
+        },
+        'bpm': {
+            'ge': 0,
+            'example': 75
+        },
+        'spo2': {
+            'ge': 0,
+            'le': 100,
+            'example': 98
+        },
+        'study_ts': {
+            'example': '2025-05-26T12:34:56Z'
+        },
+        'last_alarm_id': {
+            'ge': 1,
+            'example': 1
+        },
+        'last_alarm_type': {
+            'max_length': 64,
+            'example': 'fall_detected'
+        },
+        'last_alarm_ts': {
+            'example': '2025-05-26T12:34:56Z'
+        },
+        'last_alarm_is_urgent': {
+            'example': True
+        },
+        'update_ts': {
+            'example': '2025-05-26T12:34:56Z'
+        }
+    }
+
+patient_latest_vitals_schema = get_patient_latest_vitals_schema()
+
+
+class PatientLatestVitals(braceletBaseModel):
+    """
+    Latest study and alarm of each patient, kept by StudyCtrl and AlarmCtrl on every insert and delete so the
+    doctors' board doesn't need to look for the latest reading of every patient in the study table
+    """
+    class PatientLatestVitalsFull(AllowBaseModel):
+        patient_id           : Optional[int]      = Field(None, **patient_latest_vitals_schema['patient_id'])
+        code                 : Optional[str]      = Field(None, **patient_latest_vitals_schema['code'])
+        study_id             : Optional[int]      = Field(None, **patient_latest_vitals_schema['study_id'])
+        step_count           : Optional[int]      = Field(None, **patient_latest_vitals_schema['step_count'])
+        bpm                  : Optional[int]      = Field(None, **patient_latest_vitals_schema['bpm'])
+        spo2                 : Optional[int]      = Field(None, **patient_latest_vitals_schema['spo2'])
+        study_ts             : Optional[datetime] = Field(None, **patient_latest_vitals_schema['study_ts'])
+        last_alarm_id        : Optional[int]      = Field(None, **patient_latest_vitals_schema['last_alarm_id'])
+        last_alarm_type      : Optional[str]      = Field(None, **patient_latest_vitals_schema['last_alarm_type'])
+        last_alarm_ts        : Optional[datetime] = Field(None, **patient_latest_vitals_schema['last_alarm_ts'])
+        last_alarm_is_urgent : Optional[bool]     = Field(None, **patient_latest_vitals_schema['last_alarm_is_urgent'])
+        update_ts            : Optional[datetime] = Field(None, **patient_latest_vitals_schema['update_ts'])
+
+    class PatientLatestVitalsBoard(AllowBaseModel):
+        items : List['PatientLatestVitals.PatientLatestVitalsFull']
+
+    FullValidator  = PatientLatestVitalsFull
+    BoardValidator = PatientLatestVitalsBoard
+
+    TrustedSerialization = True
+
+    # The study and alarm ids are not foreign keys, the deletes of studies and alarms refresh the row
+    Table = sa.Table(
+        'patient_latest_vitals',
+        database_manager.get_metadata(),
+        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('study_id', sa.INTEGER(), nullable=True, comment="Latest study, by ts"),
+        sa.Column('step_count', sa.INTEGER(), nullable=True),
+        sa.Column('bpm', sa.INTEGER(), nullable=True),
+        sa.Column('spo2', sa.INTEGER(), nullable=True),
+        sa.Column('study_ts', sa.TIMESTAMP(), nullable=True),
+        sa.Column('last_alarm_id', sa.INTEGER(), nullable=True, comment="Latest alarm, by ts"),
+        sa.Column('last_alarm_type', sa.VARCHAR(64), nullable=True),
+        sa.Column('last_alarm_ts', sa.TIMESTAMP(), nullable=True),
+        sa.Column('last_alarm_is_urgent', sa.BOOLEAN(), nullable=True),
+        sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()')),
+        comment = "Latest study and alarm of each patient"
+    )
+
+    patient_id           : int      = None
+    code                 : str      = None  # From patient, only loaded by the board
+    study_id             : int      = None
+    step_count           : int      = None
+    bpm                  : int      = None
+    spo2                 : int      = None
+    study_ts             : datetime = None
+    last_alarm_id        : int      = None
+    last_alarm_type      : str      = None
+    last_alarm_ts        : datetime = None
+    last_alarm_is_urgent : bool     = None
+    update_ts            : datetime = None
+
+
+PatientLatestVitals.PatientLatestVitalsBoard.update_forward_refs(PatientLatestVitals=PatientLatestVitals)
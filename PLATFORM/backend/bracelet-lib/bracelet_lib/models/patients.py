@@ -6,7 +6,7 @@ import sqlalchemy as sa
 
 from . import relation
 from .common import UTCTimeStamp, AllowBaseModel, CustomBaseModel, StrEnum
-from ..models import database_manager
+from ..models import database_manager, search_document_column
 from ..models.base_model import braceletBaseModel
 
 
@@ -104,6 +104,8 @@ class GenderType(braceletBaseModel):
     UpdateValidator = GenderTypeUpdate
     SearchValidator = GenderTypeSearch
 
+    ResponseCached = True
+
     Table = sa.Table(
         'gender_type',
         database_manager.get_metadata(),
@@ -172,6 +174,8 @@ class Patient(braceletBaseModel):
     MergeValidator  = PatientMerge
     SearchValidator = PatientSearch
 
+    TrustedSerialization = True
+
     Table = sa.Table(
         'patient',
         database_manager.get_metadata(),
@@ -190,7 +194,8 @@ class Patient(braceletBaseModel):
             'owner_user_id',
             sa.INTEGER(),
             sa.ForeignKey('user_account.id', onupdate='CASCADE'),
-            nullable  = False
+            nullable  = False,
+            index     = True
         ),
         sa.Column(
             'patient_user_id',
@@ -203,6 +208,8 @@ class Patient(braceletBaseModel):
         sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'))
     )
 
+    SearchDocument = search_document_column(Table)  # Unaccented code
+
     id              : int      = None
     code            : str      = None
     gender          : str      = None
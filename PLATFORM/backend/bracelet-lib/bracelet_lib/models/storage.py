@@ -3,6 +3,10 @@ from typing import Optional, List
 from bracelet_lib.models.common import CustomBaseModel
 
 
+# S3 limit of parts for a multipart upload
+MAX_UPLOAD_PARTS = 10000
+
+
 class BlobOpType:
     put                = 'put'
     delete             = 'delete'
@@ -21,6 +25,8 @@ class SignedUrlRequest(CustomBaseModel):
         def valid_num_parts(cls, v):
             if v < 1:
                 raise ValueError("Parts number must be higher than 0")
+            elif v > MAX_UPLOAD_PARTS:
+                raise ValueError(f"Parts number must be lower or equal than {MAX_UPLOAD_PARTS}")
 
             return v
 
@@ -33,9 +39,23 @@ class SignedUrlRequest(CustomBaseModel):
         def valid_num_parts(cls, v):
             if v < 1:
                 raise ValueError("Parts number must be higher than 0")
+            elif v > MAX_UPLOAD_PARTS:
+                raise ValueError(f"Parts number must be lower or equal than {MAX_UPLOAD_PARTS}")
 
             return v
 
+    class UploadedPart(CustomBaseModel):
+        part_number : int                        = Field(..., ge=1, le=MAX_UPLOAD_PARTS, example=1)
+        etag        : str                        = Field(..., example='"b54357faf0632cce46e942fa68356b38"')
+
+    class CompleteMultipartRequest(CustomBaseModel):
+        reserved_id : int                        = Field(..., example=2605)
+        filename    : str                        = Field(..., example='video20220702.mp4')
+        parts       : Optional[List['SignedUrlRequest.UploadedPart']] = Field(
+            None,
+            description = 'Parts to join, all the uploaded parts are used if not set'
+        )
+
 
 class SignedUrlResponse(CustomBaseModel):
     class GetSignedUrlResponse(CustomBaseModel):
@@ -60,3 +80,21 @@ class SignedUrlResponse(CustomBaseModel):
         delete_url   : str                       = Field(..., example='https://www.aws.com/video2022.mp4')
         complete_url : Optional[str]             = Field(None, example='https://www.aws.com/video2022.mp4')
         abort_url    : Optional[str]             = Field(None, example='https://www.aws.com/video2022.mp4')
+
+    class UploadedPart(CustomBaseModel):
+        part_number  : int                       = Field(..., example=1)
+        etag         : str                       = Field(..., example='"b54357faf0632cce46e942fa68356b38"')
+        size         : int                       = Field(..., example=5242880)
+
+    class MultipartPartsResponse(CustomBaseModel):
+        upload_id    : str                       = Field(..., example='5342fsf2342ASDF2')
+        parts        : List['SignedUrlResponse.UploadedPart'] = Field(...)
+
+    class MultipartPartUrlsResponse(CustomBaseModel):
+        upload_id    : str                       = Field(..., example='5342fsf2342ASDF2')
+        first_part   : int                       = Field(..., example=1)
+        urls         : List[str]                 = Field(..., example=['https://www.aws.com/video2022.mp4'])
+
+
+SignedUrlRequest.CompleteMultipartRequest.update_forward_refs(SignedUrlRequest=SignedUrlRequest)
+SignedUrlResponse.MultipartPartsResponse.update_forward_refs(SignedUrlResponse=SignedUrlResponse)
@@ -97,17 +97,23 @@ class Study(braceletBaseModel):
     MergeValidator  = StudyMerge
     SearchValidator = StudySearch
 
+    TrustedSerialization = True
+
+    # Devices resend readings on timeouts, the retries return the stored record instead of a duplicate
+    IdempotencyColumns = ('patient_id', 'ts')
+
     Table = sa.Table(
         'study',
         database_manager.get_metadata(),
         sa.Column('id', sa.INTEGER(), primary_key=True, autoincrement=True),
-        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False, index=True),
+        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False),
         sa.Column('step_count', sa.INTEGER(), nullable=False, comment="Cumulative steps for this study"),
         sa.Column('bpm', sa.INTEGER(), nullable=False, comment="Beats per minute"),
         sa.Column('spo2', sa.INTEGER(), nullable=True, comment="Oxygen saturation %"),
         sa.Column('ts', sa.TIMESTAMP(), nullable=False, comment="Timestamp of the measurement"),
         sa.Column('create_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()'), index=True),
         sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()')),
+        sa.UniqueConstraint('patient_id', 'ts', name='uq_study_patient_ts'),  # Also used as patient_id index
     )
 
     id         : int      = None
@@ -168,3 +174,47 @@ class Study(braceletBaseModel):
             with_transaction    = with_transaction,
             ignore_rel_entities = ignore_rel_entities
         )
+
+
+class StudyDaily(braceletBaseModel):
+    """
+    Daily rollup of the studies of a patient, the raw studies older than the retention days are added to it
+    before being archived and deleted, see RetentionCtrl. The sums and counts allow merging the rows of a day
+    archived in different batches
+    """
+    Table = sa.Table(
+        'study_daily',
+        database_manager.get_metadata(),
+        sa.Column('patient_id', sa.INTEGER(), sa.ForeignKey('patient.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('day', sa.DATE(), primary_key=True),
+        sa.Column('count', sa.INTEGER(), nullable=False, comment="Studies of the day"),
+        sa.Column('first_ts', sa.TIMESTAMP(), nullable=False),
+        sa.Column('last_ts', sa.TIMESTAMP(), nullable=False),
+        sa.Column('last_step_count', sa.INTEGER(), nullable=False, comment="Steps of the day, they are cumulative"),
+        sa.Column('bpm_min', sa.INTEGER(), nullable=False),
+        sa.Column('bpm_max', sa.INTEGER(), nullable=False),
+        sa.Column('bpm_sum', sa.BIGINT(), nullable=False),
+        sa.Column('spo2_min', sa.INTEGER(), nullable=True),
+        sa.Column('spo2_max', sa.INTEGER(), nullable=True),
+        sa.Column('spo2_sum', sa.BIGINT(), nullable=False, server_default=sa.text('0')),
+        sa.Column('spo2_count', sa.INTEGER(), nullable=False, server_default=sa.text('0')),
+        sa.Column('create_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('update_ts', UTCTimeStamp(), nullable=False, server_default=sa.text('now()')),
+        comment = "Daily rollup of the archived studies"
+    )
+
+    patient_id      : int      = None
+    day             : date     = None
+    count           : int      = None
+    first_ts        : datetime = None
+    last_ts         : datetime = None
+    last_step_count : int      = None
+    bpm_min         : int      = None
+    bpm_max         : int      = None
+    bpm_sum         : int      = None
+    spo2_min        : int      = None
+    spo2_max        : int      = None
+    spo2_sum        : int      = None
+    spo2_count      : int      = None
+    create_ts       : datetime = None
+    update_ts       : datetime = None
@@ -1,13 +1,14 @@
+import asyncio
 import functools
-import hashlib
 from datetime import datetime
-from typing import Dict, Optional, List, Union
+from typing import Dict, Optional, List, Union, Sequence
 
 import sqlalchemy as sa
 from pydantic import Field, SecretStr, EmailStr
 
-from ..models import database_manager, relation
+from ..models import database_manager, relation, search_document_column
 from ..models.base_model import braceletBaseModel
+from ..controllers.password_hash import password_hash_ctrl
 from .common import CustomBaseModel, UTCTimeStamp, AllowBaseModel, StrEnum
 
 
@@ -284,6 +285,8 @@ class UserAccount(braceletBaseModel):
         sa.Index('user_account_fullname_idx', 'first_name', 'last_name')
     )
 
+    SearchDocument = search_document_column(Table)  # Unaccented email, first_name, last_name and phone
+
     id               : int      = None
     email            : str      = None
     password         : str      = None
@@ -321,7 +324,7 @@ class UserAccount(braceletBaseModel):
             ignore_rel_entities : bool = False
     ) -> 'UserAccount':
         if data.get('password'):
-            data['password'] = cls.get_password_hash(data['password'])
+            data['password'] = await cls.get_password_hash(data['password'])
         else:
             data['password'] = 'initial'
 
@@ -350,7 +353,7 @@ class UserAccount(braceletBaseModel):
         if payload_pass is None or payload_pass == masked_pass:
             data['password'] = curr_user.password
         elif payload_pass != curr_user.password:  # If is a new one we need to hash it
-            data['password'] = cls.get_password_hash(data['password'])
+            data['password'] = await cls.get_password_hash(data['password'])
 
         return await super().update_static(
             id,
@@ -360,13 +363,110 @@ class UserAccount(braceletBaseModel):
         )
 
     @classmethod
-    def get_password_hash(cls, password: str) -> str:
-        # Create entropy for password
-        text     = f'_a21_{password}_12a_'
-        hash_obj = hashlib.sha256()
-        hash_obj.update(text.encode())
+    async def _hash_passwords(cls, data_list: Sequence[Dict]) -> None:
+        """
+        Same as save_static for several rows, the hashes are computed concurrently
+        """
+        to_hash = [ data for data in data_list if data.get('password') ]
+        hashes  = await asyncio.gather(*[ cls.get_password_hash(data['password']) for data in to_hash ])
+
+        for data, password_hash in zip(to_hash, hashes):
+            data['password'] = password_hash
+
+        for data in data_list:
+            if not data.get('password'):
+                data['password'] = 'initial'
+
+    @classmethod
+    async def save_many_static(
+            cls,
+            data_list           : Sequence[Dict],
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List['UserAccount']:
+        await cls._hash_passwords(data_list)
+
+        return await super().save_many_static(
+            data_list,
+            with_transaction    = with_transaction,
+            ignore_rel_entities = ignore_rel_entities
+        )
+
+    @classmethod
+    async def update_many_static(
+            cls,
+            data_list           : Sequence[Dict],
+            raise_not_found     : bool = True,
+            with_transaction    : bool = True,
+            ignore_rel_entities : bool = False
+    ) -> List[Optional['UserAccount']]:
+        # Same rules as update_static, the current passwords are loaded with a single query
+        ids   = [ data['id'] for data in data_list if data.get('id') is not None ]
+        query = sa.select([ cls.Table.c.id, cls.Table.c.password ]).where( cls.Table.c.id.in_(ids) )
+        curr_passwords = {
+            record['id']: record['password'] for record in await database_manager.get_db_conn().fetch_all(query)
+        }
+        masked_pass = str(SecretStr('sample'))
+        to_hash     = []
+
+        for data in data_list:
+            payload_pass = data.get('password')
+            curr_pass    = curr_passwords.get( data.get('id') )
+
+            if payload_pass is None or payload_pass == masked_pass:
+                if curr_pass is None:  # Not found, update_many_static handles it
+                    data.pop('password', None)
+                else:
+                    data['password'] = curr_pass
+            elif payload_pass != curr_pass:
+                to_hash.append(data)
+
+        hashes = await asyncio.gather(*[ cls.get_password_hash(data['password']) for data in to_hash ])
+        for data, password_hash in zip(to_hash, hashes):
+            data['password'] = password_hash
+
+        return await super().update_many_static(
+            data_list,
+            raise_not_found     = raise_not_found,
+            with_transaction    = with_transaction,
+            ignore_rel_entities = ignore_rel_entities
+        )
+
+    @classmethod
+    async def upsert_many_static(
+            cls,
+            data_list        : Sequence[Dict],
+            conflict_columns : Optional[Sequence[str]] = None,
+            update_columns   : Optional[Sequence[str]] = None,
+            with_transaction : bool = True
+    ) -> List['UserAccount']:
+        await cls._hash_passwords(data_list)
+
+        return await super().upsert_many_static(
+            data_list,
+            conflict_columns = conflict_columns,
+            update_columns   = update_columns,
+            with_transaction = with_transaction
+        )
+
+    @classmethod
+    async def get_password_hash(cls, password: str) -> str:
+        return await password_hash_ctrl.hash_password(password)
 
-        return hash_obj.hexdigest()
+    @classmethod
+    async def update_password_hash(cls, id: int, password_hash: str) -> None:
+        """
+        Replace the stored hash without going through update_static, used to upgrade legacy hashes on login
+        :param id: user account id
+        :param password_hash: the already hashed password
+        """
+        query = (
+            cls.Table.update()
+            .where(cls.Table.c.id == id)
+            .values(password=password_hash)
+        )
+
+        await database_manager.get_db_conn().execute(query)
 
 
 class UserStatus(braceletBaseModel):
@@ -442,6 +542,8 @@ class UserRole(braceletBaseModel):
     UpdateValidator = UserRoleUpdate
     SearchValidator = UserRoleSearch
 
+    ResponseCached = True
+
     Table = sa.Table(
         'user_role',
         database_manager.get_metadata(),
@@ -0,0 +1,152 @@
+import datetime
+import enum
+
+import msgpack
+import orjson
+import pydantic
+import pytest
+
+from decimal import Decimal
+from typing import List, Optional
+
+from bracelet_lib.models import codecs
+from bracelet_lib.models.base_model import braceletRedisModel
+
+
+class ReadingStatus(str, enum.Enum):
+    OK    = 'ok'
+    ALARM = 'alarm'
+
+
+class ReadingFull(pydantic.BaseModel):
+    id       : int
+    naive_ts : datetime.datetime
+    aware_ts : datetime.datetime
+    day      : datetime.date
+    amount   : Decimal
+    status   : ReadingStatus
+    note     : Optional[str]
+    tags     : List[str]
+
+
+class Reading(braceletRedisModel):
+    FullValidator = ReadingFull
+    Prefix        = 'test-reading'
+    SchemaVersion = 4
+
+    id       : int               = None
+    naive_ts : datetime.datetime = None
+    aware_ts : datetime.datetime = None
+    day      : datetime.date     = None
+    amount   : 'Decimal'         = None
+    status   : ReadingStatus     = None
+    note     : Optional[str]     = None
+    tags     : List[str]         = None
+
+
+NAIVE_TS = datetime.datetime(2026, 10, 19, 8, 30, 15, 123456)
+AWARE_TS = datetime.datetime(2026, 10, 19, 10, 30, 15, 654321, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+DAY      = datetime.date(2026, 10, 19)
+
+DATA = {
+    'id'       : 7,
+    'naive_ts' : NAIVE_TS,
+    'aware_ts' : AWARE_TS,
+    'day'      : DAY,
+    'amount'   : Decimal('12.50'),
+    'status'   : ReadingStatus.ALARM,
+    'note'     : None,
+    'tags'     : ['night', 'ñandú'],
+}
+
+
+def _assert_reading(reading: Reading) -> None:
+    assert reading.id == 7
+    assert reading.naive_ts == NAIVE_TS and reading.naive_ts.tzinfo is None
+    assert reading.aware_ts == AWARE_TS and reading.aware_ts.utcoffset() is not None
+    assert reading.day == DAY and type(reading.day) is datetime.date
+    assert reading.amount == Decimal('12.50') and isinstance(reading.amount, Decimal)
+    assert reading.status is ReadingStatus.ALARM
+    assert reading.note is None
+    assert reading.tags == ['night', 'ñandú']
+
+
+def test_codec_ids_are_registered():
+    assert {codec_id: type(codec) for codec_id, codec in codecs.codecs_by_id.items()} == {
+        1: codecs.OrjsonCodec,
+        2: codecs.LegacyMsgpackCodec,
+        3: codecs.MsgpackCodec,
+    }
+
+
+def test_msgpack_codec_round_trips_the_types():
+    raw = codecs.msgpack_codec.encode(DATA, 4)
+    assert raw[:2] == bytes((3, 4))
+
+    data, schema_version, codec = codecs.decode(raw)
+    assert (schema_version, codec) == (4, codecs.msgpack_codec)
+
+    assert data['naive_ts'] == NAIVE_TS and data['naive_ts'].tzinfo is None
+    assert data['aware_ts'] == AWARE_TS  # Same instant, loaded in UTC
+    assert data['aware_ts'].utcoffset() == datetime.timedelta(0)
+    assert data['day'] == DAY and type(data['day']) is datetime.date
+
+    # Stored by value, braceletRedisModel casts them back
+    assert data['amount'] == '12.50'
+    assert data['status'] == 'alarm'
+    assert (data['note'], data['tags']) == (None, ['night', 'ñandú'])
+
+
+def test_orjson_codec_round_trips_the_values():
+    raw = codecs.orjson_codec.encode(DATA, 4)
+    assert raw[:2] == bytes((1, 4))
+
+    data, schema_version, codec = codecs.decode(raw)
+    assert (schema_version, codec) == (4, codecs.orjson_codec)
+    assert data == {
+        'id'       : 7,
+        'naive_ts' : '2026-10-19T08:30:15.123456',
+        'aware_ts' : '2026-10-19T10:30:15.654321+02:00',
+        'day'      : '2026-10-19',
+        'amount'   : '12.50',
+        'status'   : 'alarm',
+        'note'     : None,
+        'tags'     : ['night', 'ñandú'],
+    }
+
+
+def test_legacy_msgpack_payload_is_decoded():
+    # Written before the ext types, the naive datetimes and dates were stored as strings
+    legacy = {
+        **DATA,
+        'naive_ts' : NAIVE_TS.isoformat(),
+        'day'      : DAY.isoformat(),
+        'amount'   : '12.50',
+        'status'   : 'alarm',
+    }
+    raw = bytes((2, 4)) + msgpack.packb(legacy, datetime=True)
+
+    data, schema_version, codec = codecs.decode(raw)
+    assert (schema_version, codec) == (4, codecs.legacy_msgpack_codec)
+    assert not codec.RoundTripsTypes
+    assert data['naive_ts'] == NAIVE_TS.isoformat()
+    assert data['aware_ts'] == AWARE_TS
+
+    _assert_reading( Reading.from_redis(raw) )
+
+
+def test_plain_json_payload_is_decoded():
+    # Stored before the codecs, no header
+    raw = orjson.dumps(DATA, default=str)
+
+    data, schema_version, codec = codecs.decode(raw)
+    assert (schema_version, codec) == (None, None)
+    assert data['naive_ts'] == NAIVE_TS.isoformat()
+
+    _assert_reading( Reading.from_redis(raw) )
+
+
+@pytest.mark.parametrize('codec', [codecs.msgpack_codec, codecs.orjson_codec])
+@pytest.mark.parametrize('schema_version', [4, 3])
+def test_model_round_trips(codec, schema_version):
+    _assert_reading( Reading.from_redis( codec.encode(DATA, schema_version) ) )
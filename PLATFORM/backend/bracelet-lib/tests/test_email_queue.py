@@ -0,0 +1,187 @@
+import asyncio
+import contextlib
+import os
+import socket
+import time
+
+import aioredis
+import orjson
+import pytest
+
+from urllib.parse import urlparse
+from aiosmtpd.controller import Controller
+
+from bracelet_lib.cache import cache
+from bracelet_lib.controllers.email import EmailCtrl
+
+
+REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://localhost:6379/15')
+
+
+def _redis_available() -> bool:
+    url = urlparse(REDIS_URL)
+    try:
+        with socket.create_connection((url.hostname, url.port or 6379), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not _redis_available(), reason=f'Redis not available at {REDIS_URL}')
+
+
+class SmtpHandler:
+    """
+    Local SMTP server, the first `fail_first` emails are refused with a temporary error
+    """
+    def __init__(self, fail_first: int = 0):
+        self.fail_first = fail_first
+        self.received   = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.fail_first > 0:
+            self.fail_first -= 1
+            return '451 Try again later'
+
+        self.received.append(envelope)
+        return '250 OK'
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for(predicate, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'Timeout waiting for the emails queue'
+        await asyncio.sleep(0.05)
+
+
+@contextlib.asynccontextmanager
+async def email_queue(handler: SmtpHandler, retry_seconds: int = 1):
+    smtp = Controller(handler, hostname='127.0.0.1', port=_free_port())
+    smtp.start()
+
+    await cache.init(REDIS_URL)
+    await cache.conn.flushdb()
+
+    ctrl = EmailCtrl()
+    ctrl.init(
+        email_smtp_hostname  = smtp.hostname,
+        email_smtp_port      = smtp.port,
+        email_from_real_name = 'Bracelet',
+        email_from_email     = 'noreply@bracelet.test',
+        email_user_account   = None,
+        email_password       = None,
+        email_enable_ssl     = False,
+        queue_retry_seconds  = retry_seconds
+    )
+    ctrl.PollSeconds = 1
+    ctrl.start_queue_worker()
+
+    try:
+        yield ctrl
+    finally:
+        await ctrl.close()
+        await cache.conn.flushdb()
+        await cache.close()
+        smtp.stop()
+
+
+def test_queued_email_is_sent():
+    async def run():
+        handler = SmtpHandler()
+
+        async with email_queue(handler) as ctrl:
+            await ctrl.queue_email('Welcome', ['patient@bracelet.test'], body_txt='Hello')
+            await _wait_for(lambda: len(handler.received) == 1)
+
+            assert handler.received[0].rcpt_tos == ['patient@bracelet.test']
+            assert await cache.conn.llen(ctrl._processing_key) == 0
+            assert await cache.conn.llen(ctrl.QueueKey) == 0
+
+    asyncio.run(run())
+
+
+def test_failed_email_is_retried_with_backoff():
+    async def run():
+        handler = SmtpHandler(fail_first=1)
+
+        async with email_queue(handler, retry_seconds=1) as ctrl:
+            queued_at = time.time()
+            await ctrl.queue_email('Alarm', ['doctor@bracelet.test'], body_txt='Check the patient')
+
+            retries = []
+
+            async def get_retries():
+                retries[:] = await cache.conn.zrange(ctrl.RetryKey, withscores=True)
+
+            deadline = time.monotonic() + 10
+            while not retries:
+                assert time.monotonic() < deadline
+                await get_retries()
+                await asyncio.sleep(0.05)
+
+            payload, next_attempt = retries[0]
+            assert orjson.loads(payload)['attempts'] == 1
+            assert queued_at + 1 <= next_attempt <= time.time() + 1
+            assert await cache.conn.llen(ctrl._processing_key) == 0
+
+            # Moved back to the queue on the first poll after the delay
+            await _wait_for(lambda: len(handler.received) == 1)
+            assert time.time() >= next_attempt
+            assert await cache.conn.zcard(ctrl.RetryKey) == 0
+
+    asyncio.run(run())
+
+
+def test_worker_reconnects_after_losing_redis_connection():
+    async def run():
+        handler = SmtpHandler()
+
+        async with email_queue(handler) as ctrl:
+            await ctrl.queue_email('First', ['patient@bracelet.test'])
+            await _wait_for(lambda: len(handler.received) == 1)
+
+            # Kill the dedicated connection blocked in BRPOPLPUSH
+            admin = await aioredis.create_redis(REDIS_URL)
+            try:
+                clients = (await admin.execute(b'CLIENT', b'LIST')).decode().splitlines()
+                blocked = [ c for c in clients if 'cmd=brpoplpush' in c ]
+                assert blocked
+
+                for client in blocked:
+                    client_id = dict( f.split('=', 1) for f in client.split(' ') )['id']
+                    await admin.execute(b'CLIENT', b'KILL', b'ID', client_id)
+            finally:
+                admin.close()
+                await admin.wait_closed()
+
+            await ctrl.queue_email('Second', ['patient@bracelet.test'])
+            await _wait_for(lambda: len(handler.received) == 2)
+
+            assert not ctrl._worker_task.done()
+
+    asyncio.run(run())
+
+
+def test_orphan_emails_are_recovered():
+    async def run():
+        handler = SmtpHandler()
+
+        async with email_queue(handler) as ctrl:
+            # A worker that died with an email taken, its heartbeat already expired
+            orphan = orjson.dumps({
+                'id': 'orphan', 'subject': 'Orphan', 'to': ['patient@bracelet.test'], 'body_txt': 'Hello',
+                'body_html': None, 'charset': 'utf-8', 'attempts': 0
+            })
+            await cache.conn.sadd(ctrl.WorkersKey, 'dead')
+            await cache.conn.lpush(f'{ctrl.ProcessingPrefix}dead', orphan)
+
+            await _wait_for(lambda: len(handler.received) == 1)
+            assert not await cache.conn.sismember(ctrl.WorkersKey, 'dead')
+
+    asyncio.run(run())
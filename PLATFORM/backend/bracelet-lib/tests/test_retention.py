@@ -0,0 +1,205 @@
+import asyncio
+import datetime
+import io
+import os
+import socket
+
+import asyncpg
+import boto3
+import pyarrow.parquet
+import pytest
+import sqlalchemy as sa
+
+from urllib.parse import urlparse
+from moto import mock_aws
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from bracelet_lib.cache import cache
+from bracelet_lib.controllers.chats import ChatCtrl
+from bracelet_lib.controllers.patient_latest_vitals import PatientLatestVitalsCtrl
+from bracelet_lib.controllers.retention import RetentionCtrl
+from bracelet_lib.controllers.storage import blob_storage_ctrl
+from bracelet_lib.models import database_manager
+from bracelet_lib.models.alarm import Alarm
+from bracelet_lib.models.chats import Chat
+from bracelet_lib.models.messages import Message
+from bracelet_lib.models.patient_latest_vitals import PatientLatestVitals
+from bracelet_lib.models.studies import Study, StudyDaily
+
+
+DB_URL    = os.environ.get('TEST_DATABASE_URL', 'postgresql://postgres@127.0.0.1:5432/bracelet_test')
+REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://localhost:6379/15')
+BUCKET    = 'bracelet-archive-test'
+TABLES    = (Study, StudyDaily, Alarm, Chat, Message, PatientLatestVitals)
+
+
+def _available(url: str, default_port: int) -> bool:
+    url = urlparse(url)
+    try:
+        with socket.create_connection((url.hostname, url.port or default_port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+pytestmark = pytest.mark.skipif(
+    not (_available(DB_URL, 5432) and _available(REDIS_URL, 6379)),
+    reason = f'PostgreSQL ({DB_URL}) and Redis ({REDIS_URL}) are needed'
+)
+
+
+async def _create_database() -> None:
+    """
+    Empty database with the tables used by the retention job, without foreign keys so the patients, users...
+    are not needed
+    """
+    url      = urlparse(DB_URL)
+    db_name  = url.path.lstrip('/')
+    admin    = await asyncpg.connect(url._replace(path='/postgres').geturl())
+    try:
+        await admin.execute(f'DROP DATABASE IF EXISTS "{db_name}"')
+        await admin.execute(f'CREATE DATABASE "{db_name}"')
+    finally:
+        await admin.close()
+
+    database_manager.init(DB_URL)
+    await database_manager.open()
+
+    dialect = postgresql.dialect()
+    for model in TABLES:
+        create = CreateTable(model.Table, include_foreign_key_constraints=[])
+        await database_manager.get_db_conn().execute( str(create.compile(dialect=dialect)) )
+
+        for index in model.Table.indexes:
+            await database_manager.get_db_conn().execute( str(CreateIndex(index).compile(dialect=dialect)) )
+
+
+async def _insert(model, rows) -> list:
+    query = model.Table.insert().returning(model.Table.c.id)
+    return [ (await database_manager.get_db_conn().fetch_one(query.values(row)))[0] for row in rows ]
+
+
+def _aware(ts: datetime.datetime) -> datetime.datetime:
+    return ts.replace(tzinfo=datetime.timezone.utc)
+
+
+def _study(patient_id: int, ts: datetime.datetime, step_count: int, bpm: int, spo2, create_ts=None) -> dict:
+    return {
+        'patient_id' : patient_id,
+        'ts'         : ts,
+        'step_count' : step_count,
+        'bpm'        : bpm,
+        'spo2'       : spo2,
+        'create_ts'  : _aware(create_ts or ts)
+    }
+
+
+def _read_archives(s3_client, table: str) -> list:
+    rows = []
+    for obj in s3_client.list_objects_v2(Bucket=BUCKET, Prefix=f'archive/{table}/').get('Contents', []):
+        body = s3_client.get_object(Bucket=BUCKET, Key=obj['Key'])['Body'].read()
+        rows.extend( pyarrow.parquet.read_table( io.BytesIO(body) ).to_pylist() )
+
+    return rows
+
+
+@mock_aws
+def test_archive_merges_rollups_and_refreshes_latest_records():
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket=BUCKET)
+
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    day = (now - datetime.timedelta(days=40)).replace(hour=0, minute=0, second=0)
+
+    async def run():
+        await _create_database()
+        await cache.init(REDIS_URL)
+        blob_storage_ctrl.init('testing', 'testing', 'us-east-1', BUCKET)
+
+        try:
+            db_conn = database_manager.get_db_conn()
+
+            # Ordered by create_ts, with batches of 2 the day of the patient 1 is rolled up in 3 batches
+            old_ids = await _insert(Study, [
+                _study(1, day.replace(hour=8),  1000, 60, 97),
+                _study(2, day.replace(hour=9),  200,  70, None),
+                _study(2, day.replace(hour=10), 300,  80, 95),
+                _study(1, day.replace(hour=12), 4000, 90, None),
+                _study(1, day.replace(hour=20), 9000, 75, 99),
+            ])
+            # Uploaded late by the device, its reading is older but it stays until its create_ts is old too
+            late_id, = await _insert(Study, [ _study(1, day - datetime.timedelta(days=5), 100, 65, 98, now) ])
+
+            alarm_ids = await _insert(Alarm, [
+                {'patient_id': 1, 'alarm_type': 'strange_bpm', 'ts': day, 'create_ts': _aware(day)},
+                {'patient_id': 2, 'alarm_type': 'fall_detected', 'ts': day, 'create_ts': _aware(day)},
+                {'patient_id': 1, 'alarm_type': 'button_alarm', 'ts': now, 'create_ts': _aware(now)},
+            ])
+
+            chat_ids = await _insert(Chat, [
+                {'user1_id': 1, 'user2_id': 2, 'administration': False},
+                {'user1_id': 1, 'user2_id': 3, 'administration': False},
+            ])
+            await _insert(Message, [
+                {'chat_id': chat_ids[0], 'content': 'a', 'ts': day, 'create_ts': _aware(day)},
+                {'chat_id': chat_ids[0], 'content': 'b', 'ts': day.replace(hour=1), 'create_ts': _aware(day)},
+                {'chat_id': chat_ids[1], 'content': 'c', 'ts': day, 'create_ts': _aware(day)},
+            ])
+            late_message_id, = await _insert(Message, [{
+                'chat_id': chat_ids[0], 'content': 'd', 'ts': day - datetime.timedelta(days=1), 'create_ts': _aware(now)
+            }])
+
+            await PatientLatestVitalsCtrl.refresh_studies([1, 2])
+            await PatientLatestVitalsCtrl.refresh_alarms([1, 2])
+            await ChatCtrl.refresh_last_message(chat_ids)
+
+            retention = RetentionCtrl()
+            retention.init(study_days=30, alarm_days=30, message_days=30, batch_size=2)
+            await retention.run()
+
+            # Rollups merged across the batches
+            daily = {
+                record['patient_id']: dict(record)
+                for record in await db_conn.fetch_all( sa.select(StudyDaily.Table) )
+            }
+            assert daily[1]['day'] == day.date()
+            assert daily[1]['count'] == 3
+            assert daily[1]['first_ts'] == day.replace(hour=8)
+            assert daily[1]['last_ts'] == day.replace(hour=20)
+            assert daily[1]['last_step_count'] == 9000
+            assert (daily[1]['bpm_min'], daily[1]['bpm_max'], daily[1]['bpm_sum']) == (60, 90, 225)
+            assert (daily[1]['spo2_min'], daily[1]['spo2_max'], daily[1]['spo2_sum']) == (97, 99, 196)
+            assert daily[1]['spo2_count'] == 2
+            assert (daily[2]['count'], daily[2]['last_step_count'], daily[2]['spo2_count']) == (2, 300, 1)
+
+            # Only the late study is kept, the archives have all the others
+            remaining = [ record[0] for record in await db_conn.fetch_all( sa.select(Study.Table.c.id) ) ]
+            assert remaining == [late_id]
+            assert sorted( row['id'] for row in _read_archives(s3_client, 'study') ) == old_ids
+
+            # The latest vitals point to the previous study and alarm, or are empty
+            vitals = {
+                record['patient_id']: record
+                for record in await db_conn.fetch_all( sa.select(PatientLatestVitals.Table) )
+            }
+            assert vitals[1]['study_id'] == late_id
+            assert vitals[1]['step_count'] == 100
+            assert vitals[2]['study_id'] is None
+            assert vitals[1]['last_alarm_id'] == alarm_ids[2]
+            assert vitals[2]['last_alarm_id'] is None
+
+            # Same for the last message of the chats
+            chats = {
+                record['id']: record['last_message_id']
+                for record in await db_conn.fetch_all( sa.select(Chat.Table) )
+            }
+            assert chats == {chat_ids[0]: late_message_id, chat_ids[1]: None}
+            assert len( _read_archives(s3_client, 'message') ) == 3
+
+        finally:
+            await cache.conn.flushdb()
+            await cache.close()
+            await database_manager.close()
+
+    asyncio.run(run())